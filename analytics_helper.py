@@ -0,0 +1,484 @@
+"""
+In-process columnar copy of the sales data for the manager analytics views.
+
+ColumnarAnalytics loads orders, orderdetails, products, customers, employees,
+offices and productlines once into NumPy arrays (keys dictionary-encoded to
+array positions) and answers the aggregations behind
+get_employee_performance_matrix, get_consolidated_office_stats,
+get_complex_payment_report and get_productline_report with vectorized
+group-bys, without a database round trip.
+
+DatabaseHandler._invalidate forwards every write here: new orders are appended
+incrementally, any other change to the loaded tables triggers a full reload on
+the next read. NumPy is optional; without it (or with ANALYTICS_ENGINE=0) every
+method returns None and the handler runs its SQL instead.
+"""
+import threading
+from datetime import date
+from decimal import Decimal
+
+import mysql.connector
+
+from auth_helper import is_manager_title
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Tables the engine holds a copy of
+ANALYTICS_TABLES = frozenset(
+    ("offices", "employees", "customers", "orders", "orderdetails", "products", "productlines")
+)
+
+# Tables an order creation writes; such a write is applied by appending the new order
+APPEND_TABLES = frozenset(("orders", "orderdetails"))
+
+ORDER_COLUMNS = "SELECT orderNumber, customerNumber, orderDate, status FROM orders"
+LINE_COLUMNS = "SELECT orderNumber, productCode, quantityOrdered, priceEach FROM orderdetails"
+
+
+class Encoder:
+    """Maps key values to dense codes (their position in .values)."""
+
+    def __init__(self, values=()):
+        self.values = []
+        self.codes = {}
+        for value in values:
+            self.code(value)
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def get(self, value):
+        """Code of a known value, -1 otherwise."""
+        return self.codes.get(value, -1)
+
+    def __len__(self):
+        return len(self.values)
+
+
+class Columns:
+    """One loaded snapshot: dimension lookups plus the order and order line arrays."""
+
+    def __init__(self):
+        self.offices = []           # office dicts, position = office code
+        self.office_city = None     # office -> city code
+        self.cities = Encoder()
+        self.employees = []         # employee dicts, sorted by employeeNumber
+        self.employee_office = None
+        self.employee_is_rep = None
+        self.customer_codes = Encoder()
+        self.customer_rep = None    # customer -> employee position, -1 without a rep
+        self.product_codes = Encoder()
+        self.product_names = []
+        self.product_line = None    # product -> productline code
+        self.product_cost = None
+        self.productlines = Encoder()
+        self.statuses = Encoder()
+        self.order_codes = Encoder()
+        self.order_customer = None  # order -> customer code, -1 if unknown
+        self.order_day = None       # datetime64[D]
+        self.order_status = None
+        self.line_order = None      # order line -> order code
+        self.line_product = None    # order line -> product code, -1 if unknown
+        self.line_quantity = None
+        self.line_price = None
+
+    def empty_orders(self):
+        """Starts the order and line arrays empty."""
+        self.order_customer = np.zeros(0, dtype=np.int32)
+        self.order_day = np.zeros(0, dtype="datetime64[D]")
+        self.order_status = np.zeros(0, dtype=np.int32)
+        self.line_order = np.zeros(0, dtype=np.int32)
+        self.line_product = np.zeros(0, dtype=np.int32)
+        self.line_quantity = np.zeros(0, dtype=np.int64)
+        self.line_price = np.zeros(0, dtype=np.float64)
+
+    def line_revenue(self):
+        return self.line_quantity * self.line_price
+
+
+def _lookup(array, codes):
+    """array[codes] with -1 kept as -1 (unknown keys propagate instead of wrapping around)."""
+    return np.where(codes >= 0, array[np.maximum(codes, 0)], -1)
+
+
+def _flags(flags, codes):
+    """flags[codes] for a boolean array, False where the code is -1."""
+    return (codes >= 0) & flags[np.maximum(codes, 0)] if len(flags) else np.zeros(len(codes), dtype=bool)
+
+
+def _cents(amounts):
+    """Amounts rounded per line to whole cents, as int64 so sums are exact."""
+    return np.rint(amounts * 100).astype(np.int64)
+
+
+def _decimal(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+
+class ColumnarAnalytics:
+
+    def __init__(self, db, enabled=True):
+        self.db = db
+        self.enabled = enabled and np is not None
+        self._state_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._local = threading.local()
+        self._columns = None
+        self._stale = True
+        self._pending_orders = []
+        self.loads = 0
+        self.appends = 0
+
+    # --- Freshness ---
+
+    def expect_append(self, order_number):
+        """Marks this thread's next invalidation as the creation of the given order."""
+        self._local.order_number = order_number
+
+    def preload(self):
+        """Loads the snapshot now (e.g. in a server's master before it forks). True if one is held."""
+        return self._current() is not None
+
+    def expected_append(self):
+        """The order announced by expect_append for this thread's next invalidation, if any."""
+        return getattr(self._local, "order_number", None)
+
+    def invalidate(self, tables):
+        order_number = getattr(self._local, "order_number", None)
+        self._local.order_number = None
+        if not self.enabled:
+            return
+        tables = set(tables) & ANALYTICS_TABLES
+        if not tables:
+            return
+        with self._state_lock:
+            if order_number is not None and tables <= APPEND_TABLES:
+                self._pending_orders.append(order_number)
+            else:
+                self._stale = True
+
+    def _current(self):
+        """The up-to-date snapshot, loading or appending first if needed; None if unavailable."""
+        if not self.enabled:
+            return None
+        with self._load_lock:
+            with self._state_lock:
+                stale, self._stale = self._stale, False
+                pending, self._pending_orders = self._pending_orders, []
+            try:
+                if stale or self._columns is None:
+                    self._columns = self._load()
+                    self.loads += 1
+                elif pending:
+                    self._columns = self._append(self._columns, pending)
+                    self.appends += len(pending)
+            except mysql.connector.Error as err:
+                print(f"Analytics engine load failed: {err}")
+                with self._state_lock:
+                    self._stale = True
+                return None
+            return self._columns
+
+    def _rows(self, query, params=None):
+        rows = []
+        for _, chunk in self.db.stream_query(query, params, chunk_size=10000):
+            rows.extend(chunk)
+        return rows
+
+    def _load(self):
+        cols = Columns()
+
+        offices = self._rows("SELECT officeCode, city, country, territory FROM offices ORDER BY officeCode")
+        office_codes = Encoder(row[0] for row in offices)
+        cols.offices = [dict(zip(("officeCode", "city", "country", "territory"), row)) for row in offices]
+        cols.office_city = np.array([cols.cities.code(row[1]) for row in offices], dtype=np.int32)
+
+        employees = self._rows(
+            "SELECT employeeNumber, firstName, lastName, jobTitle, officeCode FROM employees ORDER BY employeeNumber"
+        )
+        employee_codes = Encoder(row[0] for row in employees)
+        cols.employees = [dict(zip(("employeeNumber", "firstName", "lastName", "jobTitle"), row)) for row in employees]
+        cols.employee_office = np.array([office_codes.get(row[4]) for row in employees], dtype=np.int32)
+        cols.employee_is_rep = np.array([row[3] == "Sales Rep" for row in employees], dtype=bool)
+
+        customers = self._rows("SELECT customerNumber, salesRepEmployeeNumber FROM customers")
+        for row in customers:
+            cols.customer_codes.code(row[0])
+        cols.customer_rep = np.array(
+            [employee_codes.get(row[1]) if row[1] is not None else -1 for row in customers], dtype=np.int32
+        )
+
+        cols.productlines = Encoder(row[0] for row in self._rows("SELECT productLine FROM productlines ORDER BY productLine"))
+        products = self._rows("SELECT productCode, productName, productLine, buyPrice FROM products")
+        for row in products:
+            cols.product_codes.code(row[0])
+        cols.product_names = [row[1] for row in products]
+        cols.product_line = np.array([cols.productlines.code(row[2]) for row in products], dtype=np.int32)
+        cols.product_cost = np.array([row[3] for row in products], dtype=np.float64)
+
+        cols.empty_orders()
+        return self._append_rows(cols, self._rows(ORDER_COLUMNS), self._rows(LINE_COLUMNS), base=cols)
+
+    def _append(self, cols, order_numbers):
+        """Adds the lines of newly created orders (skipping any the last load already has)."""
+        order_numbers = [n for n in set(order_numbers) if cols.order_codes.get(n) < 0]
+        if not order_numbers:
+            return cols
+        placeholders = ", ".join(["%s"] * len(order_numbers))
+        orders = self._rows(f"{ORDER_COLUMNS} WHERE orderNumber IN ({placeholders})", tuple(order_numbers))
+        lines = self._rows(f"{LINE_COLUMNS} WHERE orderNumber IN ({placeholders})", tuple(order_numbers))
+        return self._append_rows(cols, orders, lines, base=cols)
+
+    def _append_rows(self, cols, orders, lines, base):
+        """
+        Returns a copy of cols whose order and line arrays are base's plus the given rows.
+        Readers may still hold the previous snapshot, so nothing is modified in place.
+        """
+        new = Columns()
+        new.__dict__.update(cols.__dict__)
+        new.order_codes = Encoder(base.order_codes.values)
+        new.statuses = Encoder(base.statuses.values)
+        for row in orders:
+            new.order_codes.code(row[0])
+
+        new.order_customer = np.concatenate([base.order_customer, np.array(
+            [cols.customer_codes.get(row[1]) for row in orders], dtype=np.int32)])
+        new.order_day = np.concatenate([base.order_day, np.array(
+            [row[2] for row in orders], dtype="datetime64[D]")])
+        new.order_status = np.concatenate([base.order_status, np.array(
+            [new.statuses.code(row[3]) for row in orders], dtype=np.int32)])
+
+        new.line_order = np.concatenate([base.line_order, np.array(
+            [new.order_codes.get(row[0]) for row in lines], dtype=np.int32)])
+        new.line_product = np.concatenate([base.line_product, np.array(
+            [cols.product_codes.get(row[1]) for row in lines], dtype=np.int32)])
+        new.line_quantity = np.concatenate([base.line_quantity, np.array(
+            [row[2] for row in lines], dtype=np.int64)])
+        new.line_price = np.concatenate([base.line_price, np.array(
+            [row[3] for row in lines], dtype=np.float64)])
+        return new
+
+    # --- Aggregations (same rows as the SQL in DatabaseHandler) ---
+
+    def get_employee_performance_matrix(self, limit=10, offset=0):
+        """Revenue per (Sales Rep, product line), ordered by employeeNumber then product line."""
+        cols = self._current()
+        if cols is None:
+            return None
+        reps = _lookup(cols.customer_rep, _lookup(cols.order_customer, cols.line_order))
+        lines = _lookup(cols.product_line, cols.line_product)
+        mask = (reps >= 0) & (lines >= 0)
+        mask[mask] = cols.employee_is_rep[reps[mask]]
+
+        width = len(cols.productlines)
+        keys = reps[mask].astype(np.int64) * width + lines[mask]
+        size = len(cols.employees) * width
+        revenue = np.bincount(keys, weights=cols.line_revenue()[mask], minlength=size)
+        groups = np.flatnonzero(np.bincount(keys, minlength=size))[offset:offset + limit]
+
+        rows = []
+        for key in groups:
+            employee = cols.employees[key // width]
+            rows.append({
+                "firstName": employee["firstName"],
+                "lastName": employee["lastName"],
+                "productLine": cols.productlines.values[key % width],
+                "revenue": float(revenue[key]),
+            })
+        return rows
+
+    def get_consolidated_office_stats(self):
+        """Per-office staff, customers, orders and revenue, highest revenue first."""
+        cols = self._current()
+        if cols is None:
+            return None
+        size = len(cols.offices)
+
+        def per_office(offices):
+            return np.bincount(offices[offices >= 0], minlength=size)
+
+        customer_office = _lookup(cols.employee_office, cols.customer_rep)
+        order_office = _lookup(customer_office, cols.order_customer)
+        line_office = _lookup(order_office, cols.line_order)
+        line_mask = line_office >= 0
+
+        employees = per_office(cols.employee_office)
+        customers = per_office(customer_office)
+        orders = per_office(order_office)
+        revenue = np.bincount(line_office[line_mask], weights=cols.line_revenue()[line_mask], minlength=size)
+
+        managers = {}
+        for employee, office in zip(cols.employees, cols.employee_office):
+            if office >= 0 and office not in managers and is_manager_title(employee["jobTitle"]):
+                managers[office] = f"{employee['firstName']} {employee['lastName']}"
+
+        rows = []
+        for code, office in enumerate(cols.offices):
+            total_revenue = float(revenue[code])
+            total_orders = int(orders[code])
+            rows.append(dict(
+                office,
+                active_employees=int(employees[code]),
+                customer_count=int(customers[code]),
+                total_orders=total_orders,
+                total_revenue=total_revenue,
+                manager_name=managers.get(code, "Regional Lead"),
+                avg_ticket_size=round(total_revenue, 2) / total_orders if total_orders else 0.0,
+            ))
+        rows.sort(key=lambda row: row["total_revenue"], reverse=True)
+        return rows
+
+    def get_complex_payment_report(self, city_filter=None, year_filter=None, product_line_filter=None, limit=100):
+        """
+        Revenue and units per (office city, product), highest revenue first.
+        As with the SQL's outer joins, reps without customers, customers without
+        orders and orders without lines show up as a row without a product
+        (unless a product line is selected).
+        """
+        cols = self._current()
+        if cols is None:
+            return None
+
+        city_ok = np.array([not city_filter or city_filter.lower() in (city or "").lower()
+                            for city in cols.cities.values], dtype=bool)
+        revenue_all = cols.line_revenue()
+        global_avg = float(revenue_all.mean()) if len(revenue_all) else None
+
+        order_ok = np.ones(len(cols.order_day), dtype=bool)
+        if year_filter and year_filter.isdigit():
+            year = int(year_filter)
+            order_ok = (cols.order_day >= np.datetime64(date(year, 1, 1))) & \
+                       (cols.order_day < np.datetime64(date(year + 1, 1, 1)))
+
+        employee_city = _lookup(cols.office_city, cols.employee_office)
+        customer_city = _lookup(employee_city, cols.customer_rep)
+        order_city = _lookup(customer_city, cols.order_customer)
+        line_city = _lookup(order_city, cols.line_order)
+
+        mask = (line_city >= 0) & _flags(order_ok, cols.line_order)
+        mask &= _flags(city_ok, line_city)
+        line_product = cols.line_product
+        if product_line_filter:
+            wanted = cols.productlines.get(product_line_filter)
+            mask &= _lookup(cols.product_line, line_product) == wanted
+        # Lines of unknown products are grouped under the "no product" slot
+        products = np.where(line_product >= 0, line_product, len(cols.product_codes))
+
+        width = len(cols.product_codes) + 1
+        keys = line_city[mask].astype(np.int64) * width + products[mask]
+        size = len(cols.cities) * width
+        revenue = np.bincount(keys, weights=revenue_all[mask], minlength=size)
+        units = np.bincount(keys, weights=cols.line_quantity[mask], minlength=size)
+        present = np.bincount(keys, minlength=size) > 0
+
+        groups = {}
+        for key in np.flatnonzero(present):
+            city, product = divmod(int(key), width)
+            if product < len(cols.product_codes):
+                name = cols.product_names[product]
+                line = cols.productlines.values[cols.product_line[product]]
+            else:
+                name = line = None
+            group = groups.setdefault((city, name, line), [0.0, 0])
+            group[0] += float(revenue[key])
+            group[1] += int(units[key])
+
+        if not product_line_filter:
+            # Outer-join rows that reach no order line at all
+            valid = cols.order_customer >= 0
+            has_lines = np.zeros(len(cols.order_codes), dtype=bool)
+            has_lines[cols.line_order[cols.line_order >= 0]] = True
+            reps_with_customers = np.zeros(len(cols.employees), dtype=bool)
+            reps_with_customers[cols.customer_rep[cols.customer_rep >= 0]] = True
+
+            any_orders = np.zeros(len(cols.customer_codes), dtype=bool)
+            any_orders[cols.order_customer[valid]] = True
+            empty_cities = np.concatenate([
+                employee_city[~reps_with_customers],
+                customer_city[~any_orders],
+                order_city[order_ok & ~has_lines],
+            ])
+            for city in set(empty_cities[empty_cities >= 0].tolist()):
+                if city_ok[city]:
+                    groups.setdefault((city, None, None), [0.0, None])
+
+        rows = [{
+            "office_city": cols.cities.values[city],
+            "productName": name,
+            "productLine": line,
+            "total_revenue": total_revenue,
+            "total_units": total_units,
+            "global_avg_revenue": global_avg,
+        } for (city, name, line), (total_revenue, total_units) in groups.items()]
+        rows.sort(key=lambda row: row["total_revenue"], reverse=True)
+        return rows[:limit] if limit is not None else rows
+
+    def get_productline_report(self, start, end, status):
+        """
+        Revenue, COGS and margin per product line for orders in [start, end) with
+        the given status, with exact distinct customer and product counts.
+        None for dates numpy cannot read, leaving them to the SQL report.
+        """
+        cols = self._current()
+        if cols is None:
+            return None
+        try:
+            first, stop = np.datetime64(start, "D"), np.datetime64(end, "D")
+        except ValueError:
+            return None
+
+        wanted = cols.statuses.get(status)
+        order_ok = (cols.order_status == wanted) & (cols.order_day >= first) & (cols.order_day < stop)
+        lines = _lookup(cols.product_line, cols.line_product)
+        mask = _flags(order_ok, cols.line_order) & (lines >= 0)
+
+        line_codes = lines[mask]
+        quantity = cols.line_quantity[mask]
+        size = len(cols.productlines)
+        units = np.bincount(line_codes, weights=quantity, minlength=size)
+        revenue = np.bincount(line_codes, weights=_cents(quantity * cols.line_price[mask]), minlength=size)
+        cost = np.bincount(line_codes, weights=_cents(quantity * cols.product_cost[cols.line_product[mask]]),
+                           minlength=size)
+
+        def distinct(codes, width):
+            pairs = np.unique(line_codes.astype(np.int64) * width + codes)
+            return np.bincount(pairs // width, minlength=size)
+
+        products = distinct(cols.line_product[mask], max(len(cols.product_codes), 1))
+        customers = distinct(cols.order_customer[cols.line_order[mask]] + 1, len(cols.customer_codes) + 1)
+
+        report = []
+        for code, product_line in enumerate(cols.productlines.values):
+            total_revenue = _decimal(revenue[code])
+            total_cost = _decimal(cost[code])
+            profit = total_revenue - total_cost
+            report.append({
+                "productLine": product_line,
+                "numProducts": int(products[code]),
+                "unitsSold": int(units[code]),
+                "revenue": total_revenue,
+                "estCOGS": total_cost,
+                "estGrossProfit": profit,
+                "estGrossMargin": profit / total_revenue if total_revenue else Decimal(0),
+                "distinctCustomers": int(customers[code]),
+            })
+        report.sort(key=lambda r: r["revenue"], reverse=True)
+        return report
+
+    def stats(self):
+        cols = self._columns
+        return {
+            "enabled": self.enabled,
+            "loads": self.loads,
+            "appends": self.appends,
+            "orders": len(cols.order_codes) if cols else 0,
+            "lines": len(cols.line_order) if cols else 0,
+        }
+
@@ -1,40 +1,170 @@
-from flask import Flask
-from db_helper import DatabaseHandler
-from os import getenv
-from dotenv import load_dotenv
-
-# Import route modules
-from routes.auth import init_auth_routes
-from routes.main import init_main_routes
-from routes.cart import init_cart_routes
-from routes.orders import init_order_routes
-from routes.customer import init_customer_routes
-from routes.employee import init_employee_routes
-from routes.products import init_product_routes
-from routes.offices import init_office_routes
-
-load_dotenv()
-
-app = Flask(__name__)
-app.secret_key = "supersecretkey"
-
-# Get password from environment variable
-db_password = getenv("DB_PASSWORD")
-
-if not db_password:
-    raise ValueError("DB_PASSWORD environment variable not set. Please create a .env file.")
-
-db = DatabaseHandler(password=db_password)
-
-# Initialize all routes with the app and database instance
-init_auth_routes(app, db)
-init_main_routes(app, db)
-init_cart_routes(app, db)
-init_order_routes(app, db)
-init_customer_routes(app, db)
-init_employee_routes(app, db)
-init_product_routes(app, db)
-init_office_routes(app, db)
+import time
+from os import getenv, makedirs, path
+
+from flask import Flask, session
+from jinja2 import FileSystemBytecodeCache
+
+BASE_DIR = path.dirname(path.abspath(__file__))
+
+
+def create_app(warm=False):
+    """
+    Builds the Flask application.
+    No database connection is opened here: DatabaseHandler connects lazily,
+    once per process, so the app can be created before a pre-forking server
+    spawns its workers. Pass warm=True to connect immediately instead.
+    """
+    timings = {}
+    started = time.perf_counter()
+
+    from dotenv import load_dotenv
+    from db_helper import DatabaseHandler
+    from cache_helper import FragmentCache, FragmentCacheExtension
+    from job_helper import JobQueue, DATABASE_JOBS
+    from replica_helper import parse_replicas, STICKY_SECONDS
+
+    # Import route modules
+    from routes.auth import init_auth_routes
+    from routes.main import init_main_routes
+    from routes.cart import init_cart_routes
+    from routes.orders import init_order_routes
+    from routes.customer import init_customer_routes
+    from routes.employee import init_employee_routes
+    from routes.products import init_product_routes
+    from routes.offices import init_office_routes
+    from routes.exports import init_export_routes
+    from routes.jobs import init_job_routes
+
+    load_dotenv()
+    timings["import"] = time.perf_counter() - started
+
+    app = Flask(__name__)
+    app.secret_key = "supersecretkey"
+
+    # Get password from environment variable
+    db_password = getenv("DB_PASSWORD")
+
+    if not db_password:
+        raise ValueError("DB_PASSWORD environment variable not set. Please create a .env file.")
+
+    db = DatabaseHandler(password=db_password, replicas=parse_replicas(getenv("DB_REPLICAS")))
+    app.extensions["db"] = db
+
+    if db.replicas:
+        # Read-your-writes: after writing, a user reads from the primary for a while
+        @app.before_request
+        def route_reads():
+            db.replicas.begin(primary=session.get("primary_reads_until", 0) > time.time())
+
+        @app.after_request
+        def remember_write(response):
+            if db.replicas.end():
+                session["primary_reads_until"] = time.time() + STICKY_SECONDS
+            return response
+
+    # Point lookups are shared within a request through the handler's identity map
+    app.before_request(db.identity_map.begin)
+    app.teardown_request(db.identity_map.end)
+
+    # Writes made by other processes reach this one's caches over the invalidation bus
+    app.before_request(db.bus.poll)
+
+    # Background jobs; worker threads start with the first request of each process
+    jobs = JobQueue(db, workers=int(getenv("JOB_WORKERS", "2")),
+                    output_dir=getenv("JOB_OUTPUT_DIR"),
+                    retention_days=int(getenv("JOB_OUTPUT_RETENTION_DAYS", "7")))
+    for kind, handler in DATABASE_JOBS.items():
+        jobs.register(kind, handler)
+    app.extensions["jobs"] = jobs
+    app.before_request(jobs.ensure_started)
+
+    # Compiled templates are kept on disk so new workers skip the Jinja compiler
+    cache_dir = getenv("JINJA_CACHE_DIR", path.join(BASE_DIR, ".jinja_cache"))
+    makedirs(cache_dir, exist_ok=True)
+    app.jinja_options = {
+        **app.jinja_options,
+        "bytecode_cache": FileSystemBytecodeCache(cache_dir),
+        "extensions": [FragmentCacheExtension],
+    }
+
+    # Rendered-fragment cache for the {% cache %} blocks in templates/
+    app.jinja_env.fragment_cache = FragmentCache(db.data_versions)
+
+    # Initialize all routes with the app and database instance
+    init_auth_routes(app, db)
+    init_main_routes(app, db)
+    init_cart_routes(app, db)
+    init_order_routes(app, db)
+    init_customer_routes(app, db)
+    init_employee_routes(app, db)
+    init_product_routes(app, db)
+    init_office_routes(app, db)
+    init_export_routes(app, db)
+    init_job_routes(app, db)
+
+    phase = time.perf_counter()
+    template_count = compile_templates(app)
+    timings["templates"] = time.perf_counter() - phase
+
+    phase = time.perf_counter()
+    if warm:
+        warm_up(app)
+    timings["warmup"] = time.perf_counter() - phase
+
+    timings["total"] = time.perf_counter() - started
+    app.config["STARTUP_REPORT"] = timings
+    print("Startup: " + ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in timings.items())
+          + f" ({template_count} templates)")
+
+    return app
+
+
+def compile_templates(app):
+    """Loads every template once so the bytecode cache and Jinja's in-memory cache are filled."""
+    names = app.jinja_env.list_templates(extensions=["html"])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def warm_catalog(db):
+    """Fills the result cache with the data of the public catalog pages."""
+    db.get_all_offices()
+    for line in db.get_productlines() or []:
+        db.get_products_by_line(line["productLine"])
+
+
+def warm_up(app):
+    """
+    Readies this process before it serves traffic: opens its database
+    connection, starts its job and cache bus threads, and fills the catalog
+    caches (a no-op for whatever preload already filled and the bus kept current).
+    After a fork it also takes a new ETag token: its version counters move
+    apart from those of its siblings.
+    """
+    db = app.extensions["db"]
+    db.data_versions.renew_token()
+    db.db.ping(reconnect=True)
+    db.bus.poll()
+    app.extensions["jobs"].ensure_started()
+    warm_catalog(db)
+
+
+def preload(app):
+    """
+    Runs once in a pre-forking server's master (see serve.py): fills the
+    catalog caches, the analytics snapshot and the product search index that
+    every worker then shares copy-on-write, then closes the master's
+    connection so no worker inherits its socket.
+    """
+    db = app.extensions["db"]
+    # Changes made while loading are caught up by each worker's first poll
+    db.bus.mark_synced()
+    warm_catalog(db)
+    db.analytics.preload()
+    db.product_search.preload()
+    db.close()
+
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app(warm=True).run(debug=True)
@@ -0,0 +1,46 @@
+from flask import g, session
+
+# Job titles containing any of these count as managers (e.g. "Sales Manager (NA)", "VP Sales")
+MANAGER_TITLE_MARKERS = ("Manager", "President", "VP")
+
+
+def is_manager_title(job_title):
+    return any(marker in (job_title or "") for marker in MANAGER_TITLE_MARKERS)
+
+
+class Principal:
+    """
+    Who the logged-in user is and what they may see, resolved once and then
+    served from DatabaseHandler.principal_cache so authorization checks cost
+    no queries. The cache entry is dropped whenever employees change or customers
+    are assigned to or removed from a sales rep (see REP_ASSIGNMENTS in db_helper).
+    """
+
+    def __init__(self, user_type, number, job_title=None, office_code=None, customer_numbers=()):
+        self.user_type = user_type
+        self.number = number
+        self.job_title = job_title
+        self.office_code = office_code
+        # Customers this employee is the sales rep for
+        self.customer_numbers = frozenset(customer_numbers)
+        self.is_employee = user_type == "employee"
+        self.is_manager = self.is_employee and is_manager_title(job_title)
+        self.is_sales_rep = self.is_employee and job_title == "Sales Rep"
+
+    def can_view_customer(self, customer_number):
+        """Customers see themselves; managers see everyone; other employees see their own accounts."""
+        if self.user_type == "customer":
+            return customer_number == self.number
+        return self.is_manager or customer_number in self.customer_numbers
+
+    def __repr__(self):
+        return f"<Principal {self.user_type} {self.number} {self.job_title!r}>"
+
+
+def current_principal(db):
+    """The logged-in user's Principal (None when logged out), looked up once per request."""
+    if "principal" not in g:
+        user_type = session.get("user_type")
+        number = session.get("user_number")
+        g.principal = db.get_principal(user_type, number) if user_type and number is not None else None
+    return g.principal
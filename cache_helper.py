@@ -0,0 +1,373 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import request, session, make_response
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+
+class DataVersions:
+    """
+    Tracks a version counter and last-modified time per table.
+    Write methods in DatabaseHandler bump the tables they change, readers
+    derive cache validators from the versions without querying the database.
+    Versions are tracked in-process; the start token keeps validators from
+    one process from matching those issued by another. A forked process
+    inherits its parent's token and must call renew_token.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self.started = time.time()
+        self.renew_token()
+
+    def renew_token(self):
+        """Gives this process its own token (the pid tells apart workers forked in the same millisecond)."""
+        self.token = f"{int(time.time() * 1000):x}.{os.getpid():x}"
+
+    def bump(self, *tables):
+        """Marks the given tables as changed."""
+        now = time.time()
+        with self._lock:
+            for table in tables:
+                version, _ = self._versions.get(table, (0, self.started))
+                self._versions[table] = (version + 1, now)
+
+    def get(self, table):
+        """Returns (version, last_modified_timestamp) for a table."""
+        return self._versions.get(table, (0, self.started))
+
+    def snapshot(self, tables):
+        """Returns the version numbers of the given tables as a tuple."""
+        return tuple(self.get(table)[0] for table in tables)
+
+    def changed_within(self, tables, seconds):
+        """True if any of the given tables changed in the last `seconds` seconds."""
+        cutoff = time.time() - seconds
+        return any(self.get(table)[0] and self.get(table)[1] > cutoff for table in tables)
+
+    def last_modified(self, tables):
+        """Returns the most recent modification time across the given tables."""
+        return max(self.get(table)[1] for table in tables)
+
+
+def session_fingerprint():
+    """
+    Summarizes the session values rendered by the layout and catalog pages
+    (user, role, cart). Returns None while flashed messages are pending,
+    since those must be rendered and consumed.
+    """
+    if session.get("_flashes"):
+        return None
+    state = (
+        session.get("user_type"),
+        session.get("user_number"),
+        session.get("user_name"),
+        session.get("job_title"),
+        session.get("cart") or {},
+    )
+    return hashlib.sha1(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class ConditionalGet:
+    """
+    Strong ETag / Last-Modified validators for a page built from versioned tables.
+
+    Usage in a route:
+        cond = ConditionalGet(db.data_versions, ("products",), product_code)
+        not_modified = cond.not_modified_response()
+        if not_modified:
+            return not_modified
+        return cond.apply(render_template(...))
+    """
+
+    def __init__(self, versions, tables, *vary):
+        fingerprint = session_fingerprint()
+        self.enabled = fingerprint is not None
+
+        versions_part = ".".join(str(v) for v in versions.snapshot(tables))
+        vary_part = hashlib.sha1(repr(vary).encode()).hexdigest()[:12]
+        self.etag = f"{versions.token}-{versions_part}-{vary_part}-{fingerprint}"
+        self.last_modified = datetime.fromtimestamp(
+            int(versions.last_modified(tables)), tz=timezone.utc
+        )
+
+    def _matches(self):
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(self.etag)
+        if request.if_modified_since:
+            return self.last_modified <= request.if_modified_since
+        return False
+
+    def not_modified_response(self):
+        """Returns a 304 response if the client's copy is current, else None."""
+        if not self.enabled or not self._matches():
+            return None
+        return self.apply(make_response("", 304))
+
+    def apply(self, response):
+        """Attaches the validators to a rendered response."""
+        response = make_response(response)
+        if not self.enabled:
+            return response
+        response.set_etag(self.etag)
+        response.last_modified = self.last_modified
+        # Pages include per-user navigation, so only the browser may store them
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add("Cookie")
+        return response
+
+
+class LRUCache:
+    """
+    Thread-safe LRU store bounded both by entry count and by the approximate
+    total size of the cached values. Keeps hit/miss/eviction counters.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def sizeof(self, value):
+        """Approximate memory footprint of a value, used for the byte bound."""
+        return len(value) if isinstance(value, str) else len(repr(value))
+
+    def get(self, key):
+        """Returns the cached value or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, size)
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        """Drops one entry; the caller holds the lock."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+
+class FragmentCache(LRUCache):
+    """LRU store for rendered template fragments, keyed by the data versions they were built from."""
+
+    def __init__(self, versions, max_entries=1024, max_bytes=8 * 1024 * 1024):
+        super().__init__(max_entries, max_bytes)
+        self.versions = versions
+
+    def make_key(self, name, tables, vary):
+        return (name, tuple(tables), self.versions.snapshot(tables), repr(vary))
+
+
+class ResultCache(LRUCache):
+    """
+    LRU store for query results, each entry tagged with the tables it was read from.
+    invalidate() drops exactly the entries that depend on the changed tables.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024):
+        super().__init__(max_entries, max_bytes)
+        self._tags = {}
+        self._entry_tables = {}
+        self.invalidations = 0
+
+    def set(self, key, value, tables=()):
+        super().set(key, value)
+        with self._lock:
+            if key not in self._entries:
+                return
+            self._entry_tables[key] = tuple(tables)
+            for table in tables:
+                self._tags.setdefault(table, set()).add(key)
+
+    def _remove(self, key):
+        entry = super()._remove(key)
+        for table in self._entry_tables.pop(key, ()):
+            keys = self._tags.get(table)
+            if keys:
+                keys.discard(key)
+        return entry
+
+    def invalidate(self, tables):
+        """Drops every entry that read from any of the given tables."""
+        with self._lock:
+            for table in tables:
+                for key in list(self._tags.pop(table, ())):
+                    if self._remove(key) is not None:
+                        self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._entry_tables.clear()
+            self._size = 0
+
+    def stats(self):
+        stats = super().stats()
+        stats["invalidations"] = self.invalidations
+        return stats
+
+
+class IdentityMap:
+    """
+    Rows already loaded by primary key during the current request, per thread.
+    begin()/end() bracket a request (see create_app); outside a request the
+    map is inactive and every lookup goes to the database. Writes evict the
+    tables they touch, so a read after a write in the same request is fresh.
+    """
+
+    _MISSING = object()
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def begin(self):
+        self._local.rows = {}
+
+    def end(self, exc=None):
+        self._local.rows = None
+
+    def get(self, table, key):
+        """Returns the cached row (possibly None for a known-missing key), or IdentityMap._MISSING."""
+        rows = getattr(self._local, "rows", None)
+        if rows is None:
+            return self._MISSING
+        return rows.get((table, key), self._MISSING)
+
+    def put(self, table, key, row):
+        rows = getattr(self._local, "rows", None)
+        if rows is not None:
+            rows[(table, key)] = row
+
+    def evict(self, tables):
+        """Forgets every row of the given tables."""
+        rows = getattr(self._local, "rows", None)
+        if rows:
+            for cached in [cached for cached in rows if cached[0] in tables]:
+                del rows[cached]
+
+
+def copy_result(value):
+    """Shallow-copies query rows so callers can annotate them without touching the cached copy."""
+    if isinstance(value, list):
+        return [dict(row) if isinstance(row, dict) else row for row in value]
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+def cached_result(*tables, cache="result_cache"):
+    """
+    Caches a DatabaseHandler method's result in the handler's ResultCache
+    (handler.result_cache unless another attribute is named), keyed by
+    method name and arguments and tagged with the tables the method reads.
+    A result is only stored if none of those tables changed while it was computed,
+    nor within the handler's cache_settle_seconds (replicas may lag behind).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            store = getattr(self, cache)
+            key = (method.__name__, args, tuple(sorted(kwargs.items())))
+            cached = store.get(key)
+            if cached is not None:
+                return copy_result(cached)
+
+            versions = self.data_versions.snapshot(tables)
+            result = method(self, *args, **kwargs)
+            if (result is not None and self.data_versions.snapshot(tables) == versions
+                    and not self.data_versions.changed_within(tables, self.cache_settle_seconds)):
+                store.set(key, copy_result(result), tables)
+            return result
+        return wrapper
+    return decorator
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Jinja tag caching the rendered output of a template block:
+
+        {% cache "product_grid", ["products"], product_line, sort %}
+            ...
+        {% endcache %}
+
+    The first argument names the fragment, the second lists the tables whose
+    data versions the fragment depends on, and any further values are the
+    per-request variations (user role, cart size...). Only pass the values the
+    fragment actually renders, so entries are shared as widely as possible.
+    """
+
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        call = self.call_method("_render_cached", [nodes.List(args)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, args, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        name, tables, *vary = args
+        key = cache.make_key(name, tables, vary)
+        html = cache.get(key)
+        if html is None:
+            html = caller()
+            cache.set(key, html)
+        return html
@@ -1,17 +1,306 @@
 import mysql.connector
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
 from werkzeug.security import check_password_hash
 from decimal import Decimal
+from cache_helper import DataVersions, IdentityMap, ResultCache, cached_result
+from sketch_helper import DistinctSketch
+from auth_helper import Principal
+from analytics_helper import ColumnarAnalytics
+from invalidation_helper import InvalidationBus, transport_from_env
+from replica_helper import ReplicaPool, STICKY_SECONDS, is_plain_read
+from search_helper import ProductSearch
+
+# Tables named by a write statement (the target, plus any joined tables of a multi-table UPDATE)
+WRITE_TABLES = re.compile(
+    r"^\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+`?(\w+)`?"
+    r"|\bJOIN\s+`?(\w+)`?",
+    re.IGNORECASE
+)
+
+# Every table the ultimate analysis reports read (their cache tags)
+ULTIMATE_ANALYSIS_TABLES = (
+    "offices", "employees", "customers", "orders", "orderdetails", "products", "productlines"
+)
+
+# Not a table: bumped by the writes that change which customers a sales rep has
+# (customers.salesRepEmployeeNumber). Principals depend on it instead of on all
+# of customers, so profile edits and sign-ups leave them cached.
+REP_ASSIGNMENTS = "sales_rep_assignments"
+
+# Rows removed or changed in a table through ON DELETE / ON UPDATE foreign keys
+CASCADES = {
+    "orders": ("orderdetails",),
+    "products": ("orderdetails",),
+}
+
+# Order days affected by a write, looked up by the key the write method receives
+ORDER_DAY_QUERIES = {
+    "order": "SELECT orderDate FROM orders WHERE orderNumber = %s",
+    "product": """
+        SELECT DISTINCT o.orderDate FROM orders o
+        JOIN orderdetails od ON od.orderNumber = o.orderNumber
+        WHERE od.productCode = %s
+    """,
+}
+
+# Transactions aborted by a deadlock (1213) or a lock wait timeout (1205) are run again,
+# up to TRANSACTION_ATTEMPTS times in all (see run_transaction)
+RETRYABLE_TRANSACTION_ERRORS = {1213: "deadlocks", 1205: "lock_wait_timeouts"}
+TRANSACTION_ATTEMPTS = 5
+# Retry n waits a random 0..min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**(n-1)) seconds
+RETRY_BASE_DELAY = 0.05
+RETRY_MAX_DELAY = 1.0
+
+# Days recomputed per statement when refreshing or rebuilding productline_daily
+ROLLUP_CHUNK_DAYS = 31
+
+# Prices are compared in whole cents: buyPrice may come back as a Decimal or a float
+PRICE_CENT = Decimal("0.01")
+
+
+def same_price(a, b):
+    """True if two prices (Decimal, float or str) are equal to the cent."""
+    return Decimal(str(a)).quantize(PRICE_CENT) == Decimal(str(b)).quantize(PRICE_CENT)
+
+
+# Value of one order line as booked in customer_balances (rounded per line; priceEach is a DOUBLE)
+LINE_AMOUNT = "CAST(od.quantityOrdered * od.priceEach AS DECIMAL(14,2))"
+
+# The order an order line belongs to, locked for the rest of the transaction
+LOCK_ORDER_OF_LINE = """
+    SELECT o.orderNumber, o.customerNumber, o.status, o.orderDate
+    FROM orderdetails od
+    JOIN orders o ON o.orderNumber = od.orderNumber
+    WHERE od.orderDetailsNumber = %s
+    FOR UPDATE
+"""
+
+# Orders whose lines customers and employees may still change
+EDITABLE_ORDER_STATUSES = ("In Process",)
+
+# Status changes allowed by bulk_update_order_status: current status -> new statuses
+ORDER_STATUS_TRANSITIONS = {
+    "In Process": ("On Hold", "Shipped", "Cancelled"),
+    "On Hold": ("In Process", "Shipped", "Cancelled"),
+    "Shipped": ("Disputed", "Resolved"),
+    "Disputed": ("Shipped", "Resolved"),
+    "Resolved": (),
+    "Cancelled": (),
+}
+# Orders locked and updated per statement (and transaction) by bulk_update_order_status
+BULK_STATUS_CHUNK = 500
+
+# Report feeds: reports per page, and characters of reportContent sent in a listing
+REPORT_PAGE_SIZE = 10
+REPORT_SUMMARY_CHARS = 280
+
+# Listing columns of employee_reports; the full body is fetched with get_report
+REPORT_SUMMARY_COLUMNS = f"""
+    r.reportId, r.employeeNumber, r.reportDate,
+    LEFT(r.reportContent, {REPORT_SUMMARY_CHARS}) AS summary,
+    CHAR_LENGTH(r.reportContent) > {REPORT_SUMMARY_CHARS} AS truncated
+"""
+
+# Strictly older than the cursor in (reportDate DESC, reportId DESC) order
+REPORT_BEFORE_CURSOR = "(r.reportDate < %s OR (r.reportDate = %s AND r.reportId < %s))"
+
+
+def encode_report_cursor(report):
+    """Opaque cursor pointing after the given report, e.g. '20240105093000-812'."""
+    return f"{report['reportDate']:%Y%m%d%H%M%S}-{report['reportId']}"
+
+
+def decode_report_cursor(cursor):
+    """Parses a cursor from encode_report_cursor into (reportDate, reportId), or None if malformed."""
+    try:
+        stamp, report_id = cursor.split("-")
+        return datetime.strptime(stamp, "%Y%m%d%H%M%S"), int(report_id)
+    except (AttributeError, ValueError):
+        return None
 
 
 class DatabaseHandler:
-    def __init__(self, host="localhost", user="root", password="", database="classicmodels"):
-        self.db = mysql.connector.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=database
-        )
-        self.cursor = self.db.cursor(dictionary=True)
+    def __init__(self, host="localhost", user="root", password="", database="classicmodels", port=3306,
+                 replicas=None):
+        self.connect_args = {
+            "host": host,
+            "port": port,
+            "user": user,
+            "password": password,
+            "database": database
+        }
+        # The connection is opened lazily, once per process (see _ensure_connection)
+        self._conn = None
+        self._cursor = None
+        self._conn_pid = None
+        self._inherited = []
+        # Per-table change tracking used for HTTP validators and caches
+        self.data_versions = DataVersions()
+        # Results of the heavy report queries, dropped when a table they read changes
+        self.result_cache = ResultCache()
+        # Resolved login principals (role, office, rep's customers), see get_principal
+        self.principal_cache = ResultCache(max_entries=4096, max_bytes=16 * 1024 * 1024)
+        # Point lookups already made in the current request, keyed by (table, primary key)
+        self.identity_map = IdentityMap()
+        # Columnar copy of the sales tables for the manager analytics (needs NumPy)
+        self.analytics = ColumnarAnalytics(self, enabled=os.getenv("ANALYTICS_ENGINE", "1") != "0")
+        # Faceted index of the products for the product list
+        self.product_search = ProductSearch(self)
+        # Carries invalidations to the caches of the other processes (CACHE_BUS)
+        self.bus = InvalidationBus(transport_from_env(database), self._apply_remote_invalidation)
+        # Read replicas as (host, port) pairs; plain reads go there (see replica_helper)
+        self.replicas = ReplicaPool(replicas, self.connect_args) if replicas else None
+        # A replica may still return the old rows of a table written this recently,
+        # so results read from it are not cached until then (see cached_result)
+        self.cache_settle_seconds = STICKY_SECONDS if replicas else 0
+        # Outcomes of run_transaction per operation: committed, failed, deadlocks, lock_wait_timeouts...
+        self.transaction_metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    def _ensure_connection(self):
+        """
+        Opens the connection on first use and again in every forked child.
+        A socket inherited from the parent process must never be shared, so
+        the child keeps a reference to it (to stop it being closed under the
+        parent) and opens its own.
+        """
+        if self._conn is not None and self._conn_pid == os.getpid():
+            return
+        if self._conn is not None:
+            self._inherited.append((self._conn, self._cursor))
+        self._conn = mysql.connector.connect(**self.connect_args)
+        self._cursor = self._conn.cursor(dictionary=True)
+        self._conn_pid = os.getpid()
+
+    @property
+    def db(self):
+        self._ensure_connection()
+        return self._conn
+
+    @property
+    def cursor(self):
+        self._ensure_connection()
+        return self._cursor
+
+    def worker_handle(self):
+        """
+        A handler with its own connection that shares this one's caches, data
+        versions and analytics engine, for background threads (see job_helper).
+        """
+        handle = DatabaseHandler.__new__(DatabaseHandler)
+        handle.__dict__.update(self.__dict__)
+        handle._conn = None
+        handle._cursor = None
+        handle._conn_pid = None
+        handle._inherited = []
+        handle.replicas = self.replicas.fresh() if self.replicas else None
+        return handle
+
+    def is_connected(self):
+        """True if this process already holds its own connection."""
+        return self._conn is not None and self._conn_pid == os.getpid()
+
+    def _invalidate(self, *tables):
+        """
+        Records a committed write to the given tables: bumps their data versions
+        and drops cached results that read from them (or from cascaded tables).
+        """
+        changed = set(tables)
+        for table in tables:
+            changed.update(CASCADES.get(table, ()))
+        appended = self.analytics.expected_append()
+        self._evict(changed)
+        self.bus.publish(changed, appended)
+        if self.replicas:
+            self.replicas.note_write()
+
+    def _evict(self, changed):
+        """Drops this process's cached data for the given tables."""
+        self.data_versions.bump(*changed)
+        self.result_cache.invalidate(changed)
+        self.principal_cache.invalidate(changed)
+        self.identity_map.evict(changed)
+        self.analytics.invalidate(changed)
+        self.product_search.invalidate(changed)
+
+    def _apply_remote_invalidation(self, tables, order_number=None):
+        """Evicts a change committed by another process (called by the invalidation bus)."""
+        if order_number is not None:
+            self.analytics.expect_append(order_number)
+        self._evict(set(tables))
+
+    def run_transaction(self, name, body):
+        """
+        Runs body() as one transaction and commits it; returns body()'s result.
+        A deadlock or lock wait timeout rolls back and runs body() again after
+        a jittered, exponentially growing delay, so body() must only change the
+        database: calls like _invalidate belong after run_transaction returns.
+        Any other error, or the last retryable one, is raised after the rollback.
+        """
+        for attempt in range(1, TRANSACTION_ATTEMPTS + 1):
+            try:
+                if self.db.unread_result:
+                    self.cursor.fetchall()
+                self.db.autocommit = False
+                result = body()
+                self.db.commit()
+                self._count_transaction(name, "committed")
+                return result
+
+            except Exception as err:
+                self.db.rollback()
+                reason = None
+                if isinstance(err, mysql.connector.Error):
+                    reason = RETRYABLE_TRANSACTION_ERRORS.get(err.errno)
+                if reason is None or attempt == TRANSACTION_ATTEMPTS:
+                    self._count_transaction(name, "failed")
+                    raise
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+                self._count_transaction(name, reason, retry_wait=delay)
+                time.sleep(delay)
+
+            finally:
+                self.db.autocommit = True
+
+    def _count_transaction(self, name, outcome, retry_wait=0.0):
+        with self._metrics_lock:
+            metrics = self.transaction_metrics.setdefault(name, Counter())
+            metrics[outcome] += 1
+            if retry_wait:
+                metrics["retries"] += 1
+                metrics["retry_wait_seconds"] += retry_wait
+
+    def transaction_stats(self):
+        """Per-operation counts of committed, failed and retried transactions."""
+        with self._metrics_lock:
+            return {name: dict(metrics) for name, metrics in self.transaction_metrics.items()}
+
+    def _lookup(self, table, key, query, params):
+        """
+        Point lookup by primary key through the request's identity map:
+        the first call in a request queries, later ones are served from memory.
+        """
+        row = self.identity_map.get(table, key)
+        if row is IdentityMap._MISSING:
+            row = self.execute_query(query, params, fetchone=True)
+            self.identity_map.put(table, key, row)
+        # Callers may annotate the row, so never hand out the cached dict itself
+        return dict(row) if row else row
+
+    @staticmethod
+    def _written_tables(query):
+        """Returns the tables a write statement touches."""
+        if query.lstrip()[:6].lower() == "insert":
+            # INSERT ... SELECT only writes its target
+            match = WRITE_TABLES.match(query)
+            return [match.group(1)] if match else []
+        return [target or joined for target, joined in WRITE_TABLES.findall(query)]
 
     def get_or_create_location(self, city, state, postal_code, country):
         """Finds a locationID or creates one if it doesn't exist."""
@@ -58,18 +347,18 @@ class DatabaseHandler:
         return None
 
     def get_assigned_customers(self, employee_number,search="", sort="none"):
-        """Fetches all customers for a specific Sales Rep."""
+        """Fetches all customers for a specific Sales Rep, with their ledger balance."""
         
-        query = query = """
+        query = """
     SELECT c.customerNumber, c.customerName, l.city, l.country,
            c.salesRepEmployeeNumber,
-           IFNULL(SUM(p.amount), 0) AS totalSpend
+           IFNULL(b.totalPayments, 0) AS totalSpend,
+           IFNULL(b.totalOrders - b.totalPayments, 0) AS balance
     FROM customers c
     JOIN locations l ON c.locationID = l.locationID -- JOIN added here
-    LEFT JOIN payments p ON c.customerNumber = p.customerNumber
+    LEFT JOIN customer_balances b ON c.customerNumber = b.customerNumber
     WHERE c.salesRepEmployeeNumber = %s
       AND c.customerName LIKE %s
-    GROUP BY c.customerNumber, l.city, l.country -- Group by location fields too
     """
 
         if sort == "asc":
@@ -86,7 +375,7 @@ class DatabaseHandler:
             JOIN locations l ON c.locationID = l.locationID 
             WHERE c.customerNumber = %s
         """
-        return self.execute_query(query, (customer_number,), fetchone=True)
+        return self._lookup("customers", customer_number, query, (customer_number,))
 
     def get_customer_orders(self, customer_number, sort_by='newest'):
         """
@@ -106,7 +395,25 @@ class DatabaseHandler:
     def get_single_product(self, product_code):
         """Gets a single product by its code."""
         query = "SELECT * FROM products WHERE productCode = %s"
-        return self.execute_query(query, (product_code,), fetchone=True)
+        return self._lookup("products", product_code, query, (product_code,))
+
+    def search_products(self, vendor="", line="", scale="", sort="", limit=10, offset=0):
+        """
+        One page of the product list with its total and the vendor, line and
+        scale facet counts, from the in-memory index (see search_helper).
+        Returns None if the products could not be read.
+        """
+        return self.product_search.search({"vendor": vendor, "line": line, "scale": scale}, sort, limit, offset)
+
+    @cached_result("productlines")
+    def get_productlines(self):
+        """Product lines shown on the catalog landing page."""
+        return self.execute_query("SELECT productLine, textDescription FROM productlines")
+
+    @cached_result("products")
+    def get_products_by_line(self, product_line):
+        """Products of one product line, as listed in the catalog."""
+        return self.execute_query("SELECT * FROM products WHERE productLine = %s", (product_line,))
 
     def get_all_offices(self):
         """Fetches all office locations."""
@@ -161,29 +468,160 @@ class DatabaseHandler:
             quantity_in_stock, buy_price, msrp,
             product_code
         )
-        return self.execute_query(query, params)
 
-    
+        def change_product():
+            self.cursor.execute(
+                "SELECT productLine, buyPrice FROM products WHERE productCode = %s FOR UPDATE",
+                (product_code,)
+            )
+            old = self.cursor.fetchall()
+            self.cursor.execute(query, params)
+            result = self.cursor.rowcount
+
+            # The rollup stores COGS and product line per day, so rewrite the days this
+            # product sold on in the same transaction: the rollup never lags the product
+            repriced = bool(result and old and (old[0]["productLine"] != product_line
+                                                or not same_price(old[0]["buyPrice"], buy_price)))
+            if repriced:
+                self._rewrite_rollup_days(self._product_days([product_code]))
+            return result, repriced
+
+        try:
+            result, repriced = self.run_transaction("update_product", change_product)
+        except mysql.connector.Error as err:
+            print(f"Error: {err}")
+            return None
+
+        self._invalidate("products", *(("productline_daily",) if repriced else ()))
+        return result
+
+
+    def upsert_products(self, products):
+        """
+        Inserts or updates a chunk of products (tuples in insert_product order)
+        with one INSERT ... ON DUPLICATE KEY UPDATE. If that statement fails, the
+        products are written one at a time, so only the rows at fault are lost.
+        Returns (inserted, updated, failures), failures being [(productCode, error)].
+        """
+        def write(chunk):
+            placeholders = ", ".join(["%s"] * len(chunk))
+            self.cursor.execute(
+                f"""SELECT productCode, productLine, buyPrice FROM products
+                    WHERE productCode IN ({placeholders}) FOR UPDATE""",
+                tuple(product[0] for product in chunk)
+            )
+            # Keyed like the primary key matches: productCode compares case-insensitively
+            existing = {row["productCode"].lower(): row for row in self.cursor.fetchall()}
+            values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+            self.cursor.execute(f"""
+                INSERT INTO products (
+                    productCode, productName, productLine, productScale,
+                    productVendor, productDescription,
+                    quantityInStock, buyPrice, MSRP
+                )
+                VALUES {values}
+                ON DUPLICATE KEY UPDATE
+                    productName = VALUES(productName),
+                    productLine = VALUES(productLine),
+                    productScale = VALUES(productScale),
+                    productVendor = VALUES(productVendor),
+                    productDescription = VALUES(productDescription),
+                    quantityInStock = VALUES(quantityInStock),
+                    buyPrice = VALUES(buyPrice),
+                    MSRP = VALUES(MSRP)
+            """, tuple(value for product in chunk for value in product))
+            # Products whose line or cost changed move revenue and COGS in the rollup;
+            # their days are rewritten in this transaction, as in update_product
+            repriced = []
+            for product in chunk:
+                old = existing.get(product[0].lower())
+                if old and (old["productLine"] != product[2] or not same_price(old["buyPrice"], product[7])):
+                    repriced.append(product[0])
+            if repriced:
+                self._rewrite_rollup_days(self._product_days(repriced))
+            return len(chunk) - len(existing), len(existing), bool(repriced)
+
+        inserted = updated = 0
+        failures, repriced = [], False
+        try:
+            inserted, updated, repriced = self.run_transaction("upsert_products", lambda: write(products))
+        except mysql.connector.Error as err:
+            print(f"Error: {err}; writing the chunk one product at a time")
+            for product in products:
+                try:
+                    new, changed, moved = self.run_transaction("upsert_products", lambda: write([product]))
+                except mysql.connector.Error as row_err:
+                    failures.append((product[0], row_err.msg))
+                    continue
+                inserted += new
+                updated += changed
+                repriced = repriced or moved
+
+        if inserted or updated:
+            self._invalidate("products", *(("productline_daily",) if repriced else ()))
+        return inserted, updated, failures
+
     def delete_product(self, product_code):
         """
         Deletes a product by productCode.
         Returns the number of affected rows (0 if productCode doesn't exist).
         """
-        query = "DELETE FROM products WHERE productCode = %s"
-        return self.execute_query(query, (product_code,))
+        days = self._order_days("product", product_code)
+        try:
+            self.db.autocommit = False
+
+            # Order lines of the product go with it, so shipped totals change
+            self.cursor.execute("""
+                SELECT DISTINCT o.customerNumber
+                FROM orderdetails od
+                JOIN orders o ON o.orderNumber = od.orderNumber
+                WHERE od.productCode = %s AND o.status = 'Shipped'
+                FOR UPDATE
+            """, (product_code,))
+            customers = [row["customerNumber"] for row in self.cursor.fetchall()]
+
+            # Deleted explicitly: orderdetails has no foreign keys once partitioned (see partition_helper)
+            self.cursor.execute("DELETE FROM orderdetails WHERE productCode = %s", (product_code,))
+            self.cursor.execute("DELETE FROM products WHERE productCode = %s", (product_code,))
+            result = self.cursor.rowcount
+            for customer_number in customers:
+                self._recount_shipped_total(customer_number)
+
+            self.db.commit()
+
+        except mysql.connector.Error as err:
+            self.db.rollback()
+            print(f"Error: {err}")
+            return None
+
+        finally:
+            self.db.autocommit = True
+
+        self._invalidate("products", "orderdetails", "customer_balances")
+        if result:
+            self.refresh_productline_rollup(days)
+        return result
     
     def execute_query(self, query, params=None, fetchone=False):
         """
         Executes a given query.
         Returns: Fetched rows for SELECT or row count for INSERT/UPDATE/DELETE.
+        Plain reads go to a replica when there are replicas and none of
+        this request's data could be missing there.
         """
         try:
+            if self._use_replica(query):
+                served, result = self.replicas.read(query, params, fetchone)
+                if served:
+                    return result
+
             if params:
                 self.cursor.execute(query, params)
             else:
                 self.cursor.execute(query)
 
-            if query.strip().lower().startswith("select"):
+            # Reads return rows; this also covers queries starting with a WITH clause
+            if self.cursor.with_rows:
                 if not fetchone:
                     result = self.cursor.fetchall()
                 else:
@@ -191,16 +629,54 @@ class DatabaseHandler:
                 return result 
             else:
                 self.db.commit() 
-                return self.cursor.rowcount
+                rowcount = self.cursor.rowcount
+                self._invalidate(*self._written_tables(query))
+                return rowcount
         
         except mysql.connector.Error as err:
             print(f"Error: {err}")
             return None
 
+    def _use_replica(self, query):
+        return (self.replicas is not None
+                and not self.replicas.primary_reads
+                and not (self.is_connected() and self._conn.in_transaction)
+                and is_plain_read(query))
+
+    def stream_query(self, query, params=None, chunk_size=1000, replica=False):
+        """
+        Streams a SELECT in chunks without buffering the full result.
+        Uses a dedicated unbuffered connection so rows are read from the server
+        as they are consumed and the shared cursor stays free for other queries.
+        With replica=True the connection goes to a replica if one is available.
+        Yields (column_names, rows) pairs, rows being a list of tuples.
+        """
+        connect_args = None
+        if replica and self.replicas is not None and not self.replicas.primary_reads:
+            connect_args = self.replicas.stream_args()
+        conn = mysql.connector.connect(**(connect_args or self.connect_args))
+        cursor = conn.cursor(buffered=False)
+        try:
+            cursor.execute(query, params or ())
+            columns = cursor.column_names
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                yield columns, []
+            while rows:
+                yield columns, rows
+                rows = cursor.fetchmany(chunk_size)
+        finally:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                # Closing mid-stream (client went away) leaves unread rows behind
+                pass
+            conn.close()
+
     def get_order(self, order_number):
         """Gets a single order by its number."""
         query = "SELECT * FROM orders WHERE orderNumber = %s"
-        return self.execute_query(query, (order_number,), fetchone=True)
+        return self._lookup("orders", order_number, query, (order_number,))
 
     def get_order_details(self, order_number):
         """Gets all items (products) for a specific order."""
@@ -223,11 +699,27 @@ class DatabaseHandler:
         return self.execute_query(query, (customer_number,))
 
     def get_customer_balance(self, customer_number):
-        """Calculates total orders, payments, and balance for a customer."""
+        """Total shipped orders, payments, and balance for a customer, read from the customer_balances ledger."""
         query = """
+            SELECT totalOrders AS total_orders, totalPayments AS total_payments
+            FROM customer_balances
+            WHERE customerNumber = %s
+        """
+        rows = self.execute_query(query, (customer_number,))
+        if rows is None:
+            # Ledger unavailable (e.g. migration not applied yet): compute from the source tables
+            return self.compute_customer_balance(customer_number)
+
+        result = rows[0] if rows else {"total_orders": Decimal("0.00"), "total_payments": Decimal("0.00")}
+        result["balance"] = result["total_orders"] - result["total_payments"]
+        return result
+
+    def compute_customer_balance(self, customer_number):
+        """Calculates total orders, payments, and balance for a customer from orders and payments."""
+        query = f"""
             SELECT
                 IFNULL((
-                    SELECT SUM(od.quantityOrdered * od.priceEach)
+                    SELECT SUM({LINE_AMOUNT})
                     FROM orders o
                     JOIN orderdetails od ON o.orderNumber = od.orderNumber
                     WHERE o.customerNumber = %s
@@ -246,6 +738,110 @@ class DatabaseHandler:
         total_payments = Decimal(str(result["total_payments"]))
         result["balance"] = total_orders - total_payments
         return result
+
+    def _add_to_balance(self, customer_number, orders=0, payments=0):
+        """Adds to a customer's ledger totals inside the caller's transaction."""
+        self.cursor.execute("""
+            INSERT INTO customer_balances (customerNumber, totalOrders, totalPayments)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                totalOrders = totalOrders + VALUES(totalOrders),
+                totalPayments = totalPayments + VALUES(totalPayments)
+        """, (customer_number, orders, payments))
+
+    def _recount_shipped_total(self, customer_number):
+        """Recomputes a customer's shipped order value inside the caller's transaction."""
+        self.cursor.execute(f"""
+            INSERT INTO customer_balances (customerNumber, totalOrders)
+            SELECT %s, IFNULL(SUM({LINE_AMOUNT}), 0)
+            FROM orders o
+            JOIN orderdetails od ON od.orderNumber = o.orderNumber
+            WHERE o.customerNumber = %s AND o.status = 'Shipped'
+            ON DUPLICATE KEY UPDATE totalOrders = VALUES(totalOrders)
+        """, (customer_number, customer_number))
+
+    def _recount_shipped_totals(self, customer_numbers):
+        """_recount_shipped_total for many customers in one statement."""
+        placeholders = ", ".join(["%s"] * len(customer_numbers))
+        self.cursor.execute(f"""
+            INSERT INTO customer_balances (customerNumber, totalOrders)
+            SELECT c.customerNumber, IFNULL(SUM({LINE_AMOUNT}), 0)
+            FROM customers c
+            LEFT JOIN orders o ON o.customerNumber = c.customerNumber AND o.status = 'Shipped'
+            LEFT JOIN orderdetails od ON od.orderNumber = o.orderNumber
+            WHERE c.customerNumber IN ({placeholders})
+            GROUP BY c.customerNumber
+            ON DUPLICATE KEY UPDATE totalOrders = VALUES(totalOrders)
+        """, tuple(customer_numbers))
+
+    def _recount_payments_total(self, customer_number):
+        """Recomputes a customer's payments total inside the caller's transaction."""
+        self.cursor.execute("""
+            INSERT INTO customer_balances (customerNumber, totalPayments)
+            SELECT %s, IFNULL(SUM(amount), 0)
+            FROM payments
+            WHERE customerNumber = %s
+            ON DUPLICATE KEY UPDATE totalPayments = VALUES(totalPayments)
+        """, (customer_number, customer_number))
+
+    def reconcile_customer_balances(self, fix=True):
+        """
+        Compares customer_balances with totals recomputed from orders and payments.
+        Returns the customers whose ledger row was wrong or missing (None on error);
+        with fix=True each of them is recounted. A customer with no shipped orders
+        and no payments needs no row (new sign-ups have none until their first one).
+        """
+        query = f"""
+            SELECT
+                c.customerNumber,
+                IFNULL(shipped.total, 0) AS totalOrders,
+                IFNULL(paid.total, 0) AS totalPayments,
+                b.totalOrders AS ledgerOrders,
+                b.totalPayments AS ledgerPayments
+            FROM customers c
+            LEFT JOIN (
+                SELECT o.customerNumber, SUM({LINE_AMOUNT}) AS total
+                FROM orders o
+                JOIN orderdetails od ON od.orderNumber = o.orderNumber
+                WHERE o.status = 'Shipped'
+                GROUP BY o.customerNumber
+            ) shipped ON shipped.customerNumber = c.customerNumber
+            LEFT JOIN (
+                SELECT customerNumber, SUM(amount) AS total
+                FROM payments
+                GROUP BY customerNumber
+            ) paid ON paid.customerNumber = c.customerNumber
+            LEFT JOIN customer_balances b ON b.customerNumber = c.customerNumber
+            WHERE (b.customerNumber IS NULL AND (IFNULL(shipped.total, 0) <> 0 OR IFNULL(paid.total, 0) <> 0))
+               OR b.totalOrders <> IFNULL(shipped.total, 0)
+               OR b.totalPayments <> IFNULL(paid.total, 0)
+        """
+        mismatches = self.execute_query(query)
+        if mismatches is None or not fix:
+            return mismatches
+
+        for row in mismatches:
+            if not self.recount_customer_balance(row["customerNumber"]):
+                return None
+        return mismatches
+
+    def recount_customer_balance(self, customer_number):
+        """Rewrites one customer's ledger row from orders and payments."""
+        try:
+            self.db.autocommit = False
+            self._recount_shipped_total(customer_number)
+            self._recount_payments_total(customer_number)
+            self.db.commit()
+            self._invalidate("customer_balances")
+            return True
+
+        except mysql.connector.Error as err:
+            self.db.rollback()
+            print(f"Error recounting balance: {err}")
+            return False
+
+        finally:
+            self.db.autocommit = True
     
     def feel_lucky(self):
         query = """
@@ -299,7 +895,20 @@ class DatabaseHandler:
     def get_all_product_lines(self):
         return self.execute_query("SELECT productLine FROM productlines")
 
+    @cached_result("offices", "employees", "customers", "orders", "orderdetails", "products")
     def get_complex_payment_report(self, city_filter=None, year_filter=None, product_line_filter=None):
+        result = self.analytics.get_complex_payment_report(city_filter, year_filter, product_line_filter)
+        if result is not None:
+            return result
+        query, params = self.build_complex_payment_report_query(city_filter, year_filter, product_line_filter)
+        return self.execute_query(query, params)
+
+    def build_complex_payment_report_query(self, city_filter=None, year_filter=None,
+                                           product_line_filter=None, limit=100):
+        """
+        Builds the payment report SQL and its parameters.
+        Shared by the HTML report and the CSV/NDJSON export (which passes limit=None).
+        """
         params = []
         query = """
             SELECT 
@@ -323,8 +932,9 @@ class DatabaseHandler:
             params.append(f"%{city_filter}%")
             
         if year_filter and year_filter.isdigit():
-            query += " AND (YEAR(ord.orderDate) = %s OR ord.orderDate IS NULL)"
-            params.append(year_filter)
+            # A date range rather than YEAR(), so the index and partition pruning apply
+            query += " AND ((ord.orderDate >= %s AND ord.orderDate < %s) OR ord.orderDate IS NULL)"
+            params += [f"{int(year_filter)}-01-01", f"{int(year_filter) + 1}-01-01"]
 
         if product_line_filter:
             query += " AND p.productLine = %s"
@@ -333,10 +943,247 @@ class DatabaseHandler:
         query += """
             GROUP BY o.city, p.productName, p.productLine
             ORDER BY total_revenue DESC
-            LIMIT 100
         """
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
         
-        return self.execute_query(query, tuple(params))
+        return query, tuple(params)
+
+    @cached_result("productline_daily", "productlines", "orders", "orderdetails", "products")
+    def get_productline_report(self, start, end, status):
+        """
+        Revenue, COGS and margin per product line for orders in [start, end) with the given status.
+        Merges the productline_daily rows of the range instead of re-aggregating every order line;
+        distinct customer/product counts come from the merged sketches.
+        When the analytics engine is available it answers from its in-memory copy instead.
+        """
+        result = self.analytics.get_productline_report(start, end, status)
+        if result is not None:
+            return result
+
+        query = """
+            SELECT productLine, unitsSold, revenue, estCOGS, customerSketch, productSketch
+            FROM productline_daily
+            WHERE status = %s AND day >= %s AND day < %s
+        """
+        rows = self.execute_query(query, (status, start, end))
+        lines = self.execute_query("SELECT productLine FROM productlines")
+        if rows is None or lines is None:
+            return None
+
+        def empty():
+            return {"unitsSold": 0, "revenue": Decimal(0), "estCOGS": Decimal(0),
+                    "customers": DistinctSketch(), "products": DistinctSketch()}
+
+        totals = {line["productLine"]: empty() for line in lines}
+        for row in rows:
+            total = totals.setdefault(row["productLine"], empty())
+            total["unitsSold"] += row["unitsSold"]
+            total["revenue"] += row["revenue"]
+            total["estCOGS"] += row["estCOGS"]
+            total["customers"].merge(DistinctSketch.from_bytes(row["customerSketch"]))
+            total["products"].merge(DistinctSketch.from_bytes(row["productSketch"]))
+
+        report = []
+        for product_line, total in totals.items():
+            profit = total["revenue"] - total["estCOGS"]
+            report.append({
+                "productLine": product_line,
+                "numProducts": total["products"].count(),
+                "unitsSold": total["unitsSold"],
+                "revenue": total["revenue"],
+                "estCOGS": total["estCOGS"],
+                "estGrossProfit": profit,
+                "estGrossMargin": profit / total["revenue"] if total["revenue"] else Decimal(0),
+                "distinctCustomers": total["customers"].count(),
+            })
+        report.sort(key=lambda r: r["revenue"], reverse=True)
+        return report
+
+    def _order_days(self, by, key):
+        """Order dates touched by a write, see ORDER_DAY_QUERIES."""
+        rows = self.execute_query(ORDER_DAY_QUERIES[by], (key,))
+        return [row["orderDate"] for row in rows or []]
+
+    def refresh_productline_rollup(self, days):
+        """
+        Recomputes the productline_daily rows of the given order days from
+        orders, orderdetails and products. Called after every write that can
+        change an order's day, status or lines, or a product's cost or line.
+        It runs in its own transaction once the write has committed, so a failure
+        here leaves those days stale: it is logged with the days affected and
+        maintenance.py rebuild-rollups repairs it. Returns False if it failed.
+        (Product edits rewrite the rollup inside their own transaction instead,
+        see _rewrite_rollup_days.)
+        """
+        days = sorted({day for day in days if day is not None})
+        if not days:
+            return True
+
+        try:
+            self.db.autocommit = False
+            for i in range(0, len(days), ROLLUP_CHUNK_DAYS):
+                self._write_rollup_days(days[i:i + ROLLUP_CHUNK_DAYS])
+                self.db.commit()
+            return True
+
+        except mysql.connector.Error as err:
+            self.db.rollback()
+            print(f"ERROR: productline_daily is now out of date for {len(days)} day(s) "
+                  f"({days[0]} to {days[-1]}): {err}. "
+                  f"Run: python maintenance.py rebuild-rollups --start {days[0]} --end {days[-1] + timedelta(days=1)}")
+            return False
+
+        finally:
+            self.db.autocommit = True
+            self._invalidate("productline_daily")
+
+    def _product_days(self, product_codes):
+        """Order dates the given products sold on (inside the caller's transaction)."""
+        placeholders = ", ".join(["%s"] * len(product_codes))
+        self.cursor.execute(f"""
+            SELECT DISTINCT o.orderDate FROM orders o
+            JOIN orderdetails od ON od.orderNumber = o.orderNumber
+            WHERE od.productCode IN ({placeholders})
+        """, tuple(product_codes))
+        return [row["orderDate"] for row in self.cursor.fetchall()]
+
+    def _rewrite_rollup_days(self, days):
+        """refresh_productline_rollup inside the caller's transaction (committed or rolled back with it)."""
+        days = sorted({day for day in days if day is not None})
+        for i in range(0, len(days), ROLLUP_CHUNK_DAYS):
+            self._write_rollup_days(days[i:i + ROLLUP_CHUNK_DAYS])
+
+    def _write_rollup_days(self, days):
+        """Replaces the rollup rows of a chunk of days (inside the caller's transaction)."""
+        placeholders = ", ".join(["%s"] * len(days))
+        self.cursor.execute(f"""
+            SELECT
+                o.orderDate, o.status, pr.productLine, o.customerNumber, od.productCode,
+                SUM(od.quantityOrdered) AS unitsSold,
+                CAST(SUM(od.quantityOrdered * od.priceEach) AS DECIMAL(14,2)) AS revenue,
+                CAST(SUM(od.quantityOrdered * pr.buyPrice) AS DECIMAL(14,2)) AS estCOGS,
+                COUNT(*) AS orderLines
+            FROM orders o
+            JOIN orderdetails od ON od.orderNumber = o.orderNumber
+            JOIN products pr ON pr.productCode = od.productCode
+            WHERE o.orderDate IN ({placeholders})
+            GROUP BY o.orderDate, o.status, pr.productLine, o.customerNumber, od.productCode
+        """, tuple(days))
+
+        groups = {}
+        for row in self.cursor.fetchall():
+            key = (row["orderDate"], row["status"], row["productLine"])
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {"orderLines": 0, "unitsSold": 0, "revenue": Decimal(0),
+                                       "estCOGS": Decimal(0), "customers": DistinctSketch(),
+                                       "products": DistinctSketch()}
+            group["orderLines"] += row["orderLines"]
+            group["unitsSold"] += int(row["unitsSold"])
+            group["revenue"] += row["revenue"]
+            group["estCOGS"] += row["estCOGS"]
+            group["customers"].add(row["customerNumber"])
+            group["products"].add(row["productCode"])
+
+        self.cursor.execute(f"DELETE FROM productline_daily WHERE day IN ({placeholders})", tuple(days))
+        if groups:
+            self.cursor.executemany("""
+                INSERT INTO productline_daily
+                    (day, status, productLine, orderLines, unitsSold, revenue, estCOGS,
+                     customerSketch, productSketch)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, [
+                (day, status, product_line, g["orderLines"], g["unitsSold"], g["revenue"],
+                 g["estCOGS"], g["customers"].to_bytes(), g["products"].to_bytes())
+                for (day, status, product_line), g in groups.items()
+            ])
+
+    def rebuild_productline_rollup(self, start=None, end=None):
+        """
+        Recomputes productline_daily for every order day in [start, end)
+        (the whole table if omitted). Returns the number of days rebuilt, or None on error.
+        """
+        def where(column):
+            clauses, params = ["1=1"], []
+            if start:
+                clauses.append(f"{column} >= %s")
+                params.append(start)
+            if end:
+                clauses.append(f"{column} < %s")
+                params.append(end)
+            return " AND ".join(clauses), tuple(params)
+
+        order_where, params = where("orderDate")
+        rows = self.execute_query(f"SELECT DISTINCT orderDate FROM orders WHERE {order_where}", params)
+        if rows is None:
+            return None
+
+        # Days whose orders are all gone keep no rollup rows
+        rollup_where, params = where("day")
+        self.execute_query(f"DELETE FROM productline_daily WHERE {rollup_where}", params)
+
+        days = [row["orderDate"] for row in rows]
+        if not self.refresh_productline_rollup(days):
+            return None
+        return len(days)
+
+    def build_productline_report_query(self, start, end, status):
+        """Builds the product line performance SQL and its parameters."""
+        query = """
+        SELECT
+            pl.productLine,
+
+            COALESCE(s.numProducts, 0)        AS numProducts,
+            COALESCE(s.unitsSold, 0)          AS unitsSold,
+            COALESCE(s.revenue, 0)            AS revenue,
+            COALESCE(s.estCOGS, 0)            AS estCOGS,
+            COALESCE(s.estGrossProfit, 0)     AS estGrossProfit,
+            COALESCE(s.estGrossMargin, 0)     AS estGrossMargin,
+            COALESCE(s.distinctCustomers, 0)  AS distinctCustomers
+
+        FROM productlines pl
+
+        LEFT JOIN (
+            SELECT
+                pl2.productLine,
+
+                COUNT(DISTINCT pr.productCode) AS numProducts,
+                SUM(od.quantityOrdered) AS unitsSold,
+                SUM(od.quantityOrdered * od.priceEach) AS revenue,
+                SUM(od.quantityOrdered * pr.buyPrice) AS estCOGS,
+
+                SUM(od.quantityOrdered * od.priceEach) - SUM(od.quantityOrdered * pr.buyPrice) AS estGrossProfit,
+
+                CASE
+                WHEN SUM(od.quantityOrdered * od.priceEach) = 0 THEN 0
+                ELSE
+                    (SUM(od.quantityOrdered * od.priceEach) - SUM(od.quantityOrdered * pr.buyPrice))
+                    / SUM(od.quantityOrdered * od.priceEach)
+                END AS estGrossMargin,
+
+                COUNT(DISTINCT o.customerNumber) AS distinctCustomers
+
+            FROM productlines pl2
+            JOIN products pr
+            ON pr.productLine = pl2.productLine
+            JOIN orderdetails od
+            ON od.productCode = pr.productCode
+            JOIN orders o
+            ON o.orderNumber = od.orderNumber
+
+            WHERE o.status = %s
+            AND o.orderDate >= %s
+            AND o.orderDate <  %s
+
+            GROUP BY pl2.productLine
+        ) s
+        ON s.productLine = pl.productLine
+
+        ORDER BY revenue DESC;
+    """
+        return query, (status, start, end)
 
     def create_customer_auth(self, customer_number, hashed_password):
         """Inserts a new password record into 'customer_auth'."""
@@ -353,38 +1200,192 @@ class DatabaseHandler:
         query = "INSERT INTO employee_reports (employeeNumber, reportContent) VALUES (%s, %s)"
         return self.execute_query(query, (employee_number, content))
 
-    def get_employee_reports(self, employee_number):
-        """Fetches all reports submitted by a specific employee."""
-        query = "SELECT * FROM employee_reports WHERE employeeNumber = %s ORDER BY reportDate DESC"
-        return self.execute_query(query, (employee_number,))
+    def get_employee_reports(self, employee_number, cursor=None, limit=REPORT_PAGE_SIZE):
+        """
+        One page of an employee's reports, newest first, with content cut to a summary.
+        Pass the previous page's next_cursor to continue; see _report_page.
+        """
+        query = f"""
+            SELECT {REPORT_SUMMARY_COLUMNS}
+            FROM employee_reports r
+            WHERE r.employeeNumber = %s {{before}}
+            ORDER BY r.reportDate DESC, r.reportId DESC
+            LIMIT %s
+        """
+        return self._report_page(query, (employee_number,), cursor, limit)
 
-    def get_subordinate_reports(self, manager_number):
+    def get_subordinate_reports(self, manager_number, direct_only=False, cursor=None, limit=REPORT_PAGE_SIZE):
+        """
+        One page of the reports written by everyone below the manager in the org chart
+        (only direct reports with direct_only=True), newest first, with content cut to a summary.
+        One lookup on employee_closure selects the whole subtree.
+        """
+        depth_filter = "c.depth = 1" if direct_only else "c.depth > 0"
+        query = f"""
+            SELECT {REPORT_SUMMARY_COLUMNS}, e.firstName, e.lastName, e.jobTitle, c.depth
+            FROM employee_closure c
+            JOIN employee_reports r ON r.employeeNumber = c.descendantNumber
+            JOIN employees e ON e.employeeNumber = c.descendantNumber
+            WHERE c.ancestorNumber = %s AND {depth_filter} {{before}}
+            ORDER BY r.reportDate DESC, r.reportId DESC
+            LIMIT %s
+        """
+        return self._report_page(query, (manager_number,), cursor, limit)
+
+    def _report_page(self, query, params, cursor, limit):
+        """
+        Runs a report listing with keyset pagination on (reportDate, reportId).
+        The query has a {before} placeholder for the cursor condition and ends in LIMIT %s.
+        Returns {"reports": [...], "next_cursor": str or None}, or None on error
+        (also for a malformed cursor). Reads one extra row to know whether another page exists.
+        """
+        before = ""
+        if cursor:
+            position = decode_report_cursor(cursor)
+            if position is None:
+                print(f"Invalid report cursor: {cursor!r}")
+                return None
+            report_date, report_id = position
+            before = f"AND {REPORT_BEFORE_CURSOR}"
+            params += (report_date, report_date, report_id)
+
+        rows = self.execute_query(query.format(before=before), params + (limit + 1,))
+        if rows is None:
+            return None
+        for row in rows:
+            row["truncated"] = bool(row["truncated"])
+        next_cursor = encode_report_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return {"reports": rows[:limit], "next_cursor": next_cursor}
+
+    def get_report(self, report_id):
+        """Fetches a single report with its full content and author."""
         query = """
             SELECT r.*, e.firstName, e.lastName, e.jobTitle
             FROM employee_reports r
-            JOIN employees e ON r.employeeNumber = e.employeeNumber
-            WHERE r.employeeNumber IN (
-                SELECT employeeNumber 
-                FROM employees 
-                WHERE reportsTo = %s
-            )
-            ORDER BY r.reportDate DESC
+            JOIN employees e ON e.employeeNumber = r.employeeNumber
+            WHERE r.reportId = %s
         """
-        return self.execute_query(query, (manager_number,))
+        return self.execute_query(query, (report_id,), fetchone=True)
+
+    def get_org_descendants(self, employee_number):
+        """Everyone below the employee in the org chart, nearest levels first, with their depth."""
+        query = """
+            SELECT e.*, c.depth
+            FROM employee_closure c
+            JOIN employees e ON e.employeeNumber = c.descendantNumber
+            WHERE c.ancestorNumber = %s AND c.depth > 0
+            ORDER BY c.depth, e.lastName, e.firstName
+        """
+        return self.execute_query(query, (employee_number,))
+
+    def get_org_ancestors(self, employee_number):
+        """The employee's management chain, from the direct manager up to the top."""
+        query = """
+            SELECT e.*, c.depth
+            FROM employee_closure c
+            JOIN employees e ON e.employeeNumber = c.ancestorNumber
+            WHERE c.descendantNumber = %s AND c.depth > 0
+            ORDER BY c.depth
+        """
+        return self.execute_query(query, (employee_number,))
+
+    def rebuild_employee_closure(self):
+        """Recomputes employee_closure from employees.reportsTo. Returns the number of rows, or None on error."""
+        try:
+            self.db.autocommit = False
+            self.cursor.execute("DELETE FROM employee_closure")
+            self.cursor.execute("""
+                INSERT INTO employee_closure (ancestorNumber, descendantNumber, depth)
+                WITH RECURSIVE chain AS (
+                    SELECT employeeNumber AS ancestorNumber, employeeNumber AS descendantNumber, 0 AS depth
+                    FROM employees
+                    UNION ALL
+                    SELECT chain.ancestorNumber, e.employeeNumber, chain.depth + 1
+                    FROM chain
+                    JOIN employees e ON e.reportsTo = chain.descendantNumber
+                )
+                SELECT ancestorNumber, descendantNumber, depth FROM chain
+            """)
+            rows = self.cursor.rowcount
+            self.db.commit()
+            self._invalidate("employee_closure")
+            return rows
+
+        except mysql.connector.Error as err:
+            self.db.rollback()
+            print(f"Error rebuilding org chart: {err}")
+            return None
+
+        finally:
+            self.db.autocommit = True
+
+    def is_in_org(self, manager_number, employee_number):
+        """True if the employee is somewhere below the manager in the org chart."""
+        query = """
+            SELECT 1 AS found FROM employee_closure
+            WHERE ancestorNumber = %s AND descendantNumber = %s AND depth > 0
+        """
+        return bool(self.execute_query(query, (manager_number, employee_number)))
+
+    @cached_result("employees", REP_ASSIGNMENTS, cache="principal_cache")
+    def get_principal(self, user_type, user_number):
+        """
+        Resolves the Principal for a logged-in user: role, office, manager status
+        and, for employees, the customers they are the sales rep for.
+        Cached until the employees table or a rep's customer assignments change.
+        """
+        if user_type == "customer":
+            return Principal("customer", user_number)
+        if user_type != "employee":
+            return None
+
+        employee = self.execute_query(
+            "SELECT jobTitle, officeCode FROM employees WHERE employeeNumber = %s",
+            (user_number,), fetchone=True
+        )
+        if not employee:
+            return None
+        customers = self.execute_query(
+            "SELECT customerNumber FROM customers WHERE salesRepEmployeeNumber = %s",
+            (user_number,)
+        ) or []
+        return Principal(
+            "employee", user_number,
+            job_title=employee["jobTitle"],
+            office_code=employee["officeCode"],
+            customer_numbers=[row["customerNumber"] for row in customers]
+        )
 
     def get_employee_details(self, employee_number):
         """Fetches full details for a specific employee."""
         query = "SELECT * FROM employees WHERE employeeNumber = %s"
-        return self.execute_query(query, (employee_number,), fetchone=True)
+        return self._lookup("employees", employee_number, query, (employee_number,))
+
+    def get_subordinates(self, manager_number, indirect=False):
+        """
+        Fetches all employees who report to the given manager, including office city.
+        With indirect=True the whole subtree is returned (via employee_closure),
+        nearest levels first, with each employee's depth and direct manager.
+        """
+        if not indirect:
+            query = """
+                SELECT e.employeeNumber, e.firstName, e.lastName, e.email, e.jobTitle, o.city
+                FROM employees e
+                JOIN offices o ON e.officeCode = o.officeCode
+                WHERE e.reportsTo = %s
+                ORDER BY e.lastName, e.firstName
+            """
+            return self.execute_query(query, (manager_number,))
 
-    def get_subordinates(self, manager_number):
-        """Fetches all employees who report to the given manager, including office city."""
         query = """
-            SELECT e.employeeNumber, e.firstName, e.lastName, e.email, e.jobTitle, o.city
-            FROM employees e
+            SELECT e.employeeNumber, e.firstName, e.lastName, e.email, e.jobTitle, o.city,
+                   c.depth, CONCAT(m.firstName, ' ', m.lastName) AS managerName
+            FROM employee_closure c
+            JOIN employees e ON e.employeeNumber = c.descendantNumber
             JOIN offices o ON e.officeCode = o.officeCode
-            WHERE e.reportsTo = %s
-            ORDER BY e.lastName, e.firstName
+            LEFT JOIN employees m ON m.employeeNumber = e.reportsTo
+            WHERE c.ancestorNumber = %s AND c.depth > 0
+            ORDER BY c.depth, e.lastName, e.firstName
         """
         return self.execute_query(query, (manager_number,))
     
@@ -416,80 +1417,76 @@ class DatabaseHandler:
         Fires a Sales Rep and reassigns their customers to another Rep in the same office.
         Returns (Success: bool, Message: str).
         """
-        try:
-            # 1. Validate Employee
-            emp = self.get_employee_details(employee_id)
-            if not emp:
-                return False, "Employee not found."
-            if emp['jobTitle'] != 'Sales Rep':
-                return False, "Cannot fire: Employee is not a Sales Rep."
-
-            office_code = emp['officeCode']
-
-            # 2. Find replacement Reps in the same office
-            query_others = """
-                SELECT employeeNumber FROM employees 
-                WHERE jobTitle = 'Sales Rep' 
-                AND officeCode = %s 
-                AND employeeNumber != %s
-            """
-            others = self.execute_query(query_others, (office_code, employee_id))
-            
-            if not others:
-                return False, "Cannot fire: Only one Sales Rep in this office."
+        # 1. Validate Employee
+        emp = self.get_employee_details(employee_id)
+        if not emp:
+            return False, "Employee not found."
+        if emp['jobTitle'] != 'Sales Rep':
+            return False, "Cannot fire: Employee is not a Sales Rep."
 
-            # Pick the first available replacement
-            new_rep_id = others[0]['employeeNumber']
+        office_code = emp['officeCode']
 
-            # 3. Start Transaction
-            if self.db.is_connected():
-                self.cursor.fetchall() # Clear any unread results
-            self.db.autocommit = False
+        # 2. Find replacement Reps in the same office
+        query_others = """
+            SELECT employeeNumber FROM employees 
+            WHERE jobTitle = 'Sales Rep' 
+            AND officeCode = %s 
+            AND employeeNumber != %s
+        """
+        others = self.execute_query(query_others, (office_code, employee_id))
+
+        if not others:
+            return False, "Cannot fire: Only one Sales Rep in this office."
+
+        # Pick the first available replacement
+        new_rep_id = others[0]['employeeNumber']
 
-            # 4. Reassign Customers
+        def fire():
+            # 3. Reassign Customers
             query_reassign = "UPDATE customers SET salesRepEmployeeNumber = %s WHERE salesRepEmployeeNumber = %s"
             self.cursor.execute(query_reassign, (new_rep_id, employee_id))
 
+            # 4. Detach the employee from the org chart. Anyone reporting to them
+            # becomes a root (reportsTo is ON DELETE SET NULL), so every path through them goes.
+            self.cursor.execute("""
+                DELETE link FROM employee_closure link
+                JOIN employee_closure up
+                    ON up.ancestorNumber = link.ancestorNumber AND up.descendantNumber = %s
+                JOIN employee_closure down
+                    ON down.descendantNumber = link.descendantNumber AND down.ancestorNumber = %s
+            """, (employee_id, employee_id))
+
             # 5. Delete Employee Records
             self.cursor.execute("DELETE FROM employee_auth WHERE employeeNumber = %s", (employee_id,))
             self.cursor.execute("DELETE FROM employee_reports WHERE employeeNumber = %s", (employee_id,))
             self.cursor.execute("DELETE FROM employees WHERE employeeNumber = %s", (employee_id,))
 
-            self.db.commit()
-            return True, f"Employee fired. Customers reassigned to Rep #{new_rep_id}."
-
+        try:
+            self.run_transaction("fire_sales_rep", fire)
         except mysql.connector.Error as err:
-            self.db.rollback()
             print(f"Error firing employee: {err}")
             return False, f"Database error: {err}"
-        finally:
-            self.db.autocommit = True
+
+        self._invalidate("customers", "employee_auth", "employee_reports", "employee_closure", "employees",
+                         REP_ASSIGNMENTS)
+        return True, f"Employee fired. Customers reassigned to Rep #{new_rep_id}."
 
     def delete_customer_transaction(self, customer_number):
         """
         Deletes a customer and all associated data (orders, payments, auth) atomically.
-        Manages autocommit manually to prevent 'Transaction already in progress' errors.
         """
-        try:
-            # Ensure no unread results exist on the connection
-            if self.db.is_connected():
-                self.cursor.fetchall() 
-            
-            # Disable autocommit to start a manual transaction block
-            self.db.autocommit = False
-
+        def delete_customer():
             # --- CASCADE DELETE OPERATIONS ---
 
             # 1. Fetch customer's orders to target OrderDetails
-            query_get_orders = "SELECT orderNumber FROM orders WHERE customerNumber = %s"
+            query_get_orders = "SELECT orderNumber, orderDate FROM orders WHERE customerNumber = %s"
             self.cursor.execute(query_get_orders, (customer_number,))
             orders = self.cursor.fetchall()
 
             # 2. Delete OrderDetails for each order
-            if orders:
-                for order in orders:
-                    query_del_details = "DELETE FROM orderdetails WHERE orderNumber = %s"
-                    self.cursor.execute(query_del_details, (order['orderNumber'],))
+            for order in orders:
+                query_del_details = "DELETE FROM orderdetails WHERE orderNumber = %s"
+                self.cursor.execute(query_del_details, (order['orderNumber'],))
 
             # 3. Delete Orders
             query_delete_orders = "DELETE FROM orders WHERE customerNumber = %s"
@@ -503,23 +1500,25 @@ class DatabaseHandler:
             query_delete_auth = "DELETE FROM customer_auth WHERE customerNumber = %s"
             self.cursor.execute(query_delete_auth, (customer_number,))
 
-            # 6. Delete Customer Profile
+            # 6. Delete the balance ledger row
+            self.cursor.execute("DELETE FROM customer_balances WHERE customerNumber = %s", (customer_number,))
+
+            # 7. Delete Customer Profile
             query_delete_customer = "DELETE FROM customers WHERE customerNumber = %s"
             self.cursor.execute(query_delete_customer, (customer_number,))
+            return orders
 
-            # --- COMMIT TRANSACTION ---
-            self.db.commit()
-            print(f"SUCCESS: Customer {customer_number} deleted completely.")
-            return True
-
+        try:
+            orders = self.run_transaction("delete_customer", delete_customer)
         except mysql.connector.Error as err:
             print(f"Error deleting account: {err}")
-            self.db.rollback()
             return False
-            
-        finally:
-            # Restore autocommit to default state for subsequent operations
-            self.db.autocommit = True
+
+        self._invalidate("orderdetails", "orders", "payments", "customer_auth", "customer_balances", "customers",
+                         REP_ASSIGNMENTS)
+        print(f"SUCCESS: Customer {customer_number} deleted completely.")
+        self.refresh_productline_rollup(order["orderDate"] for order in orders)
+        return True
 
     def update_customer_profile(self, customer_number, first_name, last_name, phone, address, city, country):
         # 1. Resolve the location first
@@ -538,6 +1537,7 @@ class DatabaseHandler:
         params = (first_name, last_name, phone, address, loc_id, customer_number)
         return self.execute_query(query, params)
 
+    @cached_result("offices", "employees")
     def get_all_offices(self):
         """
         Fetches all offices. 
@@ -554,7 +1554,7 @@ class DatabaseHandler:
     def get_office_by_code(self, office_code):
         """Fetches a single office by code."""
         query = "SELECT * FROM offices WHERE officeCode = %s"
-        return self.execute_query(query, (office_code,), fetchone=True)
+        return self._lookup("offices", office_code, query, (office_code,))
 
     def insert_office(self, office_data):
         """
@@ -620,101 +1620,124 @@ class DatabaseHandler:
         return self.execute_query(query,(product_line,))
 
 
-    def delete_order_item(self, detail_id):
-        """Removes a single line item from an order."""
-        query = "DELETE FROM orderdetails WHERE orderDetailsNumber = %s"
-        return self.execute_query(query, (detail_id,))
+    def delete_order_item(self, detail_id, expected_version=None, statuses=None, principal=None):
+        """
+        Removes a single line item from an order. With expected_version,
+        statuses or principal the order must still match them (see _order_guard).
+        Returns (row count, orderNumber of the line): (0, None) when it does not
+        match, (None, None) on error.
+        """
+        def delete_line():
+            if not self._claim_order_of_line(detail_id, expected_version, statuses, principal):
+                return [], 0
+            self.cursor.execute(LOCK_ORDER_OF_LINE, (detail_id,))
+            orders = self.cursor.fetchall()
+
+            self.cursor.execute("DELETE FROM orderdetails WHERE orderDetailsNumber = %s", (detail_id,))
+            result = self.cursor.rowcount
+            if orders and orders[0]["status"] == "Shipped":
+                self._recount_shipped_total(orders[0]["customerNumber"])
+            return orders, result
+
+        try:
+            orders, result = self.run_transaction("delete_order_item", delete_line)
+        except mysql.connector.Error as err:
+            print(f"Error: {err}")
+            return None, None
+
+        if result:
+            self._invalidate("orders", "orderdetails", "customer_balances")
+            self.refresh_productline_rollup(order["orderDate"] for order in orders)
+        return result, orders[0]["orderNumber"] if result and orders else None
 
     def get_order_detail_by_id(self, detail_id):
         """Fetches a single order detail row. Needed for security checks."""
         query = "SELECT * FROM orderdetails WHERE orderDetailsNumber = %s"
-        return self.execute_query(query, (detail_id,), fetchone=True)
+        return self._lookup("orderdetails", detail_id, query, (detail_id,))
+
+    def _claim_check_number(self, check_number):
+        """
+        Raises IntegrityError if a payment already uses the check number.
+        The locking read also blocks concurrent inserts of the same number until
+        commit; needed because a partitioned payments table only keeps
+        (checkNumber, paymentDate) unique. Runs inside the caller's transaction.
+        """
+        self.cursor.execute("SELECT checkNumber FROM payments WHERE checkNumber = %s FOR UPDATE", (check_number,))
+        if self.cursor.fetchall():
+            raise mysql.connector.IntegrityError(msg=f"Duplicate check number '{check_number}'", errno=1062)
 
     def create_payment(self, customer_number, check_number, amount):
         """Inserts a new payment record for a customer with transaction control."""
-        try:
-            if self.db.is_connected():
-                self.cursor.fetchall()
-            
-            self.db.autocommit = False
-            self.cursor.execute("SAVEPOINT sp_create_payment")
-
+        def insert_payment():
+            self._claim_check_number(check_number)
             query = "INSERT INTO payments (customerNumber, checkNumber, paymentDate, amount) VALUES (%s, %s, NOW(), %s)"
             self.cursor.execute(query, (customer_number, check_number, amount))
-            
-            self.db.commit()
-            return True
-        
+            self._add_to_balance(customer_number, payments=amount)
+
+        try:
+            self.run_transaction("create_payment", insert_payment)
         except mysql.connector.Error as err:
-            self.cursor.execute("ROLLBACK TO SAVEPOINT sp_create_payment")
-            self.db.rollback()
             print(f"Error creating payment: {err}")
             return False
-        
-        finally:
-            self.db.autocommit = True
+
+        self._invalidate("payments", "customer_balances")
+        return True
 
     def delete_payment(self, customer_number, check_number):
         """Deletes a specific payment record with transaction control."""
-        try:
-            if self.db.is_connected():
-                self.cursor.fetchall()
-            
-            self.db.autocommit = False
-            self.cursor.execute("SAVEPOINT sp_delete_payment")
+        def remove_payment():
+            self.cursor.execute(
+                "SELECT amount FROM payments WHERE customerNumber = %s AND checkNumber = %s FOR UPDATE",
+                (customer_number, check_number)
+            )
+            payments = self.cursor.fetchall()
 
             query = "DELETE FROM payments WHERE customerNumber = %s AND checkNumber = %s"
             self.cursor.execute(query, (customer_number, check_number))
-            
-            self.db.commit()
-            return True
-        
+            if payments:
+                self._add_to_balance(customer_number, payments=-payments[0]["amount"])
+
+        try:
+            self.run_transaction("delete_payment", remove_payment)
         except mysql.connector.Error as err:
-            self.cursor.execute("ROLLBACK TO SAVEPOINT sp_delete_payment")
-            self.db.rollback()
             print(f"Error deleting payment: {err}")
             return False
-        
-        finally:
-            self.db.autocommit = True
+
+        self._invalidate("payments", "customer_balances")
+        return True
 
     def update_payment_check_number(self, customer_number, old_check_number, new_check_number):
         """Updates the check number for a payment with transaction control."""
-        try:
-            if self.db.is_connected():
-                self.cursor.fetchall()
-            
-            self.db.autocommit = False
-            self.cursor.execute("SAVEPOINT sp_update_check_number")
-
+        def renumber_payment():
+            if new_check_number != old_check_number:
+                self._claim_check_number(new_check_number)
             query = "UPDATE payments SET checkNumber = %s WHERE customerNumber = %s AND checkNumber = %s"
             self.cursor.execute(query, (new_check_number, customer_number, old_check_number))
-            
-            self.db.commit()
-            return True
-        
+
+        try:
+            self.run_transaction("update_payment_check_number", renumber_payment)
         except mysql.connector.Error as err:
-            self.cursor.execute("ROLLBACK TO SAVEPOINT sp_update_check_number")
-            self.db.rollback()
             print(f"Error updating check number: {err}")
             return False
-        
-        finally:
-            self.db.autocommit = True
+
+        self._invalidate("payments")
+        return True
 
     def get_payment_details(self, customer_number, check_number):
         """Fetches a single payment record for editing."""
         query = "SELECT * FROM payments WHERE customerNumber = %s AND checkNumber = %s"
-        return self.execute_query(query, (customer_number, check_number), fetchone=True)
+        return self._lookup("payments", (customer_number, check_number), query, (customer_number, check_number))
 
     def update_payment(self, customer_number, old_check_number, new_check_number, new_amount):
         """Updates a payment's check number and amount with transaction control."""
-        try:
-            if self.db.is_connected():
-                self.cursor.fetchall()
-            
-            self.db.autocommit = False
-            self.cursor.execute("SAVEPOINT sp_update_payment")
+        def change_payment():
+            self.cursor.execute(
+                "SELECT amount FROM payments WHERE customerNumber = %s AND checkNumber = %s FOR UPDATE",
+                (customer_number, old_check_number)
+            )
+            payments = self.cursor.fetchall()
+            if new_check_number != old_check_number:
+                self._claim_check_number(new_check_number)
 
             query = """
                 UPDATE payments 
@@ -722,30 +1745,30 @@ class DatabaseHandler:
                 WHERE customerNumber = %s AND checkNumber = %s
             """
             self.cursor.execute(query, (new_check_number, new_amount, customer_number, old_check_number))
-            
-            self.db.commit()
-            return True
-        
+            if payments:
+                delta = Decimal(str(new_amount)) - payments[0]["amount"]
+                self._add_to_balance(customer_number, payments=delta)
+
+        try:
+            self.run_transaction("update_payment", change_payment)
         except mysql.connector.Error as err:
-            self.cursor.execute("ROLLBACK TO SAVEPOINT sp_update_payment")
-            self.db.rollback()
             print(f"Error updating payment: {err}")
             return False
-        
-        finally:
-            self.db.autocommit = True
+
+        self._invalidate("payments", "customer_balances")
+        return True
 
     def get_all_customers_with_balance(self, search="", sort="none"):
         """Fetches all customers for the manager view."""
         query = """
         SELECT c.customerNumber, c.customerName, l.city, l.country, 
                c.salesRepEmployeeNumber,
-               IFNULL(SUM(p.amount), 0) AS totalSpend
+               IFNULL(b.totalPayments, 0) AS totalSpend,
+               IFNULL(b.totalOrders - b.totalPayments, 0) AS balance
         FROM customers c
         LEFT JOIN locations l ON c.locationID = l.locationID
-        LEFT JOIN payments p ON c.customerNumber = p.customerNumber
+        LEFT JOIN customer_balances b ON c.customerNumber = b.customerNumber
         WHERE c.customerName LIKE %s
-        GROUP BY c.customerNumber
         """
 
         # Sorting
@@ -759,19 +1782,39 @@ class DatabaseHandler:
         # Handle case where query fails and returns None
         if customers is None:
             return []
-        
-        results = []
-        for c in customers:
-            bal_data = self.get_customer_balance(c['customerNumber'])
-            c['balance'] = bal_data['balance']
-            results.append(c)
             
-        return results    
+        return customers
+
+    def update_order_item_quantity(self, detail_id, new_quantity, expected_version=None, statuses=None,
+                                   principal=None):
+        """
+        Updates the quantity of a specific order line item. With expected_version,
+        statuses or principal the order must still match them (see _order_guard);
+        returns 0 when it does not, None on error.
+        """
+        def change_quantity():
+            if not self._claim_order_of_line(detail_id, expected_version, statuses, principal):
+                return [], 0
+            self.cursor.execute(LOCK_ORDER_OF_LINE, (detail_id,))
+            orders = self.cursor.fetchall()
+
+            query = "UPDATE orderdetails SET quantityOrdered = %s WHERE orderDetailsNumber = %s"
+            self.cursor.execute(query, (new_quantity, detail_id))
+            result = self.cursor.rowcount
+            if result and orders[0]["status"] == "Shipped":
+                self._recount_shipped_total(orders[0]["customerNumber"])
+            return orders, result
+
+        try:
+            orders, result = self.run_transaction("update_order_item_quantity", change_quantity)
+        except mysql.connector.Error as err:
+            print(f"Error: {err}")
+            return None
 
-    def update_order_item_quantity(self, detail_id, new_quantity):
-        """Updates the quantity of a specific order line item."""
-        query = "UPDATE orderdetails SET quantityOrdered = %s WHERE orderDetailsNumber = %s"
-        return self.execute_query(query, (new_quantity, detail_id))
+        if result:
+            self._invalidate("orders", "orderdetails", "customer_balances")
+            self.refresh_productline_rollup(order["orderDate"] for order in orders)
+        return result
 
     def get_next_employee_number(self):
         """Returns the next available employee number."""
@@ -782,30 +1825,52 @@ class DatabaseHandler:
         return 1001 # Default start if table is empty
 
     def add_employee(self, employee_number, last_name, first_name, extension, email, office_code, reports_to, job_title):
-        """Inserts a new employee record."""
+        """Inserts a new employee record and links it under its manager in employee_closure."""
         query = """
             INSERT INTO employees (employeeNumber, lastName, firstName, extension, email, officeCode, reportsTo, jobTitle)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
         """
         params = (employee_number, last_name, first_name, extension, email, office_code, reports_to, job_title)
-        return self.execute_query(query, params)
+        try:
+            self.db.autocommit = False
+            self.cursor.execute(query, params)
+            result = self.cursor.rowcount
+
+            # The new employee sits below every ancestor of the manager (and the manager itself)
+            self.cursor.execute("""
+                INSERT INTO employee_closure (ancestorNumber, descendantNumber, depth)
+                SELECT ancestorNumber, %s, depth + 1 FROM employee_closure WHERE descendantNumber = %s
+                UNION ALL
+                SELECT %s, %s, 0
+            """, (employee_number, reports_to, employee_number, employee_number))
+
+            self.db.commit()
+            self._invalidate("employees", "employee_closure")
+            return result
+
+        except mysql.connector.Error as err:
+            self.db.rollback()
+            print(f"Error: {err}")
+            return None
+
+        finally:
+            self.db.autocommit = True
 
     def create_order_transaction(self, customer_number, cart_items, comment=""):
         """
         Creates an order and its details atomically.
         """
-        try:
-            if self.db.is_connected():
-                self.cursor.fetchall()
-            
-            self.db.autocommit = False
+        # If empty comment, set default 
+        final_comment = comment if comment else "Web Order"
 
-            self.cursor.execute("SELECT MAX(orderNumber) AS maxNum FROM orders")
+        def place_order():
+            # The counter row stays locked until this order commits, so concurrent orders
+            # cannot take the same number (a partitioned orders table only keeps
+            # (orderNumber, orderDate) unique; see migrations/0008_order_numbers.sql)
+            self.cursor.execute("SELECT lastOrderNumber FROM order_numbers WHERE id = 1 FOR UPDATE")
             res = self.cursor.fetchone()
-            next_order_id = (res["maxNum"] or 0) + 1
-
-            # If empty comment, set default 
-            final_comment = comment if comment else "Web Order"
+            next_order_id = res["lastOrderNumber"] + 1
+            self.cursor.execute("UPDATE order_numbers SET lastOrderNumber = %s WHERE id = 1", (next_order_id,))
 
             query_order = """
                 INSERT INTO orders (orderNumber, orderDate, requiredDate, status, comments, customerNumber)
@@ -828,51 +1893,234 @@ class DatabaseHandler:
                     line_number
                 ))
                 line_number += 1
+            return next_order_id
 
-            self.db.commit()
-            return True, next_order_id
-
+        try:
+            next_order_id = self.run_transaction("create_order", place_order)
         except Exception as e:
-            self.db.rollback()
             print(f"Transaction Error: {e}")
             return False, str(e)
-            
-        finally:
-            self.db.autocommit = True
 
-    def update_order_comment(self, order_number, new_comment):
-        """Updates the comment/notes of a specific order."""
-        query = "UPDATE orders SET comments = %s WHERE orderNumber = %s"
-        return self.execute_query(query, (new_comment, order_number))
+        self.analytics.expect_append(next_order_id)
+        self._invalidate("orders", "orderdetails")
+        self.refresh_productline_rollup(self._order_days("order", next_order_id))
+        return True, next_order_id
+
+    def update_order_comment(self, order_number, new_comment, expected_version=None, principal=None):
+        """
+        Updates the comment/notes of a specific order, if it still matches
+        expected_version and principal (see _order_guard). Returns the row count:
+        0 when the order changed or is not the user's, None on error.
+        """
+        guard, guard_params = self._order_guard("o", expected_version, None, principal)
+        query = f"""
+            UPDATE orders o SET o.comments = %s, o.rowVersion = o.rowVersion + 1
+            WHERE o.orderNumber = %s{guard}
+        """
+        return self.execute_query(query, (new_comment, order_number, *guard_params))
+
+    def _order_guard(self, alias, expected_version, statuses, principal):
+        """
+        Extra WHERE conditions (and parameters) for a conditional write to orders:
+        the row version the user's form was rendered with, the statuses the change
+        is allowed from, and the principal's right to change the order (customers
+        their own, sales reps their customers', managers any). None skips a check.
+        Checked in the UPDATE itself, so nothing can change between check and write.
+        """
+        conditions, params = [], []
+        if expected_version is not None:
+            conditions.append(f"{alias}.rowVersion = %s")
+            params.append(expected_version)
+        if statuses:
+            conditions.append(f"{alias}.status IN ({', '.join(['%s'] * len(statuses))})")
+            params.extend(statuses)
+        if principal is not None and principal.user_type == "customer":
+            conditions.append(f"{alias}.customerNumber = %s")
+            params.append(principal.number)
+        elif principal is not None and not principal.is_manager:
+            conditions.append(
+                f"{alias}.customerNumber IN (SELECT customerNumber FROM customers WHERE salesRepEmployeeNumber = %s)"
+            )
+            params.append(principal.number)
+        return "".join(f" AND {condition}" for condition in conditions), params
+
+    def _claim_order_of_line(self, detail_id, expected_version, statuses, principal):
+        """
+        Bumps the version of the order a line belongs to, if the order passes
+        _order_guard; the row stays locked until the caller's transaction ends.
+        Returns False when it does not match.
+        """
+        guard, guard_params = self._order_guard("o", expected_version, statuses, principal)
+        self.cursor.execute(f"""
+            UPDATE orders o
+            JOIN orderdetails od ON od.orderNumber = o.orderNumber
+            SET o.rowVersion = o.rowVersion + 1
+            WHERE od.orderDetailsNumber = %s{guard}
+        """, (detail_id, *guard_params))
+        return self.cursor.rowcount > 0
+
+    def update_order_status(self, order_number, new_status, comment=None, expected_version=None,
+                            statuses=None, principal=None):
+        """
+        Updates the status (and optionally the comment) of a specific order.
+        Orders moving into or out of 'Shipped' change the customer's balance,
+        which is updated in the same transaction. With expected_version, statuses
+        or principal the order must still match them (see _order_guard).
+        Returns the row count: 0 when it does not match, None on error.
+        """
+        guard, guard_params = self._order_guard("orders", expected_version, statuses, principal)
+
+        def change_status():
+            self.cursor.execute(
+                "SELECT customerNumber, status, orderDate FROM orders WHERE orderNumber = %s FOR UPDATE",
+                (order_number,)
+            )
+            orders = self.cursor.fetchall()
 
-    def update_order_status(self, order_number, new_status):
-        """Updates the status of a specific order."""
-        query = "UPDATE orders SET status = %s WHERE orderNumber = %s"
-        return self.execute_query(query, (new_status, order_number))
+            if comment is None:
+                self.cursor.execute(
+                    f"""UPDATE orders SET status = %s, rowVersion = rowVersion + 1
+                        WHERE orderNumber = %s{guard}""",
+                    (new_status, order_number, *guard_params)
+                )
+            else:
+                self.cursor.execute(
+                    f"""UPDATE orders SET status = %s, comments = %s, rowVersion = rowVersion + 1
+                        WHERE orderNumber = %s{guard}""",
+                    (new_status, comment, order_number, *guard_params)
+                )
+            result = self.cursor.rowcount
+
+            if result and orders[0]["status"] != new_status and "Shipped" in (orders[0]["status"], new_status):
+                self._recount_shipped_total(orders[0]["customerNumber"])
+            return orders, result
+
+        try:
+            orders, result = self.run_transaction("update_order_status", change_status)
+        except mysql.connector.Error as err:
+            print(f"Error: {err}")
+            return None
+
+        if result:
+            self._invalidate("orders", "customer_balances")
+            self.refresh_productline_rollup(order["orderDate"] for order in orders)
+        return result
+
+    def cancel_order(self, order_number, comment=None, expected_version=None, statuses=None, principal=None):
+        """Cancels an order, optionally replacing its comment (conditions as in update_order_status)."""
+        return self.update_order_status(order_number, "Cancelled", comment, expected_version, statuses, principal)
+
+    def bulk_update_order_status(self, order_numbers, new_status, principal=None):
+        """
+        Moves many orders to new_status. Orders are handled BULK_STATUS_CHUNK at a
+        time, each chunk in one transaction: one locking SELECT, one UPDATE of the
+        orders whose transition ORDER_STATUS_TRANSITIONS allows (and the principal
+        may change), and one recount of the affected customers' shipped totals.
+        Returns {order_number: outcome} with outcome one of "updated", "unchanged"
+        (already in new_status), "not_allowed", "forbidden", "not_found", or
+        "error" for the chunk that failed and those after it.
+        """
+        allowed_from = [status for status, targets in ORDER_STATUS_TRANSITIONS.items() if new_status in targets]
+        # Sorted, so concurrent batches lock orders in the same order
+        order_numbers = sorted(set(order_numbers))
+        outcomes = {}
+        changed_days = []
+
+        def update_chunk(chunk):
+            placeholders = ", ".join(["%s"] * len(chunk))
+            self.cursor.execute(
+                f"""SELECT orderNumber, customerNumber, status, orderDate FROM orders
+                    WHERE orderNumber IN ({placeholders}) FOR UPDATE""",
+                tuple(chunk)
+            )
+            rows = {row["orderNumber"]: row for row in self.cursor.fetchall()}
+
+            results, eligible = {}, []
+            for order_number in chunk:
+                row = rows.get(order_number)
+                if row is None:
+                    results[order_number] = "not_found"
+                elif principal is not None and not principal.can_view_customer(row["customerNumber"]):
+                    results[order_number] = "forbidden"
+                elif row["status"] == new_status:
+                    results[order_number] = "unchanged"
+                elif row["status"] not in allowed_from:
+                    results[order_number] = "not_allowed"
+                else:
+                    results[order_number] = "updated"
+                    eligible.append(order_number)
+
+            if eligible:
+                placeholders = ", ".join(["%s"] * len(eligible))
+                self.cursor.execute(
+                    f"""UPDATE orders SET status = %s, rowVersion = rowVersion + 1
+                        WHERE orderNumber IN ({placeholders})""",
+                    (new_status, *eligible)
+                )
+                shipped_changed = {
+                    rows[n]["customerNumber"] for n in eligible
+                    if "Shipped" in (rows[n]["status"], new_status)
+                }
+                if shipped_changed:
+                    self._recount_shipped_totals(sorted(shipped_changed))
+            return results, [rows[n]["orderDate"] for n in eligible]
+
+        for i in range(0, len(order_numbers), BULK_STATUS_CHUNK):
+            chunk = order_numbers[i:i + BULK_STATUS_CHUNK]
+            try:
+                results, days = self.run_transaction("bulk_update_order_status", lambda: update_chunk(chunk))
+            except mysql.connector.Error as err:
+                print(f"Error: {err}")
+                outcomes.update((n, "error") for n in order_numbers[i:])
+                break
+            outcomes.update(results)
+            changed_days.extend(days)
+
+        if changed_days:
+            self._invalidate("orders", "customer_balances")
+            self.refresh_productline_rollup(changed_days)
+        return outcomes
 
     def delete_order_permanently(self, order_number):
         """
-        Hard Deletes an order. 
-        Database 'ON DELETE CASCADE' will automatically remove related orderdetails.
+        Hard Deletes an order together with its orderdetails.
         """
-        try:
-            query = "DELETE FROM orders WHERE orderNumber = %s"
-            
-            row_count = self.execute_query(query, (order_number,))
-            
-            if row_count and row_count > 0:
-                return True, f"Order #{order_number} permanently deleted."
-            else:
-                return False, "Order not found or could not be deleted."
+        def delete_order():
+            self.cursor.execute(
+                "SELECT customerNumber, status, orderDate FROM orders WHERE orderNumber = %s FOR UPDATE",
+                (order_number,)
+            )
+            orders = self.cursor.fetchall()
+
+            self.cursor.execute("DELETE FROM orderdetails WHERE orderNumber = %s", (order_number,))
+            self.cursor.execute("DELETE FROM orders WHERE orderNumber = %s", (order_number,))
+            row_count = self.cursor.rowcount
+            if orders and orders[0]["status"] == "Shipped":
+                self._recount_shipped_total(orders[0]["customerNumber"])
+            return orders, row_count
 
+        try:
+            orders, row_count = self.run_transaction("delete_order", delete_order)
         except mysql.connector.Error as err:
             return False, f"Database Error: {err}"
 
+        self._invalidate("orders", "customer_balances")
+        if row_count and row_count > 0:
+            self.refresh_productline_rollup(order["orderDate"] for order in orders)
+            return True, f"Order #{order_number} permanently deleted."
+        else:
+            return False, "Order not found or could not be deleted."
+
+    @cached_result("employees", "customers", "orders", "orderdetails", "products")
     def get_employee_performance_matrix(self, limit=10, offset=0):
         """
         Complex Join (Employees -> Customers -> Orders -> OrderDetails -> Products) + Group By
         Supports pagination.
         """
+        result = self.analytics.get_employee_performance_matrix(limit, offset)
+        if result is not None:
+            return result
+
         query = """
             SELECT 
                 e.firstName, 
@@ -896,6 +2144,7 @@ class DatabaseHandler:
         query = "UPDATE employees SET email = %s WHERE employeeNumber = %s"
         return self.execute_query(query, (new_email, employee_number))
 
+    @cached_result("employees", "customers", "orders")
     def get_unproductive_employees(self):
         """
         Outer Join (Employees left join Customers left join Orders)
@@ -921,6 +2170,11 @@ class DatabaseHandler:
         return self.execute_query(query)
 
     def get_filtered_orders(self, customer_number, filters, search_query=None):
+        query, params = self.build_filtered_orders_query(customer_number, filters, search_query)
+        return self.execute_query(query, params)
+
+    def build_filtered_orders_query(self, customer_number, filters, search_query=None):
+        """Builds the order history SQL and parameters shared by the order pages and exports."""
         #main query
         query = """
             SELECT 
@@ -1015,13 +2269,20 @@ class DatabaseHandler:
         else:
             query += " ORDER BY o.orderNumber DESC"
 
-        return self.execute_query(query, params)
+        return query, tuple(params)
 
     def close(self):
         """Closes the cursor and database connection."""
-        self.cursor.close()
-        self.db.close()
-
+        if self.replicas:
+            self.replicas.close()
+        if not self.is_connected():
+            return
+        self._cursor.close()
+        self._conn.close()
+        self._conn = None
+        self._cursor = None
+
+    @cached_result("offices", "employees", "customers", "orders", "orderdetails")
     def get_sales_rep_vs_office_average(self):
         """
         Analytical Report:
@@ -1068,12 +2329,78 @@ class DatabaseHandler:
         """
         return self.execute_query(query)
 
+    @cached_result("offices", "employees", "customers", "orders", "orderdetails")
+    def get_sales_rep_vs_office_page(self, limit=10, offset=0, office_city=None, search=None):
+        """
+        One page of the Sales Rep vs. office average comparison.
+        Each employee's revenue is summed once; the office average is a window
+        over those totals, taken before the office filter and the search
+        (case-insensitive, on office city or rep name) narrow the rows.
+        Returns {"rows": [...], "total": matching rows}, or None on error.
+        """
+        conditions = []
+        params = []
+        if office_city:
+            conditions.append("office_city = %s")
+            params.append(office_city)
+        if search:
+            pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            conditions.append("(office_city LIKE %s OR sales_rep LIKE %s)")
+            params += [pattern, pattern]
+        where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        query = f"""
+            WITH rep_totals AS (
+                SELECT
+                    e.officeCode,
+                    o.city AS office_city,
+                    e.employeeNumber,
+                    CONCAT(e.firstName, ' ', e.lastName) AS sales_rep,
+                    COALESCE(SUM(od.quantityOrdered * od.priceEach), 0) AS rep_revenue
+                FROM offices o
+                JOIN employees e ON o.officeCode = e.officeCode
+                LEFT JOIN customers c ON e.employeeNumber = c.salesRepEmployeeNumber
+                LEFT JOIN orders ord ON c.customerNumber = ord.customerNumber
+                LEFT JOIN orderdetails od ON ord.orderNumber = od.orderNumber
+                GROUP BY e.officeCode, o.city, e.employeeNumber, sales_rep
+            ),
+            with_office_avg AS (
+                SELECT
+                    rep_totals.*,
+                    AVG(rep_revenue) OVER (PARTITION BY officeCode) AS office_avg_revenue
+                FROM rep_totals
+            )
+            SELECT
+                office_city, employeeNumber, sales_rep, rep_revenue, office_avg_revenue,
+                COUNT(*) OVER () AS total_rows
+            FROM with_office_avg
+            {where_sql}
+            ORDER BY office_city, rep_revenue DESC, employeeNumber
+            LIMIT %s OFFSET %s
+        """
+        rows = self.execute_query(query, tuple(params) + (limit, offset))
+        if rows is None:
+            return None
+        # A page past the end has no rows to carry the count, so recount from the first page
+        if not rows and offset > 0:
+            first_page = self.get_sales_rep_vs_office_page(1, 0, office_city, search)
+            return {"rows": [], "total": first_page["total"] if first_page else 0}
+        total = rows[0]["total_rows"] if rows else 0
+        for row in rows:
+            del row["total_rows"]
+        return {"rows": rows, "total": total}
+
+    @cached_result("offices", "employees", "customers", "orders", "orderdetails")
     def get_consolidated_office_stats(self):
         """
         MERGED & COMPLEX QUERY:
         Combines Activity Report + Order Stats into one master query.
         Features: Multi-Join (5 Tables), Left Joins, Count Distinct, Nested Subquery for Manager.
         """
+        result = self.analytics.get_consolidated_office_stats()
+        if result is not None:
+            return result
+
         query = """
             SELECT 
                 o.officeCode,
@@ -1115,13 +2442,22 @@ class DatabaseHandler:
         """
         return self.execute_query(query)
 
+    @cached_result(*ULTIMATE_ANALYSIS_TABLES)
     def get_ultimate_analysis_paginated(self, limit=10, offset=0, filter_office=None, filter_category=None):
         """
         THE ULTIMATE QUERY (PAGINATED & FILTERED):
         Analyzes Office performance per Product Category vs Global Averages.
         Includes 7-Table Joins, Nested Subqueries, and Dynamic Filtering.
         """
-        # Dynamic WHERE clause construction
+        query, params = self.build_ultimate_analysis_query(filter_office, filter_category)
+        query += " LIMIT %s OFFSET %s"
+        # Add pagination params
+        params = params + (limit, offset)
+        
+        return self.execute_query(query, params)
+
+    def _ultimate_analysis_where(self, filter_office=None, filter_category=None):
+        """Dynamic WHERE clause shared by the ultimate analysis queries."""
         where_clauses = ["pl.productLine IS NOT NULL"]
         params = []
 
@@ -1133,9 +2469,31 @@ class DatabaseHandler:
             where_clauses.append("pl.productLine = %s")
             params.append(filter_category)
 
-        where_sql = " AND ".join(where_clauses)
+        return " AND ".join(where_clauses), params
+
+    def build_ultimate_analysis_query(self, filter_office=None, filter_category=None, with_total=False):
+        """
+        Builds the unpaginated ultimate analysis SQL (used directly by the export).
+        The per-category global averages are computed once in a CTE, one row per
+        product line, instead of once per output group. with_total=True adds a
+        Total_Rows column counting every matching group, for pagination.
+        """
+        where_sql, params = self._ultimate_analysis_where(filter_office, filter_category)
+        total_sql = ",\n                COUNT(*) OVER () AS Total_Rows" if with_total else ""
 
         query = f"""
+            WITH order_line_totals AS (
+                SELECT p2.productLine, SUM(od2.quantityOrdered * od2.priceEach) AS sub_sum
+                FROM orderdetails od2
+                JOIN products p2 ON od2.productCode = p2.productCode
+                GROUP BY od2.orderNumber, p2.productLine
+            ),
+            category_avg AS (
+                -- Global Average Calculation: mean order revenue per product line
+                SELECT productLine, AVG(sub_sum) AS Global_Category_Avg
+                FROM order_line_totals
+                GROUP BY productLine
+            )
             SELECT 
                 o.city AS Office,
                 o.territory AS Region,
@@ -1143,18 +2501,7 @@ class DatabaseHandler:
                 
                 COUNT(DISTINCT ord.orderNumber) AS Order_Count,
                 COALESCE(SUM(od.quantityOrdered * od.priceEach), 0) AS Total_Revenue,
-
-                -- COMPLEX NESTED SUBQUERY: Global Average Calculation
-                (
-                    SELECT AVG(sub_sum)
-                    FROM (
-                        SELECT SUM(od2.quantityOrdered * od2.priceEach) as sub_sum
-                        FROM orderdetails od2
-                        JOIN products p2 ON od2.productCode = p2.productCode
-                        WHERE p2.productLine = pl.productLine -- Correlated Reference
-                        GROUP BY od2.orderNumber
-                    ) AS global_stats
-                ) AS Global_Category_Avg
+                MAX(ca.Global_Category_Avg) AS Global_Category_Avg{total_sql}
 
             FROM offices o
             JOIN employees e 
@@ -1169,30 +2516,40 @@ class DatabaseHandler:
                 ON od.productCode = p.productCode
             LEFT JOIN productlines pl 
                 ON p.productLine = pl.productLine
+            LEFT JOIN category_avg ca
+                ON ca.productLine = pl.productLine
             
             WHERE {where_sql}
             
             GROUP BY o.officeCode, pl.productLine
             ORDER BY o.city, Total_Revenue DESC
-            LIMIT %s OFFSET %s
         """
-        # Add pagination params
-        params.extend([limit, offset])
-        
-        return self.execute_query(query, tuple(params))
+        return query, tuple(params)
 
+    @cached_result(*ULTIMATE_ANALYSIS_TABLES)
+    def get_ultimate_analysis_page(self, limit=10, offset=0, filter_office=None, filter_category=None):
+        """
+        One page of the ultimate analysis together with the number of matching
+        rows, from a single statement (Total_Rows is a window over the groups).
+        Returns {"rows": [...], "total": n}, or None on error.
+        """
+        query, params = self.build_ultimate_analysis_query(filter_office, filter_category, with_total=True)
+        query += " LIMIT %s OFFSET %s"
+        rows = self.execute_query(query, params + (limit, offset))
+        if rows is None:
+            return None
+        # A page past the end has no rows to carry the count
+        if not rows and offset > 0:
+            return {"rows": [], "total": self.get_ultimate_analysis_count(filter_office, filter_category)}
+        total = rows[0]["Total_Rows"] if rows else 0
+        for row in rows:
+            del row["Total_Rows"]
+        return {"rows": rows, "total": total}
+
+    @cached_result(*ULTIMATE_ANALYSIS_TABLES)
     def get_ultimate_analysis_count(self, filter_office=None, filter_category=None):
         """Helper to get total row count for pagination."""
-        where_clauses = ["pl.productLine IS NOT NULL"]
-        params = []
-        if filter_office and filter_office != 'All':
-            where_clauses.append("o.city = %s")
-            params.append(filter_office)
-        if filter_category and filter_category != 'All':
-            where_clauses.append("pl.productLine = %s")
-            params.append(filter_category)
-        
-        where_sql = " AND ".join(where_clauses)
+        where_sql, params = self._ultimate_analysis_where(filter_office, filter_category)
         
         query = f"""
             SELECT COUNT(*) as total
@@ -1210,4 +2567,4 @@ class DatabaseHandler:
             ) as count_table
         """
         result = self.execute_query(query, tuple(params), fetchone=True)
-        return result['total'] if result else 0
\ No newline at end of file
+        return result['total'] if result else 0
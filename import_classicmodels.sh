@@ -66,5 +66,15 @@ for f in tables/*.sql; do
   fi
 done
 
+# Bring the fresh schema up to the latest migration version
+echo "Applying schema migrations ..."
+DB_PASSWORD="$PASS" python3 migrate.py --host "$HOST" --port "$PORT" --user "$USER" --database "$DB" \
+  || { echo "Schema migrations failed"; unset MYSQL_PWD; exit 4; }
+
+# Fill the derived tables the migrations created
+echo "Building report rollups ..."
+DB_PASSWORD="$PASS" python3 maintenance.py --host "$HOST" --port "$PORT" --user "$USER" --database "$DB" rebuild-rollups \
+  || { echo "Rollup rebuild failed"; unset MYSQL_PWD; exit 5; }
+
 unset MYSQL_PWD
 echo "Import finished."
\ No newline at end of file
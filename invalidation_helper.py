@@ -0,0 +1,298 @@
+"""
+Cross-process cache invalidation for the result, principal and analytics caches.
+
+Every process (gunicorn worker, job worker, maintenance command) keeps its own
+caches. DatabaseHandler._invalidate publishes each committed write on the bus
+as a set of changed tables; the subscriber thread of every other web process
+evicts the same tables from its caches.
+
+Each change also increments a shared counter per table. Messages carry the new
+counters, and every process remembers the highest counter it has applied; a
+periodic check (InvalidationBus.poll, run before requests) compares them with
+the shared counters, so a dropped or missed message only delays an eviction
+by CHECK_SECONDS.
+
+Transports (CACHE_BUS):
+    local (default)   Unix datagram sockets, one per process, in a directory
+                      shared by the processes on this host; counters are files
+    <directory>       local, in the given directory
+    redis://...       Redis PUBLISH/SUBSCRIBE plus a hash of counters
+    off               no bus, for a single process
+"""
+import fcntl
+import glob
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Seconds between comparisons with the shared counters (the fallback for missed messages)
+CHECK_SECONDS = 2.0
+
+REDIS_CHANNEL = "classicmodels:invalidate"
+REDIS_VERSIONS_KEY = "classicmodels:table_versions"
+
+
+class SocketTransport:
+    """
+    Broadcasts over Unix datagram sockets in one directory: each subscribed
+    process binds <pid>.sock there and a publisher sends to every socket but
+    its own. Counters live in versions/<table> files, updated under flock.
+    Sockets of processes that exited are removed by the next publisher.
+    """
+
+    errors = (OSError, ValueError)
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.versions_dir = os.path.join(directory, "versions")
+        os.makedirs(self.versions_dir, exist_ok=True)
+        self._sender = None
+        self._receiver = None
+        self._path = None
+
+    def bump(self, tables):
+        """Increments the shared counter of each table; returns {table: new counter}."""
+        versions = {}
+        with open(os.path.join(self.directory, "versions.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            for table in tables:
+                path = os.path.join(self.versions_dir, table)
+                versions[table] = self._read(path) + 1
+                with open(path + ".tmp", "w") as out:
+                    out.write(str(versions[table]))
+                os.replace(path + ".tmp", path)
+        return versions
+
+    def versions(self):
+        return {
+            os.path.basename(path): self._read(path)
+            for path in glob.glob(os.path.join(self.versions_dir, "*"))
+            if not path.endswith(".tmp")
+        }
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as counter:
+                return int(counter.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def send(self, payload):
+        if self._sender is None:
+            self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sender.setblocking(False)
+        for path in glob.glob(os.path.join(self.directory, "*.sock")):
+            if path == self._path:
+                continue
+            try:
+                self._sender.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Nobody is bound to it any more: the process has exited
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                # The receiver's queue is full; the counter check catches it up
+                pass
+
+    def listen(self, callback):
+        """Receives messages until the process exits (runs on the subscriber thread)."""
+        self._path = os.path.join(self.directory, f"{os.getpid()}.sock")
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._receiver.bind(self._path)
+        while True:
+            callback(self._receiver.recv(65536))
+
+
+class RedisTransport:
+    """
+    Publishes on a Redis channel and keeps the counters in a Redis hash.
+    Any client with the redis-py interface (hincrby, hgetall, publish, pubsub,
+    pipeline) can be passed instead of a URL, e.g. fakeredis for a local stand-in.
+    """
+
+    errors = (OSError, ValueError) + ((redis.RedisError,) if redis else ())
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            if redis is None:
+                raise ValueError("CACHE_BUS is a Redis URL but the redis package is not installed")
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    def bump(self, tables):
+        pipe = self.client.pipeline()
+        for table in tables:
+            pipe.hincrby(REDIS_VERSIONS_KEY, table, 1)
+        return dict(zip(tables, pipe.execute()))
+
+    def versions(self):
+        return {
+            (table.decode() if isinstance(table, bytes) else table): int(version)
+            for table, version in self.client.hgetall(REDIS_VERSIONS_KEY).items()
+        }
+
+    def send(self, payload):
+        self.client.publish(REDIS_CHANNEL, payload)
+
+    def listen(self, callback):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(REDIS_CHANNEL)
+        for message in pubsub.listen():
+            if message.get("type") == "message":
+                callback(message["data"])
+
+
+def transport_from_env(database):
+    """The transport selected by CACHE_BUS, or None when the bus is off."""
+    setting = os.getenv("CACHE_BUS", "local")
+    if setting == "off":
+        return None
+    if setting.startswith(("redis://", "rediss://", "unix://")):
+        return RedisTransport(setting)
+    if setting == "local":
+        setting = os.path.join(tempfile.gettempdir(), f"classicmodels-cache-bus-{database}")
+    return SocketTransport(setting)
+
+
+class InvalidationBus:
+    """
+    Connects a DatabaseHandler's caches to the other processes.
+    apply(tables, order_number) is the handler's local eviction; it runs for
+    every remote change (order_number is set when the change was an appended order).
+    """
+
+    def __init__(self, transport, apply, check_seconds=CHECK_SECONDS):
+        self.transport = transport
+        self.apply = apply
+        self.check_seconds = check_seconds
+        self.origin = uuid.uuid4().hex
+        self._seen = None
+        self._seen_lock = threading.Lock()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        self._checked = 0.0
+        self.published = 0
+        self.received = 0
+        self.caught_up = 0
+
+    @property
+    def enabled(self):
+        return self.transport is not None
+
+    def publish(self, tables, order_number=None):
+        """Announces a committed change to the given tables. Errors are printed, never raised."""
+        if not self.enabled or not tables:
+            return
+        tables = sorted(tables)
+        try:
+            versions = self.transport.bump(tables)
+            self.transport.send(json.dumps({
+                "origin": self.origin, "versions": versions, "order": order_number,
+            }).encode())
+            self.published += 1
+        except self.transport.errors as err:
+            print(f"Cache bus publish failed: {err}")
+            return
+        # A counter that moved by more than our own increment means another
+        # process changed the table too and its message has not arrived yet
+        missed = self._advance({table: version - 1 for table, version in versions.items()})
+        self._advance(versions)
+        if missed:
+            self.apply(missed, None)
+
+    def _advance(self, versions):
+        """Records versions as applied; returns the tables that were behind."""
+        with self._seen_lock:
+            if self._seen is None:
+                return []
+            behind = [table for table, version in versions.items() if version > self._seen.get(table, 0)]
+            for table in behind:
+                self._seen[table] = versions[table]
+            return behind
+
+    def _receive(self, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get("origin") == self.origin:
+            return
+        behind = self._advance(message.get("versions", {}))
+        if behind:
+            self.received += 1
+            self.apply(behind, message.get("order"))
+
+    def ensure_started(self):
+        """Starts this process's subscriber thread (again after a fork)."""
+        if not self.enabled or self._started_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            # A fork inherits the parent's identity; this process needs its own
+            self.origin = uuid.uuid4().hex
+            if self._seen is None:
+                self.mark_synced()
+                self._checked = time.monotonic()
+            # Otherwise the caches were inherited (see app.preload): the first poll catches them up
+            threading.Thread(target=self._listen, name="cache-bus", daemon=True).start()
+            self._started_pid = os.getpid()
+
+    def mark_synced(self):
+        """Records the current shared counters as applied; call before filling empty caches."""
+        try:
+            versions = self.transport.versions() if self.enabled else {}
+        except self.transport.errors as err:
+            print(f"Cache bus unavailable: {err}")
+            versions = {}
+        with self._seen_lock:
+            self._seen = versions
+
+    def _listen(self):
+        while True:
+            try:
+                self.transport.listen(self._receive)
+            except self.transport.errors as err:
+                print(f"Cache bus subscriber error: {err}")
+            time.sleep(self.check_seconds)
+
+    def poll(self):
+        """
+        Run before each request: starts the subscriber if needed and, every
+        check_seconds, evicts tables whose shared counter is ahead of this process.
+        """
+        self.ensure_started()
+        if not self.enabled or time.monotonic() - self._checked < self.check_seconds:
+            return
+        self._checked = time.monotonic()
+        try:
+            versions = self.transport.versions()
+        except self.transport.errors as err:
+            print(f"Cache bus check failed: {err}")
+            return
+        behind = self._advance(versions)
+        if behind:
+            self.caught_up += 1
+            self.apply(behind, None)
+
+    def stats(self):
+        return {
+            "transport": type(self.transport).__name__ if self.enabled else None,
+            "published": self.published,
+            "received": self.received,
+            "caught_up": self.caught_up,
+        }
@@ -0,0 +1,305 @@
+"""
+Persistent background jobs for slow administrative work and report exports.
+
+Jobs are rows of the `jobs` table (migrations/0006_jobs.sql). JobQueue.enqueue
+inserts one and returns its id right away; worker threads in each web process
+(JOB_WORKERS, default 2) claim queued jobs with FOR UPDATE SKIP LOCKED, so any
+number of processes can share the table. A claimed job holds a lease; if its
+process dies the lease runs out and another worker picks the job up again.
+
+A failed attempt (an unexpected exception, or JobFailed with retry=True) is
+retried with exponential backoff until maxAttempts is reached. Queued jobs
+are cancelled at once; running ones are asked to stop and notice it the next
+time they call Job.heartbeat().
+
+Export files are kept for retention_days (JOB_OUTPUT_RETENTION_DAYS, default 7)
+after their job finished; the workers, or maintenance.py run-jobs, then delete
+them (JobQueue.sweep_outputs).
+"""
+import json
+import os
+import threading
+import time
+import traceback
+
+import mysql.connector
+
+# Seconds a claimed job may run before another worker may take it over (see Job.heartbeat)
+LEASE_SECONDS = 300
+# Delay before retry n is 2**n * RETRY_BASE_SECONDS
+RETRY_BASE_SECONDS = 5
+# Days an export file is kept after its job finished (JOB_OUTPUT_RETENTION_DAYS)
+OUTPUT_RETENTION_DAYS = 7
+# Seconds between a worker thread's sweeps of expired export files
+SWEEP_SECONDS = 3600
+
+JOB_STATUSES = ("queued", "running", "done", "failed", "cancelled")
+
+CLAIM_JOB = """
+    SELECT jobId, kind, params, attempts, maxAttempts
+    FROM jobs
+    WHERE (status = 'queued' AND availableAt <= NOW())
+       OR (status = 'running' AND leaseUntil < NOW())
+    ORDER BY jobId
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+"""
+
+
+class JobCancelled(Exception):
+    """Raised by Job.heartbeat() once cancellation of a running job was requested."""
+
+
+class JobFailed(Exception):
+    """
+    Raised by a job handler for a failure whose message is shown to the user.
+    Only retried with retry=True (e.g. a database error); other exceptions always are.
+    """
+
+    def __init__(self, message, retry=False):
+        super().__init__(message)
+        self.retry = retry
+
+
+class Job:
+    """The job being run, as passed to handlers."""
+
+    def __init__(self, queue, db, row):
+        self.queue = queue
+        self.db = db
+        self.id = row["jobId"]
+        self.kind = row["kind"]
+        self.params = json.loads(row["params"])
+        self.attempt = row["attempts"] + 1
+
+    def heartbeat(self):
+        """Extends the lease; raises JobCancelled if the user cancelled the job."""
+        self.db.execute_query(
+            "UPDATE jobs SET leaseUntil = NOW() + INTERVAL %s SECOND WHERE jobId = %s",
+            (LEASE_SECONDS, self.id)
+        )
+        row = self.db.execute_query("SELECT cancelRequested FROM jobs WHERE jobId = %s", (self.id,), fetchone=True)
+        if row and row["cancelRequested"]:
+            raise JobCancelled()
+
+    def output_path(self, extension):
+        """Where the job writes a file for download."""
+        return os.path.join(self.queue.output_dir, f"job-{self.id}.{extension}")
+
+
+class JobQueue:
+    """
+    Enqueue/inspect/cancel API plus the worker threads of one process.
+    Handlers are registered per job kind: handler(db, job) returns a
+    JSON-serializable result; db is the worker's own DatabaseHandler.
+    """
+
+    def __init__(self, db, workers=2, output_dir=None, poll_seconds=1.0, retention_days=OUTPUT_RETENTION_DAYS):
+        self.db = db
+        self.workers = workers
+        self.output_dir = output_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "job_output")
+        self.poll_seconds = poll_seconds
+        self.retention_days = retention_days
+        self.handlers = {}
+        self._wakeup = threading.Event()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    # --- API used by the routes ---
+
+    def enqueue(self, kind, params, user_type=None, user_number=None, max_attempts=3):
+        """Queues a job and returns its id (None if it could not be stored)."""
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind {kind!r}")
+        rows = self.db.execute_query("""
+            INSERT INTO jobs (kind, params, requestedByType, requestedBy, maxAttempts)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (kind, json.dumps(params, default=str), user_type, user_number, max_attempts))
+        if not rows:
+            return None
+        self._wakeup.set()
+        return self.db.cursor.lastrowid
+
+    def get(self, job_id):
+        """A job row with params/result decoded, or None."""
+        job = self.db.execute_query("SELECT * FROM jobs WHERE jobId = %s", (job_id,), fetchone=True)
+        if job:
+            job["params"] = json.loads(job["params"])
+            job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def list_for(self, user_type, user_number, limit=25):
+        """The user's most recent jobs, newest first."""
+        jobs = self.db.execute_query("""
+            SELECT * FROM jobs
+            WHERE requestedByType = %s AND requestedBy = %s
+            ORDER BY jobId DESC
+            LIMIT %s
+        """, (user_type, user_number, limit)) or []
+        for job in jobs:
+            job["params"] = json.loads(job["params"])
+            job["result"] = json.loads(job["result"]) if job["result"] else None
+        return jobs
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued job, or asks a running one to stop.
+        Returns the resulting status, or None if the job had already finished.
+        """
+        cancelled = self.db.execute_query("""
+            UPDATE jobs SET status = 'cancelled', finishedAt = NOW()
+            WHERE jobId = %s AND status = 'queued'
+        """, (job_id,))
+        if cancelled:
+            return "cancelled"
+        requested = self.db.execute_query(
+            "UPDATE jobs SET cancelRequested = 1 WHERE jobId = %s AND status = 'running'", (job_id,)
+        )
+        return "running" if requested else None
+
+    # --- Workers ---
+
+    def ensure_started(self):
+        """Starts this process's worker threads (again after a fork, since threads do not survive one)."""
+        if self.workers <= 0 or self._started_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            os.makedirs(self.output_dir, exist_ok=True)
+            for n in range(self.workers):
+                threading.Thread(target=self._work, name=f"job-worker-{n}", daemon=True).start()
+            self._started_pid = os.getpid()
+
+    def _work(self):
+        db = self.db.worker_handle()
+        swept = 0.0
+        while True:
+            try:
+                if time.monotonic() - swept >= SWEEP_SECONDS:
+                    swept = time.monotonic()
+                    self.sweep_outputs(db)
+                ran = self.run_next(db)
+            except mysql.connector.Error as err:
+                print(f"Job worker error: {err}")
+                ran = False
+            if not ran:
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+
+    def sweep_outputs(self, db):
+        """
+        Deletes the export files of jobs that finished more than retention_days
+        ago and marks their results expired, so /jobs stops offering them.
+        Returns the number of jobs swept.
+        """
+        rows = db.execute_query("""
+            SELECT jobId, result FROM jobs
+            WHERE status = 'done' AND finishedAt < NOW() - INTERVAL %s DAY AND result LIKE %s
+        """, (self.retention_days, '%"file"%')) or []
+        swept = 0
+        for row in rows:
+            result = json.loads(row["result"])
+            if "file" not in result:
+                continue
+            try:
+                os.remove(os.path.join(self.output_dir, os.path.basename(result.pop("file"))))
+            except FileNotFoundError:
+                pass
+            result["expired"] = True
+            db.execute_query("UPDATE jobs SET result = %s WHERE jobId = %s",
+                             (json.dumps(result, default=str), row["jobId"]))
+            swept += 1
+        return swept
+
+    def run_next(self, db):
+        """Claims and runs one job on the given DatabaseHandler. Returns False if none was waiting."""
+        row = self._claim(db)
+        if row is None:
+            return False
+
+        job = Job(self, db, row)
+        handler = self.handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise JobFailed(f"Unknown job kind {job.kind!r}")
+            result = handler(db, job)
+        except JobCancelled:
+            self._finish(db, job, "cancelled")
+        except Exception as err:
+            message = str(err) if isinstance(err, JobFailed) else f"{type(err).__name__}: {err}"
+            if not isinstance(err, JobFailed):
+                traceback.print_exc()
+            retry = getattr(err, "retry", True)
+            if retry and job.attempt < row["maxAttempts"]:
+                db.execute_query("""
+                    UPDATE jobs
+                    SET status = 'queued', error = %s, leaseUntil = NULL,
+                        availableAt = NOW() + INTERVAL %s SECOND
+                    WHERE jobId = %s
+                """, (message, 2 ** job.attempt * RETRY_BASE_SECONDS, job.id))
+            else:
+                self._finish(db, job, "failed", error=message)
+        else:
+            self._finish(db, job, "done", result=result)
+        return True
+
+    def _claim(self, db):
+        try:
+            db.db.autocommit = False
+            db.cursor.execute(CLAIM_JOB)
+            rows = db.cursor.fetchall()
+            if rows:
+                db.cursor.execute("""
+                    UPDATE jobs
+                    SET status = 'running', attempts = attempts + 1, startedAt = NOW(),
+                        leaseUntil = NOW() + INTERVAL %s SECOND
+                    WHERE jobId = %s
+                """, (LEASE_SECONDS, rows[0]["jobId"]))
+            db.db.commit()
+            return rows[0] if rows else None
+
+        except mysql.connector.Error as err:
+            db.db.rollback()
+            print(f"Error claiming job: {err}")
+            return None
+
+        finally:
+            db.db.autocommit = True
+
+    def _finish(self, db, job, status, result=None, error=None):
+        db.execute_query("""
+            UPDATE jobs
+            SET status = %s, result = %s, error = %s, finishedAt = NOW(), leaseUntil = NULL
+            WHERE jobId = %s
+        """, (status, json.dumps(result, default=str) if result is not None else None, error, job.id))
+
+
+# --- Handlers for the slow DatabaseHandler operations ---
+
+def _database_error(message):
+    """The (success, message) methods report database errors (worth retrying) with this prefix."""
+    return message.lower().startswith("database error")
+
+
+def fire_sales_rep_job(db, job):
+    success, message = db.fire_sales_rep(job.params["employeeNumber"])
+    if not success:
+        raise JobFailed(message, retry=_database_error(message))
+    return {"message": message}
+
+
+def delete_order_job(db, job):
+    success, message = db.delete_order_permanently(job.params["orderNumber"])
+    if not success:
+        raise JobFailed(message, retry=_database_error(message))
+    return {"message": message}
+
+
+DATABASE_JOBS = {
+    "fire_sales_rep": fire_sales_rep_job,
+    "delete_order": delete_order_job,
+}
@@ -0,0 +1,184 @@
+"""
+Maintenance commands for derived tables that the application keeps up to date
+incrementally, for filling them after a migration or repairing them.
+
+Usage:
+    python maintenance.py rebuild-rollups                      # whole productline_daily table
+    python maintenance.py rebuild-rollups --start 2004-01-01 --end 2005-01-01
+    python maintenance.py reconcile-balances                   # report and fix ledger drift
+    python maintenance.py reconcile-balances --dry-run         # report only
+    python maintenance.py rebuild-org-closure                  # employee_closure from reportsTo
+    python maintenance.py partition-init                       # yearly partitions (one-off, see partition_helper)
+    python maintenance.py add-partition --year 2026            # next year's partitions, ahead of time
+    python maintenance.py archive-partitions --before 2005     # move old years to <table>_archive_<year>
+    python maintenance.py run-jobs                             # process waiting background jobs, delete expired exports, then exit
+    python maintenance.py import-products feed.csv             # insert or update products from a CSV file
+"""
+import argparse
+import os
+import sys
+from datetime import date
+
+from dotenv import load_dotenv
+
+from db_helper import DatabaseHandler
+import partition_helper
+from job_helper import JobQueue, DATABASE_JOBS
+from product_helper import import_products_csv
+
+
+def rebuild_rollups(db, args):
+    days = db.rebuild_productline_rollup(args.start, args.end)
+    if days is None:
+        print("Rollup rebuild failed.")
+        return 2
+    print(f"Rebuilt productline_daily for {days} order day(s).")
+    return 0
+
+
+def reconcile_balances(db, args):
+    mismatches = db.reconcile_customer_balances(fix=not args.dry_run)
+    if mismatches is None:
+        print("Balance reconciliation failed.")
+        return 2
+
+    for row in mismatches:
+        print(f"  customer {row['customerNumber']}: "
+              f"orders {row['ledgerOrders']} -> {row['totalOrders']}, "
+              f"payments {row['ledgerPayments']} -> {row['totalPayments']}")
+    action = "found" if args.dry_run else "fixed"
+    print(f"{len(mismatches)} customer balance(s) {action}.")
+    # A dry run that finds drift exits non-zero so it can be used as a check
+    return 3 if args.dry_run and mismatches else 0
+
+
+def rebuild_org_closure(db, args):
+    rows = db.rebuild_employee_closure()
+    if rows is None:
+        print("Org chart rebuild failed.")
+        return 2
+    print(f"Rebuilt employee_closure with {rows} row(s).")
+    return 0
+
+
+def partition_init(db, args):
+    years = partition_helper.init_partitions(db, args.through)
+    if years is None:
+        print("Partitioning failed.")
+        return 2
+    print(f"Partitioned orders, orderdetails and payments by year ({years[0]}-{years[-1]}).")
+    return 0
+
+
+def add_partition(db, args):
+    created = partition_helper.add_partition(db, args.year)
+    if created is None:
+        print("Adding partitions failed.")
+        return 2
+    print(f"Created {len(created)} partition(s): {', '.join(created) or 'none needed'}.")
+    return 0
+
+
+def archive_partitions(db, args):
+    archived = partition_helper.archive_partitions(db, args.before)
+    if archived is None:
+        print("Archiving failed.")
+        return 2
+    print(f"Archived {len(archived)} partition(s): {', '.join(archived) or 'nothing older'}.")
+    if archived:
+        # Those tables rebuild from the live rows and would drop the archived history
+        print("Do not run reconcile-balances or a full rebuild-rollups over archived years.")
+    return 0
+
+
+def run_jobs(db, args):
+    # Same handlers as the web workers (see create_app)
+    from routes.exports import export_report_job
+
+    queue = JobQueue(db, workers=0, output_dir=os.getenv("JOB_OUTPUT_DIR"),
+                     retention_days=int(os.getenv("JOB_OUTPUT_RETENTION_DAYS", "7")))
+    for kind, handler in DATABASE_JOBS.items():
+        queue.register(kind, handler)
+    queue.register("export_report", export_report_job)
+    os.makedirs(queue.output_dir, exist_ok=True)
+
+    processed = 0
+    while (args.limit is None or processed < args.limit) and queue.run_next(db):
+        processed += 1
+    swept = queue.sweep_outputs(db)
+    print(f"Processed {processed} job(s); deleted the files of {swept} expired export(s).")
+    return 0
+
+
+def import_products(db, args):
+    with open(args.file, "rb") as feed:
+        report = import_products_csv(db, feed)
+
+    for line, code, message in report["errors"]:
+        print(f"  line {line} {code}: {message}")
+    if report["failed"] > len(report["errors"]):
+        print(f"  ... {report['failed'] - len(report['errors'])} more")
+    print(f"{report['rows']} row(s) read: {report['inserted']} inserted, "
+          f"{report['updated']} updated, {report['failed']} skipped.")
+    return 3 if report["failed"] else 0
+
+
+def main(argv=None):
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Maintain derived tables.")
+    parser.add_argument("--host", default=os.getenv("DB_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("DB_PORT", "3306")))
+    parser.add_argument("--user", default=os.getenv("DB_USER", "root"))
+    parser.add_argument("--database", default=os.getenv("DB_NAME", "classicmodels"))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rollups = commands.add_parser("rebuild-rollups", help="recompute the daily product line rollup")
+    rollups.add_argument("--start", help="first order day to rebuild (YYYY-MM-DD)")
+    rollups.add_argument("--end", help="order day to stop before (YYYY-MM-DD)")
+    rollups.set_defaults(handler=rebuild_rollups)
+
+    balances = commands.add_parser("reconcile-balances", help="check customer_balances against orders and payments")
+    balances.add_argument("--dry-run", action="store_true", help="only report mismatches")
+    balances.set_defaults(handler=reconcile_balances)
+
+    closure = commands.add_parser("rebuild-org-closure", help="recompute employee_closure from reportsTo")
+    closure.set_defaults(handler=rebuild_org_closure)
+
+    partitions = commands.add_parser("partition-init", help="partition orders, orderdetails and payments by year")
+    partitions.add_argument("--through", type=int, help="last year to create a partition for (default: next year)")
+    partitions.set_defaults(handler=partition_init)
+
+    next_year = date.today().year + 1
+    add = commands.add_parser("add-partition", help="create the partitions for a coming year")
+    add.add_argument("--year", type=int, default=next_year, help=f"year to add (default: {next_year})")
+    add.set_defaults(handler=add_partition)
+
+    archive = commands.add_parser("archive-partitions", help="move old yearly partitions into archive tables")
+    archive.add_argument("--before", type=int, required=True, help="archive every year older than this")
+    archive.set_defaults(handler=archive_partitions)
+
+    jobs = commands.add_parser("run-jobs", help="process the background jobs waiting in the queue")
+    jobs.add_argument("--limit", type=int, help="stop after this many jobs")
+    jobs.set_defaults(handler=run_jobs)
+
+    products = commands.add_parser("import-products", help="insert or update products from a CSV file")
+    products.add_argument("file", help="CSV file with a header row naming the product columns")
+    products.set_defaults(handler=import_products)
+
+    args = parser.parse_args(argv)
+
+    password = os.getenv("DB_PASSWORD")
+    if not password:
+        print("DB_PASSWORD environment variable not set. Please create a .env file.")
+        return 1
+
+    db = DatabaseHandler(host=args.host, port=args.port, user=args.user, password=password, database=args.database)
+    try:
+        return args.handler(db, args)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+Applies versioned schema migrations from migrations/ to an existing database.
+
+Each migration is a file named NNNN_description.sql. Applied versions are
+recorded in the schema_migrations table, so running the script again only
+applies what is missing. DDL is written to run online (ALGORITHM=INPLACE,
+LOCK=NONE) and a short lock_wait_timeout keeps a migration from queueing
+live traffic behind it while it waits for a metadata lock.
+
+Usage:
+    python migrate.py                 # apply all pending migrations
+    python migrate.py --status        # list applied / pending versions
+    python migrate.py --target 1      # apply up to and including version 1
+"""
+import argparse
+import os
+import re
+import sys
+
+import mysql.connector
+from dotenv import load_dotenv
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+# Errors meaning a statement's effect is already in place
+# (e.g. a migration interrupted halfway and re-run, since DDL cannot be rolled back).
+ALREADY_APPLIED_ERRORS = {
+    1050,  # Table already exists
+    1060,  # Duplicate column name
+    1061,  # Duplicate key name
+    1091,  # Can't DROP; check that column/key exists
+}
+
+LOCK_NAME = "classicmodels_schema_migrate"
+
+
+def load_migrations():
+    """Returns [(version, name, path)] sorted by version."""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return migrations
+
+
+def split_statements(sql):
+    """Splits a migration file into statements (one per trailing ';'), dropping comment lines."""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    statements = re.split(r";\s*$", "\n".join(lines), flags=re.MULTILINE)
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version   INT          NOT NULL,
+            name      VARCHAR(255) NOT NULL,
+            appliedAt DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (version)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """)
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def current_version(cursor):
+    """Highest applied migration version (0 for a database that has none)."""
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cursor.fetchone()[0]
+
+
+def apply_migration(conn, cursor, version, name, path):
+    with open(path, encoding="utf-8") as f:
+        statements = split_statements(f.read())
+
+    for statement in statements:
+        try:
+            cursor.execute(statement)
+            # Drain results of statements that return rows (e.g. backfill SELECTs)
+            if cursor.with_rows:
+                cursor.fetchall()
+        except mysql.connector.Error as err:
+            if err.errno in ALREADY_APPLIED_ERRORS:
+                print(f"  skipped (already applied): {err.msg}")
+                continue
+            raise
+
+    cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+    conn.commit()
+
+
+def migrate(conn, target=None, lock_wait_timeout=10):
+    """Applies pending migrations up to target (all if None). Returns the versions applied."""
+    cursor = conn.cursor()
+    cursor.execute("SET SESSION lock_wait_timeout = %s", (lock_wait_timeout,))
+
+    # Only one runner at a time, e.g. when several app servers deploy together
+    cursor.execute("SELECT GET_LOCK(%s, 0)", (LOCK_NAME,))
+    if cursor.fetchone()[0] != 1:
+        raise RuntimeError("Another migration run holds the lock.")
+
+    try:
+        ensure_migrations_table(cursor)
+        done = applied_versions(cursor)
+        applied = []
+
+        for version, name, path in load_migrations():
+            if version in done or (target is not None and version > target):
+                continue
+            print(f"Applying {version:04d}_{name} ...")
+            apply_migration(conn, cursor, version, name, path)
+            applied.append(version)
+
+        return applied
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cursor.fetchall()
+        cursor.close()
+
+
+def print_status(conn):
+    cursor = conn.cursor()
+    ensure_migrations_table(cursor)
+    done = applied_versions(cursor)
+    print(f"Current schema version: {current_version(cursor)}")
+    for version, name, _ in load_migrations():
+        state = "applied" if version in done else "pending"
+        print(f"  {version:04d}_{name}: {state}")
+    cursor.close()
+
+
+def main(argv=None):
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations.")
+    parser.add_argument("--host", default=os.getenv("DB_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("DB_PORT", "3306")))
+    parser.add_argument("--user", default=os.getenv("DB_USER", "root"))
+    parser.add_argument("--database", default=os.getenv("DB_NAME", "classicmodels"))
+    parser.add_argument("--target", type=int, help="apply migrations up to this version")
+    parser.add_argument("--status", action="store_true", help="show applied and pending migrations")
+    parser.add_argument("--lock-wait-timeout", type=int, default=10,
+                        help="seconds a DDL statement may wait for a metadata lock")
+    args = parser.parse_args(argv)
+
+    password = os.getenv("DB_PASSWORD")
+    if not password:
+        print("DB_PASSWORD environment variable not set. Please create a .env file.")
+        return 1
+
+    conn = mysql.connector.connect(
+        host=args.host,
+        port=args.port,
+        user=args.user,
+        password=password,
+        database=args.database
+    )
+    try:
+        if args.status:
+            print_status(conn)
+            return 0
+
+        applied = migrate(conn, target=args.target, lock_wait_timeout=args.lock_wait_timeout)
+        if applied:
+            print(f"Applied {len(applied)} migration(s).")
+        else:
+            print("Schema is up to date.")
+        return 0
+    except mysql.connector.Error as err:
+        print(f"Migration failed: {err}")
+        return 2
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
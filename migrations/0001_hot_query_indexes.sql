@@ -0,0 +1,32 @@
+-- Indexes for the columns the hot queries filter and sort on.
+-- Built in place without blocking reads or writes on the table.
+
+-- get_customer_orders / get_filtered_orders: one customer's orders by date
+ALTER TABLE `orders`
+  ADD INDEX `idx_orders_customer_date` (`customerNumber`, `orderDate`),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+-- report_productlines: status + orderDate range
+ALTER TABLE `orders`
+  ADD INDEX `idx_orders_status_date` (`status`, `orderDate`),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+-- get_customer_payments: one customer's payments, newest first
+ALTER TABLE `payments`
+  ADD INDEX `idx_payments_customer_date` (`customerNumber`, `paymentDate`),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+-- customer_signup: duplicate phone check
+ALTER TABLE `customers`
+  ADD INDEX `idx_customers_phone` (`phone`),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+-- fire_sales_rep: other Sales Reps in the same office
+ALTER TABLE `employees`
+  ADD INDEX `idx_employees_office_title` (`officeCode`, `jobTitle`),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+-- report_productlines / sort_popular_products: order lines per product
+ALTER TABLE `orderdetails`
+  ADD INDEX `idx_orderdetails_product_order` (`productCode`, `orderNumber`),
+  ALGORITHM=INPLACE, LOCK=NONE;
@@ -0,0 +1,24 @@
+-- Daily per-product-line rollup for the product line report.
+-- One row per (day, status, productLine) with summable measures and
+-- mergeable distinct sketches (see sketch_helper.DistinctSketch).
+-- Rows are refreshed by DatabaseHandler on order writes; fill or repair
+-- the table with: python maintenance.py rebuild-rollups
+
+CREATE TABLE IF NOT EXISTS `productline_daily` (
+  `day`             date          NOT NULL,
+  `status`          varchar(15)   NOT NULL,
+  `productLine`     varchar(50)   NOT NULL,
+  `orderLines`      int(11)       NOT NULL DEFAULT 0,
+  `unitsSold`       int(11)       NOT NULL DEFAULT 0,
+  `revenue`         decimal(14,2) NOT NULL DEFAULT 0,
+  `estCOGS`         decimal(14,2) NOT NULL DEFAULT 0,
+  `customerSketch`  blob          NOT NULL,
+  `productSketch`   blob          NOT NULL,
+  PRIMARY KEY (`day`, `status`, `productLine`),
+  KEY `idx_productline_daily_status_day` (`status`, `day`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- Rollup refreshes select the order lines of a set of days
+ALTER TABLE `orders`
+  ADD INDEX `idx_orders_date` (`orderDate`),
+  ALGORITHM=INPLACE, LOCK=NONE;
@@ -0,0 +1,36 @@
+-- Running per-customer balance: shipped order value and payments received.
+-- Kept in step by the DatabaseHandler write methods inside their own
+-- transactions; check or repair with: python maintenance.py reconcile-balances
+-- Line amounts are rounded per line, as in DatabaseHandler.
+
+CREATE TABLE IF NOT EXISTS `customer_balances` (
+  `customerNumber` int(11)       NOT NULL,
+  `totalOrders`    decimal(14,2) NOT NULL DEFAULT 0,
+  `totalPayments`  decimal(14,2) NOT NULL DEFAULT 0,
+  `updatedAt`      timestamp     NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`customerNumber`),
+  CONSTRAINT `customer_balances_ibfk_1`
+    FOREIGN KEY (`customerNumber`) REFERENCES `customers` (`customerNumber`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+INSERT INTO `customer_balances` (`customerNumber`, `totalOrders`, `totalPayments`)
+SELECT
+    c.customerNumber,
+    IFNULL(shipped.total, 0),
+    IFNULL(paid.total, 0)
+FROM customers c
+LEFT JOIN (
+    SELECT o.customerNumber, SUM(CAST(od.quantityOrdered * od.priceEach AS DECIMAL(14,2))) AS total
+    FROM orders o
+    JOIN orderdetails od ON od.orderNumber = o.orderNumber
+    WHERE o.status = 'Shipped'
+    GROUP BY o.customerNumber
+) shipped ON shipped.customerNumber = c.customerNumber
+LEFT JOIN (
+    SELECT customerNumber, SUM(amount) AS total
+    FROM payments
+    GROUP BY customerNumber
+) paid ON paid.customerNumber = c.customerNumber
+ON DUPLICATE KEY UPDATE
+    totalOrders = VALUES(totalOrders),
+    totalPayments = VALUES(totalPayments);
@@ -0,0 +1,28 @@
+-- Closure table of the reporting hierarchy (employees.reportsTo):
+-- one row per (ancestor, descendant) pair, including depth 0 for each
+-- employee itself, so "everyone under X" and "everyone above X" are
+-- single indexed lookups. Maintained by DatabaseHandler.add_employee
+-- and fire_sales_rep.
+
+CREATE TABLE IF NOT EXISTS `employee_closure` (
+  `ancestorNumber`   int(11) NOT NULL,
+  `descendantNumber` int(11) NOT NULL,
+  `depth`            int(11) NOT NULL,
+  PRIMARY KEY (`ancestorNumber`, `descendantNumber`),
+  KEY `idx_employee_closure_descendant` (`descendantNumber`, `depth`),
+  CONSTRAINT `employee_closure_ancestor_fk`
+    FOREIGN KEY (`ancestorNumber`) REFERENCES `employees` (`employeeNumber`),
+  CONSTRAINT `employee_closure_descendant_fk`
+    FOREIGN KEY (`descendantNumber`) REFERENCES `employees` (`employeeNumber`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+INSERT IGNORE INTO `employee_closure` (`ancestorNumber`, `descendantNumber`, `depth`)
+WITH RECURSIVE chain AS (
+    SELECT employeeNumber AS ancestorNumber, employeeNumber AS descendantNumber, 0 AS depth
+    FROM employees
+    UNION ALL
+    SELECT chain.ancestorNumber, e.employeeNumber, chain.depth + 1
+    FROM chain
+    JOIN employees e ON e.reportsTo = chain.descendantNumber
+)
+SELECT ancestorNumber, descendantNumber, depth FROM chain;
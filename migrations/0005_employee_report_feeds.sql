@@ -0,0 +1,20 @@
+-- Keyset pagination of the dashboard report feeds on (reportDate, reportId).
+-- reportDate becomes NOT NULL so the cursor comparison never meets a NULL;
+-- rows without a date sort after every dated report, as they did before.
+UPDATE `employee_reports` SET `reportDate` = '1970-01-01 00:00:00' WHERE `reportDate` IS NULL;
+
+ALTER TABLE `employee_reports`
+  MODIFY `reportDate` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+-- get_employee_reports: one employee's feed (also serves the employeeNumber foreign key)
+ALTER TABLE `employee_reports`
+  ADD INDEX `idx_employee_reports_feed` (`employeeNumber`, `reportDate`, `reportId`),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+-- get_subordinate_reports: organization-wide feed, read newest first and filtered through employee_closure
+ALTER TABLE `employee_reports`
+  ADD INDEX `idx_employee_reports_date` (`reportDate`, `reportId`),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+-- Superseded by idx_employee_reports_feed
+ALTER TABLE `employee_reports` DROP INDEX `employeeNumber`;
@@ -0,0 +1,27 @@
+-- Background jobs (see job_helper.py): slow administrative operations and
+-- report exports are queued here and run by worker threads, which claim
+-- rows with FOR UPDATE SKIP LOCKED and hold them under a lease.
+
+CREATE TABLE IF NOT EXISTS `jobs` (
+  `jobId`           bigint       NOT NULL AUTO_INCREMENT,
+  `kind`            varchar(40)  NOT NULL,
+  `params`          text         NOT NULL,
+  `status`          enum('queued','running','done','failed','cancelled') NOT NULL DEFAULT 'queued',
+  `attempts`        int          NOT NULL DEFAULT 0,
+  `maxAttempts`     int          NOT NULL DEFAULT 3,
+  `cancelRequested` tinyint(1)   NOT NULL DEFAULT 0,
+  `requestedByType` varchar(10)  DEFAULT NULL,
+  `requestedBy`     int          DEFAULT NULL,
+  `result`          text         DEFAULT NULL,
+  `error`           text         DEFAULT NULL,
+  `availableAt`     datetime     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `leaseUntil`      datetime     DEFAULT NULL,
+  `createdAt`       datetime     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `startedAt`       datetime     DEFAULT NULL,
+  `finishedAt`      datetime     DEFAULT NULL,
+  PRIMARY KEY (`jobId`),
+  -- Worker claim: next runnable job
+  KEY `idx_jobs_claim` (`status`, `availableAt`),
+  -- "My jobs" list
+  KEY `idx_jobs_requester` (`requestedByType`, `requestedBy`, `jobId`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
@@ -0,0 +1,7 @@
+-- Optimistic concurrency for order edits. Every edit to an order (status,
+-- comment, order lines) bumps rowVersion; edit forms send back the version they
+-- were rendered with and the UPDATE only matches while it is unchanged (see
+-- DatabaseHandler._order_guard).
+ALTER TABLE `orders`
+  ADD COLUMN `rowVersion` int unsigned NOT NULL DEFAULT 1,
+  ALGORITHM=INSTANT;
@@ -0,0 +1,15 @@
+-- Order number allocation. Once partition-init widens the primary key of
+-- orders to (orderNumber, orderDate), nothing in the schema keeps orderNumber
+-- unique, so checkouts take the next number from this single row (locked FOR
+-- UPDATE until their order commits; see DatabaseHandler.create_order_transaction).
+
+CREATE TABLE IF NOT EXISTS `order_numbers` (
+  `id`              tinyint NOT NULL,
+  `lastOrderNumber` int(11) NOT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+INSERT INTO `order_numbers` (`id`, `lastOrderNumber`)
+SELECT 1, IFNULL(MAX(orderNumber), 0) FROM orders
+ON DUPLICATE KEY UPDATE
+    lastOrderNumber = GREATEST(lastOrderNumber, VALUES(lastOrderNumber));
@@ -0,0 +1,234 @@
+"""
+Yearly RANGE partitioning of the order history (orders, orderdetails, payments).
+
+orders and payments are partitioned on their date column, one partition per
+calendar year (p2003, p2004, ...) plus a pmax catch-all. orderdetails has no
+date, so it is partitioned on orderNumber with each year ending at the first
+order of the next year; its newest years share pmax until the year is closed.
+Order numbers grow with order dates, so a year's lines sit in the same
+partition as its orders and the join prunes the same way.
+
+MySQL does not allow foreign keys on partitioned tables, and every unique key
+must contain the partitioning column, so init_partitions drops the foreign
+keys of these tables and widens their primary keys. DatabaseHandler deletes
+child rows explicitly and checks checkNumber uniqueness itself; order numbers
+come from the order_numbers counter (migrations/0008_order_numbers.sql).
+"""
+from datetime import date
+
+# Table -> (partitioning expression, partitioned by year of a date column?)
+PARTITIONED_TABLES = {
+    "orders": ("RANGE COLUMNS(orderDate)", True),
+    "payments": ("RANGE COLUMNS(paymentDate)", True),
+    "orderdetails": ("RANGE (orderNumber)", False),
+}
+
+# Primary keys widened to include the partitioning column
+PARTITION_PRIMARY_KEYS = {
+    "orders": "(orderNumber, orderDate)",
+    "payments": "(checkNumber, paymentDate)",
+    "orderdetails": "(orderDetailsNumber, orderNumber)",
+}
+
+
+def partition_name(year):
+    return f"p{year}"
+
+
+def partition_years(db, table):
+    """Years that have their own partition in the table, oldest first ([] if the table is not partitioned)."""
+    rows = db.execute_query("""
+        SELECT PARTITION_NAME AS name FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """, (table,))
+    if rows is None:
+        return None
+    return [int(row["name"][1:]) for row in rows if row["name"] != "pmax"]
+
+
+def is_partitioned(db):
+    rows = db.execute_query("""
+        SELECT 1 AS found FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'orders' AND PARTITION_NAME IS NOT NULL
+    """)
+    return bool(rows)
+
+
+def first_order_of_year(db, year):
+    """Lowest orderNumber dated in or after the given year, or None if there is none yet."""
+    row = db.execute_query(
+        "SELECT MIN(orderNumber) AS first FROM orders WHERE orderDate >= %s",
+        (date(year, 1, 1),), fetchone=True
+    )
+    return row["first"] if row else None
+
+
+def _date_partition(year):
+    return f"PARTITION {partition_name(year)} VALUES LESS THAN ('{year + 1}-01-01')"
+
+
+def _order_partition(year, boundary):
+    return f"PARTITION {partition_name(year)} VALUES LESS THAN ({int(boundary)})"
+
+
+PMAX = "PARTITION pmax VALUES LESS THAN (MAXVALUE)"
+
+
+def _closed_order_years(db, years):
+    """
+    (year, first orderNumber of the following year) for each year that has ended
+    in the data. Years without orders get no partition, since range boundaries
+    must strictly increase.
+    """
+    closed = []
+    for year in years:
+        boundary = first_order_of_year(db, year + 1)
+        if boundary is None:
+            break
+        if closed and boundary == closed[-1][1]:
+            continue
+        closed.append((year, boundary))
+    return closed
+
+
+def _invalidate_partitioned(db):
+    """
+    DDL is not seen by DatabaseHandler's write tracking, so evict the order
+    history from this process's caches and, over the invalidation bus, from
+    those of the running web processes.
+    """
+    db._invalidate(*PARTITIONED_TABLES)
+
+
+def _ddl(db, statement, params=None):
+    """Runs one DDL statement; returns False (the error is printed by execute_query) on failure."""
+    return db.execute_query(statement, params) is not None
+
+
+def init_partitions(db, through_year=None):
+    """
+    Converts orders, orderdetails and payments to yearly partitions covering
+    every year with data up to through_year (default: next year).
+    Returns the list of years partitioned, or None on error.
+    """
+    if is_partitioned(db):
+        print("orders is already partitioned; use add-partition instead.")
+        return None
+    if not db.execute_query("""
+        SELECT 1 AS found FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'order_numbers'
+    """):
+        print("order_numbers is missing; apply migrations/0008_order_numbers.sql first (python migrate.py).")
+        return None
+
+    row = db.execute_query("""
+        SELECT LEAST(
+            (SELECT IFNULL(MIN(YEAR(orderDate)), YEAR(CURDATE())) FROM orders),
+            (SELECT IFNULL(MIN(YEAR(paymentDate)), YEAR(CURDATE())) FROM payments)
+        ) AS first_year
+    """, fetchone=True)
+    if row is None:
+        return None
+    years = list(range(row["first_year"], (through_year or date.today().year + 1) + 1))
+
+    tables = tuple(PARTITIONED_TABLES)
+    foreign_keys = db.execute_query(f"""
+        SELECT TABLE_NAME AS table_name, CONSTRAINT_NAME AS name
+        FROM information_schema.REFERENTIAL_CONSTRAINTS
+        WHERE CONSTRAINT_SCHEMA = DATABASE()
+          AND (TABLE_NAME IN ({", ".join(["%s"] * len(tables))})
+               OR REFERENCED_TABLE_NAME IN ({", ".join(["%s"] * len(tables))}))
+    """, tables + tables)
+    if foreign_keys is None:
+        return None
+    for fk in foreign_keys:
+        if not _ddl(db, f"ALTER TABLE `{fk['table_name']}` DROP FOREIGN KEY `{fk['name']}`"):
+            return None
+
+    try:
+        closed = _closed_order_years(db, years)
+        for table, (expression, by_date) in PARTITIONED_TABLES.items():
+            if by_date:
+                partitions = [_date_partition(year) for year in years]
+            else:
+                partitions = [_order_partition(year, boundary) for year, boundary in closed]
+            partitions.append(PMAX)
+            statement = f"""
+                ALTER TABLE `{table}`
+                  DROP PRIMARY KEY, ADD PRIMARY KEY {PARTITION_PRIMARY_KEYS[table]}
+                PARTITION BY {expression} ({", ".join(partitions)})
+            """
+            if not _ddl(db, statement):
+                return None
+        return years
+    finally:
+        _invalidate_partitioned(db)
+
+
+def add_partition(db, year):
+    """
+    Splits the year off the pmax partition of orders and payments (meant to run
+    ahead of time, while pmax is still empty) and closes every ended year of
+    orderdetails. Returns the names of the partitions created, or None on error.
+    """
+    if not is_partitioned(db):
+        print("orders is not partitioned yet; run partition-init first.")
+        return None
+
+    created = []
+    for table, (_, by_date) in PARTITIONED_TABLES.items():
+        years = partition_years(db, table)
+        if years is None:
+            return None
+        if by_date:
+            if year in years:
+                continue
+            if years and year < years[-1]:
+                print(f"{table}: {year} is older than the newest partition {partition_name(years[-1])}.")
+                return None
+            # Any years skipped in between get their own partitions too
+            first = years[-1] + 1 if years else year
+            partitions = [_date_partition(y) for y in range(first, year + 1)]
+        else:
+            first = years[-1] + 1 if years else year
+            partitions = [_order_partition(y, b) for y, b in _closed_order_years(db, range(first, year))]
+            if not partitions:
+                continue
+        statement = f"ALTER TABLE `{table}` REORGANIZE PARTITION pmax INTO ({', '.join(partitions + [PMAX])})"
+        if not _ddl(db, statement):
+            return None
+        created += [f"{table}.{p.split()[1]}" for p in partitions]
+    return created
+
+
+def archive_partitions(db, before_year):
+    """
+    Moves every yearly partition older than before_year out of the live tables
+    into stand-alone tables named <table>_archive_<year> (EXCHANGE PARTITION,
+    so no rows are copied), then drops the emptied partitions.
+    customer_balances and productline_daily still count the archived years.
+    Returns the names of the archive tables, or None on error.
+    """
+    archived = []
+    try:
+        for table in PARTITIONED_TABLES:
+            years = partition_years(db, table)
+            if years is None:
+                return None
+            for year in [y for y in years if y < before_year]:
+                archive = f"{table}_archive_{year}"
+                steps = [
+                    f"CREATE TABLE `{archive}` LIKE `{table}`",
+                    f"ALTER TABLE `{archive}` REMOVE PARTITIONING",
+                    f"ALTER TABLE `{table}` EXCHANGE PARTITION {partition_name(year)} WITH TABLE `{archive}`",
+                    f"ALTER TABLE `{table}` DROP PARTITION {partition_name(year)}",
+                ]
+                for statement in steps:
+                    if not _ddl(db, statement):
+                        return None
+                archived.append(archive)
+        return archived
+    finally:
+        # Also after a failure part way: earlier years may already be gone
+        _invalidate_partitioned(db)
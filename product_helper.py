@@ -0,0 +1,168 @@
+"""
+Product validation shared by the product form and the CSV catalog import.
+
+The import reads an uploaded CSV file row by row (header row with the
+PRODUCT_FIELDS column names, extra columns ignored), validates each row like
+the form does, with the product lines checked against one in-memory set, and
+writes IMPORT_CHUNK_ROWS valid rows at a time with DatabaseHandler.upsert_products:
+new product codes are inserted, existing ones updated. A bad row is reported
+with its line number and skipped; the rest of the file is still loaded.
+"""
+import csv
+import io
+
+PRODUCT_FIELDS = (
+    "productCode", "productName", "productLine", "productScale",
+    "productVendor", "productDescription", "quantityInStock", "buyPrice", "MSRP",
+)
+
+# Column sizes of the products table
+MAX_LENGTHS = (
+    ("productCode", "Product code", 15),
+    ("productName", "Product name", 70),
+    ("productLine", "Product line", 50),
+    ("productScale", "Product scale", 10),
+    ("productVendor", "Product vendor", 50),
+)
+# quantityInStock is a SMALLINT
+MAX_QUANTITY_IN_STOCK = 32767
+
+# Valid rows written per INSERT ... ON DUPLICATE KEY UPDATE
+IMPORT_CHUNK_ROWS = 1000
+# Rows listed in an import report; errors beyond these are only counted
+IMPORT_MAX_REPORTED_ERRORS = 200
+
+
+def product_line_names(db):
+    """The existing product lines as a set (served from the catalog cache)."""
+    return {row["productLine"] for row in db.get_productlines() or []}
+
+
+def validate_product(fields, product_lines, with_code=True):
+    """
+    Checks a product's fields (strings, e.g. request.form or a CSV row) against
+    the products table: required fields, lengths, numbers, MSRP >= buyPrice and
+    an existing product line. with_code=False skips productCode (edit form).
+    Returns (product_info, errors); product_info is the insert_product tuple,
+    or None when there are errors.
+    """
+    values = {field: (fields.get(field) or "").strip() for field in PRODUCT_FIELDS}
+    errors = []
+
+    # --- Required field checks ---
+    required = PRODUCT_FIELDS if with_code else PRODUCT_FIELDS[1:]
+    if not all(values[field] for field in required):
+        errors.append("All fields are required.")
+
+    # --- Length checks based on table schema ---
+    for field, label, limit in MAX_LENGTHS:
+        if (with_code or field != "productCode") and len(values[field]) > limit:
+            errors.append(f"{label} cannot exceed {limit} characters.")
+
+    # --- Numeric conversions & validation ---
+    quantity_in_stock = buy_price = msrp = None
+
+    if values["quantityInStock"]:
+        try:
+            quantity_in_stock = int(values["quantityInStock"])
+            if quantity_in_stock < 0:
+                errors.append("Quantity in stock cannot be negative.")
+            elif quantity_in_stock > MAX_QUANTITY_IN_STOCK:
+                errors.append(f"Quantity in stock cannot exceed {MAX_QUANTITY_IN_STOCK}.")
+        except ValueError:
+            errors.append("Quantity in stock must be an integer.")
+
+    if values["buyPrice"]:
+        try:
+            buy_price = float(values["buyPrice"])
+            if buy_price <= 0:
+                errors.append("Buy price must be positive.")
+        except ValueError:
+            errors.append("Buy price must be a valid number.")
+
+    if values["MSRP"]:
+        try:
+            msrp = float(values["MSRP"])
+            if msrp <= 0:
+                errors.append("MSRP must be positive.")
+        except ValueError:
+            errors.append("MSRP must be a valid number.")
+
+    # --- Logical check: MSRP >= buyPrice ---
+    if buy_price is not None and msrp is not None and msrp < buy_price:
+        errors.append("MSRP should not be lower than buy price.")
+
+    # --- Check productLine exists ---
+    if values["productLine"] and values["productLine"] not in product_lines:
+        errors.append("Product line does not exist.")
+
+    if errors:
+        return None, errors
+    return (
+        values["productCode"], values["productName"], values["productLine"],
+        values["productScale"], values["productVendor"], values["productDescription"],
+        quantity_in_stock, buy_price, msrp,
+    ), []
+
+
+def import_products_csv(db, stream, chunk_rows=IMPORT_CHUNK_ROWS):
+    """
+    Loads products from a binary CSV stream (e.g. an upload's FileStorage.stream).
+    Returns a report: rows read, products inserted and updated, rows failed,
+    and errors as (line number, productCode, message), the first
+    IMPORT_MAX_REPORTED_ERRORS of them.
+    """
+    report = {"rows": 0, "inserted": 0, "updated": 0, "failed": 0, "errors": []}
+
+    def fail(line, code, message):
+        report["failed"] += 1
+        if len(report["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            report["errors"].append((line, code, message))
+
+    try:
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+        missing = [field for field in PRODUCT_FIELDS if field not in (reader.fieldnames or [])]
+    except (UnicodeDecodeError, csv.Error) as err:
+        fail(1, "", f"Could not read the file as CSV: {err}")
+        return report
+    if missing:
+        fail(1, "", f"Missing columns: {', '.join(missing)}.")
+        return report
+
+    product_lines = product_line_names(db)
+    seen_codes = set()
+    chunk, chunk_lines = [], {}
+
+    def flush():
+        inserted, updated, failures = db.upsert_products(chunk)
+        report["inserted"] += inserted
+        report["updated"] += updated
+        for code, message in failures:
+            fail(chunk_lines[code], code, message)
+        chunk.clear()
+        chunk_lines.clear()
+
+    try:
+        for row in reader:
+            report["rows"] += 1
+            line = reader.line_num
+            code = (row.get("productCode") or "").strip()
+
+            product_info, errors = validate_product(row, product_lines)
+            if not errors and code.lower() in seen_codes:
+                errors = ["Product code appears more than once in the file."]
+            if errors:
+                fail(line, code, " ".join(errors))
+                continue
+
+            seen_codes.add(code.lower())
+            chunk.append(product_info)
+            chunk_lines[code] = line
+            if len(chunk) >= chunk_rows:
+                flush()
+    except (UnicodeDecodeError, csv.Error) as err:
+        fail(reader.line_num, "", f"Stopped reading the file: {err}")
+
+    if chunk:
+        flush()
+    return report
@@ -0,0 +1,174 @@
+"""
+Read replicas for DatabaseHandler.
+
+DB_REPLICAS lists replica servers as comma-separated host[:port] entries; they
+share the primary's user, password and database. execute_query sends plain
+reads (SELECT or WITH, outside a transaction, without a locking clause) to the
+replicas in turn; writes, transactions and locking reads stay on the primary.
+
+Read-your-writes: during a request (begin/end, see create_app) a write routes
+the rest of the request to the primary, and the app records it in the session
+so the same user keeps reading from the primary for STICKY_SECONDS, longer
+than replication is expected to lag. A replica that fails is skipped for
+RETRY_SECONDS; with none left, reads go to the primary.
+"""
+import os
+import re
+import threading
+import time
+
+import mysql.connector
+
+# Seconds a user's reads stay on the primary after they wrote
+STICKY_SECONDS = 5
+# Seconds before a failed replica is tried again
+RETRY_SECONDS = 30
+
+READ_STATEMENT = re.compile(r"^\s*\(?\s*(SELECT|WITH)\b", re.IGNORECASE)
+LOCKING_CLAUSE = re.compile(r"\bFOR\s+(?:UPDATE|SHARE)\b|\bLOCK\s+IN\s+SHARE\s+MODE\b", re.IGNORECASE)
+# A WITH clause can also lead an UPDATE or DELETE
+DATA_CHANGE = re.compile(r"\b(?:INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+
+
+def is_plain_read(query):
+    """True for a SELECT (or WITH ... SELECT) that takes no locks."""
+    match = READ_STATEMENT.match(query)
+    if not match or LOCKING_CLAUSE.search(query):
+        return False
+    return match.group(1).upper() == "SELECT" or not DATA_CHANGE.search(query)
+
+
+def parse_replicas(setting, port=3306):
+    """'db2:3307, db3' -> [("db2", 3307), ("db3", 3306)]."""
+    replicas = []
+    for entry in (setting or "").split(","):
+        entry = entry.strip()
+        if entry:
+            host, _, entry_port = entry.partition(":")
+            replicas.append((host, int(entry_port) if entry_port else port))
+    return replicas
+
+
+class ReplicaPool:
+    """
+    One lazily opened connection per replica and process, used round-robin.
+    A pool belongs to one DatabaseHandler; worker_handle gives background
+    threads a fresh() pool of their own.
+    """
+
+    def __init__(self, replicas, connect_args):
+        self.replicas = list(replicas)
+        self.connect_args = connect_args
+        self._conns = {}
+        self._conns_pid = None
+        self._inherited = []
+        self._down_until = {}
+        self._next = 0
+        self._local = threading.local()
+        self.reads = 0
+        self.fallbacks = 0
+
+    def fresh(self):
+        return ReplicaPool(self.replicas, self.connect_args)
+
+    def _args(self, index):
+        host, port = self.replicas[index]
+        return {**self.connect_args, "host": host, "port": port}
+
+    # --- Read-your-writes ---
+
+    def begin(self, primary=False):
+        """Starts a request; primary=True while the user's recent write may not have replicated yet."""
+        self._local.active = True
+        self._local.primary = primary
+        self._local.wrote = False
+
+    def end(self):
+        """Ends the request; returns True if it wrote."""
+        wrote = getattr(self._local, "wrote", False)
+        self._local.active = False
+        self._local.primary = False
+        self._local.wrote = False
+        return wrote
+
+    def note_write(self):
+        """Called for every committed write: the rest of the request reads from the primary."""
+        if getattr(self._local, "active", False):
+            self._local.wrote = True
+            self._local.primary = True
+
+    @property
+    def primary_reads(self):
+        return getattr(self._local, "primary", False)
+
+    # --- Connections ---
+
+    def _candidates(self):
+        """Replica indexes to try, starting with the next in turn and skipping failed ones."""
+        now = time.monotonic()
+        count = len(self.replicas)
+        start, self._next = self._next, (self._next + 1) % count
+        return [i % count for i in range(start, start + count)
+                if self._down_until.get(i % count, 0) <= now]
+
+    def _cursor(self, index):
+        if self._conns_pid != os.getpid():
+            # Never use a socket inherited from the parent process (see DatabaseHandler)
+            self._inherited.extend(self._conns.values())
+            self._conns = {}
+            self._conns_pid = os.getpid()
+        if index not in self._conns:
+            conn = mysql.connector.connect(**self._args(index))
+            self._conns[index] = (conn, conn.cursor(dictionary=True, buffered=True))
+        return self._conns[index][1]
+
+    def _mark_down(self, index, err):
+        host, port = self.replicas[index]
+        print(f"Replica {host}:{port} unavailable, using the others for {RETRY_SECONDS}s: {err}")
+        self._down_until[index] = time.monotonic() + RETRY_SECONDS
+        conn, _ = self._conns.pop(index, (None, None))
+        if conn is not None:
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+
+    def read(self, query, params=None, fetchone=False):
+        """
+        Runs a read on a replica. Returns (True, rows), or (False, None) if no
+        replica could be reached. SQL errors are raised as from the primary.
+        """
+        for index in self._candidates():
+            try:
+                cursor = self._cursor(index)
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                self.reads += 1
+                return True, cursor.fetchone() if fetchone else cursor.fetchall()
+            except (mysql.connector.InterfaceError, mysql.connector.OperationalError) as err:
+                self._mark_down(index, err)
+        self.fallbacks += 1
+        return False, None
+
+    def stream_args(self):
+        """Connection arguments of the next available replica, for stream_query; None if there is none."""
+        candidates = self._candidates()
+        return self._args(candidates[0]) if candidates else None
+
+    def close(self):
+        if self._conns_pid != os.getpid():
+            return
+        for conn, cursor in self._conns.values():
+            cursor.close()
+            conn.close()
+        self._conns = {}
+
+    def stats(self):
+        return {
+            "replicas": [f"{host}:{port}" for host, port in self.replicas],
+            "reads": self.reads,
+            "fallbacks": self.fallbacks,
+            "down": sorted(i for i, until in self._down_until.items() if until > time.monotonic()),
+        }
@@ -33,6 +33,7 @@ def init_auth_routes(app, database):
                     session["user_type"] = "customer"
                     session["user_number"] = customer["customerNumber"]
                     session["user_name"] = customer["contactFirstName"]
+                    db.get_principal("customer", customer["customerNumber"])
                     flash("Login successful as Customer!", "success")
                     return redirect(url_for('index'))
                 else:
@@ -47,6 +48,8 @@ def init_auth_routes(app, database):
                     session["user_name"] = employee["firstName"]
                     # JobTitle data inserting to session!
                     session["job_title"] = employee["jobTitle"] 
+                    # Resolve role, office and customer set now, so later checks are cache hits
+                    db.get_principal("employee", employee["employeeNumber"])
                     
                     flash(f"Login successful as {employee['jobTitle']}!", "info")
                     return redirect(url_for('index'))
@@ -4,6 +4,17 @@ import re, mysql
 import math
 
 
+def order_filters(args):
+    """Reads the order history filters (shared by the order pages and the order export)."""
+    return {
+        'status': args.getlist('status'),
+        'categories': args.getlist('category'),
+        'price_ranges': args.getlist('price'),
+        'sort_date': args.get('sort_date', 'newest'),
+        'sort_option': args.get('sort_option', 'date_desc')
+    }
+
+
 def init_customer_routes(app, database):
     """Initialize customer-specific routes."""
     global db
@@ -43,13 +54,7 @@ def init_customer_routes(app, database):
 
         search_query = request.args.get('q', '').strip()
 
-        filters = {
-            'status': request.args.getlist('status'),
-            'categories': request.args.getlist('category'),
-            'price_ranges': request.args.getlist('price'),
-            'sort_date': request.args.get('sort_date', 'newest'),
-            'sort_option': request.args.get('sort_option', 'date_desc')
-        }
+        filters = order_filters(request.args)
 
         customer = db.get_customer_details(customer_number)
 
@@ -206,7 +211,8 @@ def init_customer_routes(app, database):
                 flash("Cannot delete account due to outstanding debt.", "danger")
                 return redirect(url_for("account_settings"))
 
-            # Deleting opertaion via Transaction
+            # Deleting opertaion via Transaction (kept in the request, so the
+            # customer is only told the account is gone once it is)
             success = db.delete_customer_transaction(customer_number)
 
             if success:
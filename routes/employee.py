@@ -1,12 +1,33 @@
-from flask import render_template, request, redirect, url_for, flash, session, request
+from flask import render_template, request, redirect, url_for, flash, session, request, jsonify
 from werkzeug.security import generate_password_hash
 import string
 import random
 import math
+from routes.customer import order_filters
+from auth_helper import current_principal
 
 db = None
 
 
+def office_stats_filters(args):
+    """Reads the office/category filters of the office statistics page."""
+    return args.get('office', 'All'), args.get('category', 'All')
+
+
+def payment_report_filters(args):
+    """Reads the city/year/product line filters of the payment analysis report."""
+    return (args.get("city", "").strip(),
+            args.get("year", "").strip(),
+            args.get("product_line", "").strip())
+
+
+def report_json(report):
+    """A report row as sent to the dashboard's report feeds."""
+    row = dict(report)
+    row["reportDate"] = str(row["reportDate"])
+    return row
+
+
 def init_employee_routes(app, database):
     """Initialize employee-specific routes."""
     global db
@@ -23,30 +44,23 @@ def init_employee_routes(app, database):
         sort_order = request.args.get("sort", "none")   # "asc", "desc", or "none"
 
         
-        # 1. Determine Role
-        employee_details = db.get_employee_details(employee_number)
-        
-        # Check if they are strictly a 'Sales Rep'
-        is_sales_rep = (employee_details['jobTitle'] == 'Sales Rep')
-        
-        # Anyone who is NOT a Sales Rep is considered a Manager (President, VP, etc.)
-        # Ideally we check for "Manager" in title, but user specified "sales managers can add"
-        # and "jobTitle" for Anthony Bow is "Sales Manager (NA)". 
-        # So "not is_sales_rep" is a loose safe bet, or we check "Manager" in jobTitle
-        is_manager = "Manager" in employee_details['jobTitle'] or "President" in employee_details['jobTitle'] or "VP" in employee_details['jobTitle']
+        # 1. Determine Role (resolved at login, see auth_helper.Principal)
+        principal = current_principal(db)
+        if principal is None:
+            session.clear()
+            flash("Your employee record no longer exists.", "danger")
+            return redirect(url_for("login"))
+
+        is_sales_rep = principal.is_sales_rep
+        is_manager = principal.is_manager
 
         customers = []
         offices = []
         
         # 2. Fetch Customers
         if is_sales_rep:
-            # Sales Reps -> Only assigned customers
-            raw_customers = db.get_assigned_customers(employee_number, search_query, sort_order)
-            # Calculate balance manually since we aren't using the bulk fetch
-            for c in raw_customers:
-                bal = db.get_customer_balance(c["customerNumber"])
-                c['balance'] = bal["balance"]
-                customers.append(c)
+            # Sales Reps -> Only assigned customers (balance comes from the ledger join)
+            customers = db.get_assigned_customers(employee_number, search_query, sort_order) or []
         else:
             # Managers -> ALL customers (This function must exist in db_helper.py!)
             customers = db.get_all_customers_with_balance(search_query, sort_order)
@@ -54,9 +68,9 @@ def init_employee_routes(app, database):
             # Fetch offices for the Add Employee form
             offices = db.get_all_offices()
 
-        # 3. Fetch Reports
-        my_reports = db.get_employee_reports(employee_number)
-        team_reports = db.get_subordinate_reports(employee_number)
+        # 3. Fetch Reports (first page only; the dashboard loads more from /dashboard/reports)
+        my_reports = db.get_employee_reports(employee_number) or {"reports": [], "next_cursor": None}
+        team_reports = db.get_subordinate_reports(employee_number) or {"reports": [], "next_cursor": None}
         
         subordinates = []
         analytics_matrix = []
@@ -69,7 +83,8 @@ def init_employee_routes(app, database):
         offset = (analytics_page - 1) * limit
 
         if is_manager:
-            subordinates = db.get_subordinates(employee_number)
+            # Whole reporting subtree, so VPs and the President see their entire org
+            subordinates = db.get_subordinates(employee_number, indirect=True)
             try:
                 # New Analytics Features with Pagination
                 analytics_matrix = db.get_employee_performance_matrix(limit=limit, offset=offset)
@@ -101,8 +116,8 @@ def init_employee_routes(app, database):
 
         # Verify Manager Status Again
         manager_number = session.get("user_number")
-        manager_details = db.get_employee_details(manager_number)
-        is_manager = "Manager" in manager_details['jobTitle'] or "President" in manager_details['jobTitle'] or "VP" in manager_details['jobTitle']
+        principal = current_principal(db)
+        is_manager = principal is not None and principal.is_manager
         
         if not is_manager:
             flash("Only Managers can add employees.", "danger")
@@ -142,21 +157,15 @@ def init_employee_routes(app, database):
             flash("Access denied.", "danger")
             return redirect(url_for("login"))
 
-        employee_number = session.get("user_number")
-        
-        employee_details = db.get_employee_details(employee_number)
-        
-        is_manager = ("Manager" in employee_details['jobTitle']
-                    or "President" in employee_details['jobTitle']
-                    or "VP" in employee_details['jobTitle'])
-
-        filters = {
-            'status': request.args.getlist('status'),
-            'categories': request.args.getlist('category'),
-            'price_ranges': request.args.getlist('price'),
-            'sort_date': request.args.get('sort_date', 'newest'),
-            'sort_option': request.args.get('sort_option', 'date_desc')
-        }
+        principal = current_principal(db)
+        is_manager = principal is not None and principal.is_manager
+
+        # Sales reps only see the accounts they look after
+        if principal is None or not principal.can_view_customer(customer_num):
+            flash("Access denied. You are not the sales rep for this customer.", "danger")
+            return redirect(url_for("employee_dashboard"))
+
+        filters = order_filters(request.args)
 
         customer = db.get_customer_details(customer_num)
 
@@ -218,6 +227,41 @@ def init_employee_routes(app, database):
         flash("Report submitted successfully!", "success")
         return redirect(url_for("employee_dashboard"))
 
+    @app.route("/dashboard/reports")
+    def dashboard_reports():
+        """Next page of the dashboard's report feeds as JSON (?feed=mine|team&cursor=...)."""
+        if session.get("user_type") != "employee":
+            return jsonify({"error": "Unauthorized access."}), 403
+
+        employee_number = session.get("user_number")
+        feed = request.args.get("feed", "mine")
+        cursor = request.args.get("cursor") or None
+        if feed == "mine":
+            page = db.get_employee_reports(employee_number, cursor=cursor)
+        elif feed == "team":
+            page = db.get_subordinate_reports(employee_number, cursor=cursor)
+        else:
+            return jsonify({"error": "Unknown report feed."}), 400
+
+        if page is None:
+            return jsonify({"error": "Could not load reports."}), 400
+        return jsonify({"reports": [report_json(r) for r in page["reports"]],
+                        "next_cursor": page["next_cursor"]})
+
+    @app.route("/reports/<int:report_id>")
+    def view_report(report_id):
+        """Full content of one report as JSON, for the author and anyone above them in the org chart."""
+        if session.get("user_type") != "employee":
+            return jsonify({"error": "Unauthorized access."}), 403
+
+        employee_number = session.get("user_number")
+        report = db.get_report(report_id)
+        if not report:
+            return jsonify({"error": "Report not found."}), 404
+        if report["employeeNumber"] != employee_number and not db.is_in_org(employee_number, report["employeeNumber"]):
+            return jsonify({"error": "You can only read reports from your own organization."}), 403
+        return jsonify(report_json(report))
+
     @app.route("/fire_employee/<int:employee_id>", methods=["POST"])
     def fire_employee(employee_id):
         """Fire a subordinate Sales Rep."""
@@ -225,17 +269,22 @@ def init_employee_routes(app, database):
             flash("Unauthorized access.", "danger")
             return redirect(url_for("index"))
 
-        # Optional: Check if the logged-in user is actually the manager of this employee
-        # For now, we rely on the UI being hidden and the db_helper check
-        
-        success, message = db.fire_sales_rep(employee_id)
+        # Only someone above the employee in the org chart may fire them
+        if not db.is_in_org(session.get("user_number"), employee_id):
+            flash("You can only fire employees in your own organization.", "danger")
+            return redirect(url_for("employee_dashboard"))
         
-        if success:
-            flash(message, "success")
+        # Reassigning customers and rewriting the org chart is slow; a worker does it
+        job_id = app.extensions["jobs"].enqueue(
+            "fire_sales_rep", {"employeeNumber": employee_id},
+            session.get("user_type"), session.get("user_number")
+        )
+        if job_id is None:
+            flash("The request could not be queued. Please try again.", "danger")
         else:
-            flash(message, "danger")
-            
-        return redirect(url_for("employee_dashboard"))
+            flash(f"Removal of employee {employee_id} queued as job #{job_id}.", "info")
+
+        return redirect(url_for("list_jobs"))
 
     @app.route("/register", methods=["GET", "POST"])
     def register():
@@ -260,19 +309,17 @@ def init_employee_routes(app, database):
         per_page = 10
         offset = (page - 1) * per_page
 
-        filter_office = request.args.get('office', 'All')
-        filter_category = request.args.get('category', 'All')
+        filter_office, filter_category = office_stats_filters(request.args)
 
-        # 3. Fetch Ultimate Data
-        ultimate_data = db.get_ultimate_analysis_paginated(
+        # 3. Fetch Ultimate Data (page and total count from one query)
+        ultimate = db.get_ultimate_analysis_page(
             limit=per_page, 
             offset=offset, 
             filter_office=filter_office, 
             filter_category=filter_category
-        )
-        
-        total_rows = db.get_ultimate_analysis_count(filter_office, filter_category)
-        total_pages = math.ceil(total_rows / per_page)
+        ) or {"rows": [], "total": 0}
+        ultimate_data = ultimate["rows"]
+        total_pages = math.ceil(ultimate["total"] / per_page)
 
         # 4. Filter Options (Populating dropdowns)
         # Extract unique cities from consolidated stats for the dropdown
@@ -303,13 +350,8 @@ def init_employee_routes(app, database):
             flash("Unauthorized access.", "danger")
             return redirect(url_for("index"))
 
-        employee_number = session.get("user_number")
-        
-        employee_details = db.get_employee_details(employee_number)
-        
-        is_manager = ("Manager" in employee_details['jobTitle']
-                    or "President" in employee_details['jobTitle']
-                    or "VP" in employee_details['jobTitle'])
+        principal = current_principal(db)
+        is_manager = principal is not None and principal.is_manager
 
         if not is_manager:
             flash("Unauthorized access. Only Managers can edit payments.", "danger")
@@ -339,13 +381,8 @@ def init_employee_routes(app, database):
             flash("Unauthorized access.", "danger")
             return redirect(url_for("index"))
 
-        employee_number = session.get("user_number")
-        
-        employee_details = db.get_employee_details(employee_number)
-        
-        is_manager = ("Manager" in employee_details['jobTitle']
-                    or "President" in employee_details['jobTitle']
-                    or "VP" in employee_details['jobTitle'])
+        principal = current_principal(db)
+        is_manager = principal is not None and principal.is_manager
 
         if not is_manager:
             flash("Unauthorized access. Only Managers can delete payments.", "danger")
@@ -364,9 +401,7 @@ def init_employee_routes(app, database):
         if session.get("user_type") != "employee":
             flash("Unauthorized access.", "danger")
             return redirect(url_for("index"))
-        city_param = request.args.get("city", "").strip()
-        year_param = request.args.get("year", "").strip()
-        line_param = request.args.get("product_line", "").strip()
+        city_param, year_param, line_param = payment_report_filters(request.args)
 
         offices_list = db.get_all_offices()
         lines_list = db.get_all_product_lines()
@@ -393,13 +428,8 @@ def init_employee_routes(app, database):
             flash("Unauthorized access.", "danger")
             return redirect(url_for("index"))
 
-        employee_number = session.get("user_number")
-        employee_details = db.get_employee_details(employee_number)
-
-        is_manager = ("Manager" in employee_details['jobTitle']
-                    or "President" in employee_details['jobTitle']
-                    or "VP" in employee_details['jobTitle'])
-        if not is_manager:
+        principal = current_principal(db)
+        if principal is None or not principal.is_manager:
             flash("Managers only.", "danger")
             return redirect(url_for("employee_dashboard"))
 
@@ -418,20 +448,21 @@ def init_employee_routes(app, database):
         try:
             analytics_matrix = db.get_employee_performance_matrix(limit=limit, offset=offset)
             unproductive_employees = db.get_unproductive_employees()
-            full_sales_vs_office = db.get_sales_rep_vs_office_average()
-            # Filter by office
-            if sales_office_filter:
-                full_sales_vs_office = [row for row in full_sales_vs_office if row['office_city'] == sales_office_filter]
-            # Filter by search
-            if sales_office_search:
-                full_sales_vs_office = [row for row in full_sales_vs_office if sales_office_search.lower() in row['office_city'].lower() or sales_office_search.lower() in row['sales_rep'].lower()]
-            # Slice for pagination
-            sales_vs_office = full_sales_vs_office[sales_office_offset:sales_office_offset+limit]
+            # Office filter, search and paging all happen in SQL
+            sales_office = db.get_sales_rep_vs_office_page(
+                limit=limit,
+                offset=sales_office_offset,
+                office_city=sales_office_filter or None,
+                search=sales_office_search or None,
+            ) or {"rows": [], "total": 0}
+            sales_vs_office = sales_office["rows"]
+            sales_office_total_pages = max(1, math.ceil(sales_office["total"] / limit))
         except Exception as e:
             print(f"Manager Analytics Error: {e}")
             analytics_matrix = []
             unproductive_employees = []
             sales_vs_office = []
+            sales_office_total_pages = 1
 
         search_query = request.args.get("search", "")
         sort_order = request.args.get("sort", "")
@@ -444,6 +475,7 @@ def init_employee_routes(app, database):
             is_manager=True,
             analytics_page=analytics_page,
             sales_office_page=sales_office_page,
+            sales_office_total_pages=sales_office_total_pages,
             search_query=search_query,
             sort_order=sort_order,
             sales_office_search=sales_office_search,
@@ -0,0 +1,173 @@
+from flask import Response, stream_with_context, redirect, url_for, flash, session, request
+from werkzeug.datastructures import MultiDict
+from routes.products import productline_report_filters
+from routes.employee import office_stats_filters, payment_report_filters
+from routes.customer import order_filters
+import csv
+import io
+import json
+import os
+
+db = None
+jobs = None
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _csv_lines(chunks):
+    """Turns (columns, rows) chunks into CSV text, one yielded block per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_written = False
+
+    for columns, rows in chunks:
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+
+def _ndjson_lines(chunks):
+    """Turns (columns, rows) chunks into newline-delimited JSON objects."""
+    for columns, rows in chunks:
+        if rows:
+            yield "".join(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows)
+
+
+def stream_export(query, params, fmt, filename):
+    """
+    Builds a streaming response for a report query.
+    Rows go from the server-side cursor to the client chunk by chunk,
+    so memory use stays constant no matter how large the export is.
+    """
+    chunks = db.stream_query(query, params, replica=True)
+    body = _csv_lines(chunks) if fmt == "csv" else _ndjson_lines(chunks)
+
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{fmt}"}
+    )
+
+
+# Employee report exports, run as background jobs: name -> (download filename, query builder)
+REPORT_EXPORTS = {
+    "productlines": ("productline_report", lambda db, args: db.build_productline_report_query(
+        *productline_report_filters(args))),
+    "payment_analysis": ("payment_analysis", lambda db, args: db.build_complex_payment_report_query(
+        *payment_report_filters(args), limit=None)),
+    "office_stats": ("office_category_analysis", lambda db, args: db.build_ultimate_analysis_query(
+        *office_stats_filters(args))),
+}
+
+
+def _counted(chunks, job, counter):
+    """Passes chunks through, renewing the job's lease (and checking for cancellation) per chunk."""
+    for columns, rows in chunks:
+        job.heartbeat()
+        counter["rows"] += len(rows)
+        yield columns, rows
+
+
+def export_report_job(worker_db, job):
+    """
+    Job handler writing a report export to a file for /jobs/<id>/download.
+    The file only appears under its final name once complete.
+    """
+    report, fmt = job.params["report"], job.params["format"]
+    filename, build = REPORT_EXPORTS[report]
+    query, params = build(worker_db, MultiDict(job.params["args"]))
+
+    path = job.output_path(fmt)
+    counter = {"rows": 0}
+    chunks = _counted(worker_db.stream_query(query, params, replica=True), job, counter)
+    lines = _csv_lines(chunks) if fmt == "csv" else _ndjson_lines(chunks)
+    try:
+        with open(path + ".part", "w", newline="", encoding="utf-8") as out:
+            for block in lines:
+                out.write(block)
+        os.replace(path + ".part", path)
+    finally:
+        if os.path.exists(path + ".part"):
+            os.remove(path + ".part")
+
+    return {"file": os.path.basename(path), "download_name": f"{filename}.{fmt}",
+            "mimetype": EXPORT_FORMATS[fmt], "rows": counter["rows"]}
+
+
+def init_export_routes(app, database):
+    """Initialize CSV/NDJSON export routes for reports and order history."""
+    global db, jobs
+    db = database
+    jobs = app.extensions["jobs"]
+    jobs.register("export_report", export_report_job)
+
+    def _valid_format(fmt):
+        if fmt not in EXPORT_FORMATS:
+            flash("Unsupported export format.", "danger")
+            return False
+        return True
+
+    def enqueue_export(report, fmt):
+        """Queues a report export and sends the user to their job list."""
+        job_id = jobs.enqueue(
+            "export_report",
+            {"report": report, "format": fmt, "args": request.args.to_dict()},
+            session.get("user_type"), session.get("user_number")
+        )
+        if job_id is None:
+            flash("The export could not be queued.", "danger")
+        else:
+            flash(f"Export queued as job #{job_id}. It will be ready to download here shortly.", "info")
+        return redirect(url_for("list_jobs"))
+
+    @app.route("/reports/productlines/export.<fmt>", methods=["POST"])
+    def export_report_productlines(fmt):
+        if session.get("user_type") != "employee":
+            flash("You must be an employee to manage products.", "danger")
+            return redirect(url_for("index"))
+        if not _valid_format(fmt):
+            return redirect(url_for("report_productlines"))
+
+        return enqueue_export("productlines", fmt)
+
+    @app.route("/payment/analysis/export.<fmt>", methods=["POST"])
+    def export_payment_analysis(fmt):
+        if session.get("user_type") != "employee":
+            flash("Unauthorized access.", "danger")
+            return redirect(url_for("index"))
+        if not _valid_format(fmt):
+            return redirect(url_for("payment_analysis_report"))
+
+        return enqueue_export("payment_analysis", fmt)
+
+    @app.route("/offices/stats/export.<fmt>", methods=["POST"])
+    def export_office_stats(fmt):
+        if session.get("user_type") != "employee":
+            flash("Access denied.", "danger")
+            return redirect(url_for("index"))
+        if not _valid_format(fmt):
+            return redirect(url_for("view_office_stats"))
+
+        return enqueue_export("office_stats", fmt)
+
+    @app.route("/customer/orders/export.<fmt>")
+    def export_customer_orders(fmt):
+        if session.get("user_type") != "customer":
+            flash("Access denied.", "danger")
+            return redirect(url_for("login"))
+        if not _valid_format(fmt):
+            return redirect(url_for("customer_orders"))
+
+        customer_number = session.get("user_number")
+        search_query = request.args.get('q', '').strip()
+        filters = order_filters(request.args)
+
+        query, params = db.build_filtered_orders_query(customer_number, filters, search_query=search_query)
+        return stream_export(query, params, fmt, f"orders_{customer_number}")
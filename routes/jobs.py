@@ -0,0 +1,83 @@
+from flask import render_template, redirect, url_for, flash, session, jsonify, send_file
+import os
+
+db = None
+jobs = None
+
+
+def job_json(job):
+    """A job row as returned by the status endpoint."""
+    return {
+        "jobId": job["jobId"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "maxAttempts": job["maxAttempts"],
+        "cancelRequested": bool(job["cancelRequested"]),
+        "error": job["error"],
+        "result": job["result"],
+        "createdAt": str(job["createdAt"]),
+        "finishedAt": str(job["finishedAt"]) if job["finishedAt"] else None,
+    }
+
+
+def init_job_routes(app, database):
+    """Initialize the routes for following, cancelling and downloading background jobs."""
+    global db, jobs
+    db = database
+    jobs = app.extensions["jobs"]
+
+    def own_job(job_id):
+        """The job if the logged-in user queued it, else None."""
+        job = jobs.get(job_id)
+        if not job or job["requestedByType"] != session.get("user_type") \
+                or job["requestedBy"] != session.get("user_number"):
+            return None
+        return job
+
+    @app.route("/jobs")
+    def list_jobs():
+        if session.get("user_type") != "employee":
+            flash("Unauthorized access.", "danger")
+            return redirect(url_for("index"))
+
+        user_jobs = jobs.list_for(session.get("user_type"), session.get("user_number"))
+        active = any(job["status"] in ("queued", "running") for job in user_jobs)
+        return render_template("jobs.html", jobs=user_jobs, active=active)
+
+    @app.route("/jobs/<int:job_id>")
+    def job_status(job_id):
+        job = own_job(job_id)
+        if not job:
+            return jsonify({"error": "Job not found."}), 404
+        return jsonify(job_json(job))
+
+    @app.route("/jobs/<int:job_id>/cancel", methods=["POST"])
+    def cancel_job(job_id):
+        if not own_job(job_id):
+            flash("Job not found.", "danger")
+            return redirect(url_for("list_jobs"))
+
+        status = jobs.cancel(job_id)
+        if status == "cancelled":
+            flash(f"Job #{job_id} cancelled.", "info")
+        elif status == "running":
+            flash(f"Job #{job_id} is running; it will stop at its next checkpoint.", "info")
+        else:
+            flash(f"Job #{job_id} has already finished.", "warning")
+        return redirect(url_for("list_jobs"))
+
+    @app.route("/jobs/<int:job_id>/download")
+    def download_job(job_id):
+        job = own_job(job_id)
+        result = job["result"] if job else None
+        if not job or job["status"] != "done" or not result or "file" not in result:
+            flash("No download is available for this job.", "warning")
+            return redirect(url_for("list_jobs"))
+
+        path = os.path.join(jobs.output_dir, result["file"])
+        if not os.path.exists(path):
+            flash("The export file is no longer available. Please export again.", "warning")
+            return redirect(url_for("list_jobs"))
+        return send_file(path, mimetype=result["mimetype"], as_attachment=True,
+                         download_name=result["download_name"])
@@ -1,5 +1,6 @@
 from flask import render_template, redirect, url_for, flash, session, request
 from routes.cart import get_cart
+from cache_helper import ConditionalGet
 
 db = None
 
@@ -16,17 +17,29 @@ def init_main_routes(app, database):
 
     @app.route('/productlines')
     def productlines():
-        productlines_data = db.execute_query("SELECT productLine, textDescription FROM productlines")
-        return render_template('productlines.html', productlines=productlines_data)
+        cond = ConditionalGet(db.data_versions, ("productlines",))
+        not_modified = cond.not_modified_response()
+        if not_modified:
+            return not_modified
+
+        productlines_data = db.get_productlines()
+        return cond.apply(render_template('productlines.html', productlines=productlines_data))
 
     @app.route("/products/<product_line>")
     def products_by_line(product_line):
         sort = request.args.get("sort")
 
+        # Popularity depends on order volume, which is not versioned
+        cond = None
+        if sort != "popular":
+            cond = ConditionalGet(db.data_versions, ("products",), product_line, sort)
+            not_modified = cond.not_modified_response()
+            if not_modified:
+                return not_modified
+
         if not sort or sort == "price_asc" or sort == "price_desc":
-            query = "SELECT * FROM products WHERE productLine = %s"
-            products = db.execute_query(query, (product_line,))
-            
+            products = db.get_products_by_line(product_line)
+
             if sort == "price_asc":
                 products = sorted(products, key=lambda x: x["MSRP"])
             elif sort == "price_desc":
@@ -35,10 +48,16 @@ def init_main_routes(app, database):
         elif sort == "popular":
             products = db.sort_popular_products(product_line)
 
-        return render_template("products.html", products=products, product_line=product_line,sort=sort)
+        html = render_template("products.html", products=products, product_line=product_line,sort=sort)
+        return cond.apply(html) if cond else html
 
     @app.route("/product/<product_code>")
     def product_page(product_code):
+        cond = ConditionalGet(db.data_versions, ("products",), product_code)
+        not_modified = cond.not_modified_response()
+        if not_modified:
+            return not_modified
+
         product = db.get_single_product(product_code)
         if not product:
             return "Product not found", 404
@@ -48,7 +67,7 @@ def init_main_routes(app, database):
         if product_code in cart:
             in_cart_qty = cart[product_code]["quantity"]
 
-        return render_template("product.html", product=product, in_cart_qty=in_cart_qty)
+        return cond.apply(render_template("product.html", product=product, in_cart_qty=in_cart_qty))
 
     @app.route("/profile")
     def my_profile():
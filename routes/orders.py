@@ -1,7 +1,40 @@
-from flask import render_template, request, redirect, url_for, flash, session
+from collections import Counter
+from flask import render_template, request, redirect, url_for, flash, session, jsonify
+from auth_helper import current_principal
+from db_helper import EDITABLE_ORDER_STATUSES, ORDER_STATUS_TRANSITIONS
 
 db = None
 
+# Most orders one bulk status request may change
+BULK_STATUS_MAX_ORDERS = 20000
+
+CONFLICT_MESSAGE = "This order was changed in the meantime or can no longer be edited. Please review it and try again."
+
+
+def submitted_version():
+    """The order rowVersion an edit form was rendered with (None if the form did not send one)."""
+    return request.form.get("version", type=int)
+
+
+def flash_write_result(result, success_message=None, success_category="success"):
+    """Flashes the outcome of a conditional order write; returns True if it was applied."""
+    if result is None:
+        flash("A database error occurred. Please try again.", "danger")
+    elif result == 0:
+        flash(CONFLICT_MESSAGE, "warning")
+    elif success_message:
+        flash(success_message, success_category)
+    return bool(result)
+
+
+def json_order_number(value):
+    """An order number sent in JSON: an int or a string of digits (not a float or bool); None otherwise."""
+    if type(value) is int:
+        return value
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    return None
+
 
 def init_order_routes(app, database):
     """Initialize order-related routes."""
@@ -15,13 +48,13 @@ def init_order_routes(app, database):
             return redirect(url_for("order_detail", order_number=order_number))
 
         new_comment = request.form.get("new_comment", "").strip()
-        db.update_order_comment(order_number, new_comment)
-
-        order = db.get_order(order_number)
-        customer_num = order['customerNumber']
+        result = db.update_order_comment(order_number, new_comment,
+                                         expected_version=submitted_version(),
+                                         principal=current_principal(db))
 
-        flash("Order note updated successfully.", "success")
-        
+        customer_num = request.form.get("customer_num", type=int)
+        if not flash_write_result(result, "Order note updated successfully.") or customer_num is None:
+            return redirect(url_for("order_detail", order_number=order_number))
         return redirect(url_for("employee_view_customer_orders", customer_num=customer_num))
 
     @app.route("/order/<int:order_number>/update_status", methods=["POST"])
@@ -38,12 +71,46 @@ def init_order_routes(app, database):
             flash("Invalid order status.", "danger")
             return redirect(url_for("order_detail", order_number=order_number))
 
-        db.update_order_status(order_number, new_status)
+        result = db.update_order_status(order_number, new_status,
+                                        expected_version=submitted_version(),
+                                        principal=current_principal(db))
+        flash_write_result(result, f"Order status updated to '{new_status}'.")
 
-        flash(f"Order status updated to '{new_status}'.", "success")
-        
         return redirect(url_for("order_detail", order_number=order_number))
 
+    @app.route("/orders/bulk_status", methods=["POST"])
+    def bulk_status_route():
+        """
+        JSON API: {"status": "Shipped", "orders": [10100, 10101, ...]} moves all
+        the orders at once and answers with each order's outcome (see
+        DatabaseHandler.bulk_update_order_status) and a count per outcome.
+        """
+        if session.get("user_type") != "employee":
+            return jsonify({"error": "Unauthorized access."}), 403
+
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({"error": "Send a JSON object with 'status' and 'orders'."}), 400
+        new_status = payload.get("status")
+        order_numbers = payload.get("orders")
+
+        if not isinstance(new_status, str) or new_status not in ORDER_STATUS_TRANSITIONS:
+            return jsonify({"error": "Invalid order status."}), 400
+        if not isinstance(order_numbers, list) or not order_numbers:
+            return jsonify({"error": "Send the order numbers as a list in 'orders'."}), 400
+        if len(order_numbers) > BULK_STATUS_MAX_ORDERS:
+            return jsonify({"error": f"At most {BULK_STATUS_MAX_ORDERS} orders per request."}), 400
+        order_numbers = [json_order_number(n) for n in order_numbers]
+        if None in order_numbers:
+            return jsonify({"error": "Order numbers must be integers."}), 400
+
+        outcomes = db.bulk_update_order_status(order_numbers, new_status, principal=current_principal(db))
+        return jsonify({
+            "status": new_status,
+            "summary": dict(Counter(outcomes.values())),
+            "results": {str(n): outcome for n, outcome in outcomes.items()},
+        })
+
     @app.route("/order/<int:order_number>") 
     def order_detail(order_number):
         order = db.get_order(order_number)
@@ -52,29 +119,17 @@ def init_order_routes(app, database):
             return redirect(url_for("index"))
 
         user_type = session.get("user_type")
-        user_number = session.get("user_number")
-        
-        manager_details = db.get_employee_details(user_number)
-
-        is_manager = False
-        if manager_details and 'jobTitle' in manager_details:
-             is_manager = "Manager" in manager_details['jobTitle'] or "President" in manager_details['jobTitle'] or "VP" in manager_details['jobTitle']
+        principal = current_principal(db)
 
         if user_type == "customer":
-            if order["customerNumber"] != user_number:
+            if not principal.can_view_customer(order["customerNumber"]):
                 flash("Access denied. This is not your order.", "danger")
                 return redirect(url_for("index"))
 
         elif user_type == "employee":
-            customer_of_order = db.get_customer_details(order["customerNumber"])
-
-            if not is_manager:
-                if (
-                    not customer_of_order 
-                    or customer_of_order.get("salesRepEmployeeNumber") != user_number
-                ):
-                    flash("Access denied. You are not the sales rep for this customer.", "danger")
-                    return redirect(url_for("employee_dashboard"))
+            if not principal or not principal.can_view_customer(order["customerNumber"]):
+                flash("Access denied. You are not the sales rep for this customer.", "danger")
+                return redirect(url_for("employee_dashboard"))
 
         elif not user_type:
             flash("You must be logged in to view order details.", "danger")
@@ -95,36 +150,26 @@ def init_order_routes(app, database):
     @app.route("/order/<int:order_number>/cancel", methods=["POST"])
     def cancel_order(order_number):
         user_type = session.get("user_type")
-        user_number = session.get("user_number")
 
         if not user_type:
             flash("You must be logged in.", "danger")
             return redirect(url_for("login"))
 
-        order = db.get_order(order_number)
-        if not order:
-            flash("Order not found.", "danger")
-            return redirect(url_for("index"))
-
-        if user_type == "customer":
-            if order["customerNumber"] != user_number:
-                flash("You cannot cancel someone else's order.", "danger")
-                return redirect(url_for("customer_orders"))
-            
-            # customer can only cancel if "In Process"
-            if order["status"] != "In Process":
-                flash("This order can no longer be cancelled.", "warning")
-                return redirect(url_for("order_detail", order_number=order_number))
-
-        db.execute_query(
-            "UPDATE orders SET status = 'Cancelled' WHERE orderNumber = %s",
-            (order_number,)
+        # Customers may only cancel their own orders, and only while "In Process"
+        result = db.cancel_order(
+            order_number,
+            expected_version=submitted_version(),
+            statuses=EDITABLE_ORDER_STATUSES if user_type == "customer" else None,
+            principal=current_principal(db)
         )
-        
-        flash(f"Order #{order_number} has been cancelled.", "warning")
+        if not flash_write_result(result, f"Order #{order_number} has been cancelled.", "warning"):
+            return redirect(url_for("order_detail", order_number=order_number))
 
-        if user_type == "employee":
-            return redirect(url_for("employee_view_customer_orders", customer_num=order['customerNumber']))
+        customer_num = request.form.get("customer_num", type=int)
+        if user_type == "employee" and customer_num is not None:
+            return redirect(url_for("employee_view_customer_orders", customer_num=customer_num))
+        elif user_type == "employee":
+            return redirect(url_for("order_detail", order_number=order_number))
         else:
             return redirect(url_for("customer_orders"))
 
@@ -140,59 +185,57 @@ def init_order_routes(app, database):
             new_quantity = int(request.form.get("quantity"))
         except (ValueError, TypeError):
             new_quantity = 1
-        
-        item = db.get_order_detail_by_id(detail_id)
-        if not item:
-            flash("Item not found.", "danger")
-            return redirect(url_for("index"))
 
-        order = db.get_order(item['orderNumber'])
-        if order['status'] != 'In Process':
-            flash("Cannot update items in a processed order.", "danger")
-            return redirect(url_for("order_detail", order_number=item['orderNumber']))
+        order_number = request.form.get("order_number", type=int)
 
         if new_quantity > 0:
-            db.update_order_item_quantity(detail_id, new_quantity)
-            flash("Quantity updated.", "success")
+            result = db.update_order_item_quantity(detail_id, new_quantity,
+                                                   expected_version=submitted_version(),
+                                                   statuses=EDITABLE_ORDER_STATUSES,
+                                                   principal=current_principal(db))
+            flash_write_result(result, "Quantity updated.")
         else:
             flash("Quantity must be at least 1.", "warning")
 
-        return redirect(url_for("order_detail", order_number=item['orderNumber']))
+        if order_number is None:
+            return redirect(url_for("index"))
+        return redirect(url_for("order_detail", order_number=order_number))
 
     @app.route("/order/item/<int:detail_id>/delete", methods=["POST"])
     def delete_order_item(detail_id):
         user_number = session.get("user_number")
-        user_type = session.get("user_type")
         if not user_number:
             flash("Please log in.", "danger")
             return redirect(url_for("login"))
 
-        item = db.get_order_detail_by_id(detail_id)
-        if not item:
+        order_number = request.form.get("order_number", type=int)
+        if order_number is None:
             flash("Item not found.", "danger")
             return redirect(url_for("index"))
 
-        order_number = item['orderNumber']
-        order = db.get_order(order_number)
-
-        if user_type == "customer" and order['customerNumber'] != user_number:
-            flash("Access denied. You cannot modify another customer's order.", "danger")
-            return redirect(url_for("index"))
-            
-        if order['status'] != 'In Process':
-            flash("Cannot remove items from a processed order.", "danger")
+        principal = current_principal(db)
+        version = submitted_version()
+        result, line_order = db.delete_order_item(detail_id, expected_version=version,
+                                                  statuses=EDITABLE_ORDER_STATUSES, principal=principal)
+        if not flash_write_result(result):
             return redirect(url_for("order_detail", order_number=order_number))
 
-        db.delete_order_item(detail_id)
-
+        # The order the line belonged to, whatever the form said
+        order_number = line_order
         remaining_items = db.get_order_details(order_number)
         
         if not remaining_items:
-            db.execute_query(
-                "UPDATE orders SET status = 'Cancelled', comments = 'Auto-cancelled: All items removed.' WHERE orderNumber = %s",
-                (order_number,)
-            )
-            flash(f"Order #{order_number} cancelled because it is empty.", "warning")
+            # The removal above bumped the version once
+            cancelled = db.cancel_order(order_number, comment="Auto-cancelled: All items removed.",
+                                        expected_version=version + 1 if version is not None else None,
+                                        statuses=EDITABLE_ORDER_STATUSES, principal=principal)
+            if cancelled:
+                flash(f"Order #{order_number} cancelled because it is empty.", "warning")
+            elif cancelled == 0:
+                flash(f"Item removed, but Order #{order_number} changed in the meantime and was not "
+                      "cancelled. Please review it.", "warning")
+            else:
+                flash(f"Item removed, but Order #{order_number} could not be cancelled. Please try again.", "danger")
 
         else:
             flash("Item removed from order.", "success")
@@ -215,12 +258,14 @@ def init_order_routes(app, database):
             flash("Only cancelled orders can be permanently deleted.", "warning")
             return redirect(url_for("order_detail", order_number=order_number))
 
-        # HARD DELETE
-        success, message = db.delete_order_permanently(order_number)
-        
-        if success:
-            flash(message, "success")
-            return redirect(url_for("employee_view_customer_orders", customer_num=order['customerNumber']))
-        else:
-            flash(message, "danger")
-            return redirect(url_for("order_detail", order_number=order_number))
\ No newline at end of file
+        # HARD DELETE, run by a background worker
+        job_id = app.extensions["jobs"].enqueue(
+            "delete_order", {"orderNumber": order_number},
+            session.get("user_type"), session.get("user_number")
+        )
+        if job_id is None:
+            flash("The deletion could not be queued. Please try again.", "danger")
+            return redirect(url_for("order_detail", order_number=order_number))
+
+        flash(f"Deletion of order #{order_number} queued as job #{job_id}.", "info")
+        return redirect(url_for("employee_view_customer_orders", customer_num=order['customerNumber']))
\ No newline at end of file
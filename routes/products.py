@@ -1,10 +1,31 @@
-from flask import render_template, request, redirect, url_for, flash, session
+from flask import render_template, request, redirect, url_for, flash, session, has_request_context
+from datetime import datetime
 import math
 import re
+from product_helper import PRODUCT_FIELDS, validate_product, product_line_names, import_products_csv
 
 db = None
 
 
+def productline_report_filters(args):
+    """
+    Reads the product line report filters (also used by the report export).
+    A start or end date that is not a valid YYYY-MM-DD falls back to its default.
+    """
+    dates = []
+    for name, default in (("start", "2004-01-01"), ("end", "2005-01-01")):
+        value = args.get(name, default=default, type=str).strip()
+        try:
+            datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            if has_request_context():
+                flash(f"Invalid {name} date '{value}', using {default} instead.", "warning")
+            value = default
+        dates.append(value)
+    status = args.get("status", default="Shipped", type=str)
+    return dates[0], dates[1], status
+
+
 def init_product_routes(app, database):
     """Initialize product-related routes."""
     global db
@@ -33,76 +54,33 @@ def init_product_routes(app, database):
         # 2) Read filter/sort parameters
         vendor = request.args.get("vendor", default="", type=str).strip()
         line = request.args.get("line", default="", type=str).strip()
+        scale = request.args.get("scale", default="", type=str).strip()
         sort = request.args.get("sort", default="", type=str).strip()
 
-        # 3) Build WHERE dynamically (safe parameter binding)
-        where_clauses = ["1=1"]
-        params = []
-
-        if vendor:
-            where_clauses.append("productVendor = %s")
-            params.append(vendor)
-
-        if line:
-            where_clauses.append("productLine = %s")
-            params.append(line)
-
-        where_sql = " AND ".join(where_clauses)
-
-        # 4) Whitelist ORDER BY
-        sort_map = {
-            "buyPrice_asc": "buyPrice ASC",
-            "buyPrice_desc": "buyPrice DESC",
-            "stock_asc": "quantityInStock ASC",
-            "stock_desc": "quantityInStock DESC",
-            "name_asc": "productName ASC",
-            "name_desc": "productName DESC",
-        }
-        order_by = sort_map.get(sort, "productLine ASC, productName ASC")
-
-        # 5) Count total items WITH filters
-        count_row = db.execute_query(
-            f"SELECT COUNT(*) AS cnt FROM products WHERE {where_sql}",
-            tuple(params),
-            fetchone=True
-        )
-        total_items = count_row["cnt"]
-        total_pages = max(1, math.ceil(total_items / per_page))
+        # 3) Current page, match count and facet counts from the product index
+        result = db.search_products(vendor, line, scale, sort, limit=per_page, offset=offset)
+        if result is None:
+            flash("Could not load products. Please try again.", "danger")
+            result = {"products": [], "total": 0, "facets": {"vendor": [], "line": [], "scale": []}}
 
-        # 6) Fetch current page WITH filters + sorting
-        products = db.execute_query(
-            f"""
-            SELECT *
-            FROM products
-            WHERE {where_sql}
-            ORDER BY {order_by}
-            LIMIT %s OFFSET %s
-            """,
-            tuple(params + [per_page, offset]),
-        )
-
-        # 7) Dropdown options (for filters)
-        vendor_rows = db.execute_query(
-            "SELECT DISTINCT productVendor FROM products ORDER BY productVendor"
-        )
-        line_rows = db.execute_query(
-            "SELECT DISTINCT productLine FROM products ORDER BY productLine"
-        )
-        vendors = [r["productVendor"] for r in vendor_rows]
-        lines = [r["productLine"] for r in line_rows]
+        total_items = result["total"]
+        total_pages = max(1, math.ceil(total_items / per_page))
+        facets = result["facets"]
 
         return render_template(
             "products_list.html",
-            products=products,
+            products=result["products"],
             page=page,
             per_page=per_page,
             total_pages=total_pages,
             total_items=total_items,
             vendor=vendor,
             line=line,
+            scale=scale,
             sort=sort,
-            vendors=vendors,
-            lines=lines,
+            vendors=facets["vendor"],
+            lines=facets["line"],
+            scales=facets["scale"],
         )
     
     @app.route("/reports/productlines")
@@ -111,66 +89,9 @@ def init_product_routes(app, database):
         if not _require_employee():
             return redirect(url_for("index"))
 
-        # Optional filters
-        start = request.args.get("start", default="2004-01-01", type=str)
-        end   = request.args.get("end",   default="2005-01-01", type=str)
-        status = request.args.get("status", default="Shipped", type=str)
-
-        sql = """
-        SELECT
-            pl.productLine,
-
-            COALESCE(s.numProducts, 0)        AS numProducts,
-            COALESCE(s.unitsSold, 0)          AS unitsSold,
-            COALESCE(s.revenue, 0)            AS revenue,
-            COALESCE(s.estCOGS, 0)            AS estCOGS,
-            COALESCE(s.estGrossProfit, 0)     AS estGrossProfit,
-            COALESCE(s.estGrossMargin, 0)     AS estGrossMargin,
-            COALESCE(s.distinctCustomers, 0)  AS distinctCustomers
-
-        FROM productlines pl
-
-        LEFT JOIN (
-            SELECT
-                pl2.productLine,
-
-                COUNT(DISTINCT pr.productCode) AS numProducts,
-                SUM(od.quantityOrdered) AS unitsSold,
-                SUM(od.quantityOrdered * od.priceEach) AS revenue,
-                SUM(od.quantityOrdered * pr.buyPrice) AS estCOGS,
-
-                SUM(od.quantityOrdered * od.priceEach) - SUM(od.quantityOrdered * pr.buyPrice) AS estGrossProfit,
-
-                CASE
-                WHEN SUM(od.quantityOrdered * od.priceEach) = 0 THEN 0
-                ELSE
-                    (SUM(od.quantityOrdered * od.priceEach) - SUM(od.quantityOrdered * pr.buyPrice))
-                    / SUM(od.quantityOrdered * od.priceEach)
-                END AS estGrossMargin,
-
-                COUNT(DISTINCT o.customerNumber) AS distinctCustomers
-
-            FROM productlines pl2
-            JOIN products pr
-            ON pr.productLine = pl2.productLine
-            JOIN orderdetails od
-            ON od.productCode = pr.productCode
-            JOIN orders o
-            ON o.orderNumber = od.orderNumber
-
-            WHERE o.status = %s
-            AND o.orderDate >= %s
-            AND o.orderDate <  %s
-
-            GROUP BY pl2.productLine
-        ) s
-        ON s.productLine = pl.productLine
-
-        ORDER BY revenue DESC;
-    """
-
+        start, end, status = productline_report_filters(request.args)
 
-        rows = db.execute_query(sql, (status, start, end))
+        rows = db.get_productline_report(start, end, status)
 
         return render_template(
             "report_productlines.html",
@@ -187,69 +108,8 @@ def init_product_routes(app, database):
             return redirect(url_for("index"))
 
         if request.method == "POST":
-            # Get form inputs
             productCode = request.form.get("productCode", "").strip()
-            productName = request.form.get("productName", "").strip()
-            productLine = request.form.get("productLine", "").strip()
-            productScale = request.form.get("productScale", "").strip()
-            productVendor = request.form.get("productVendor", "").strip()
-            productDescription = request.form.get("productDescription", "").strip()
-            quantityInStock_raw = request.form.get("quantityInStock", "").strip()
-            buyPrice_raw = request.form.get("buyPrice", "").strip()
-            msrp_raw = request.form.get("MSRP", "").strip()
-
-            errors = []
-
-            # --- Required field checks ---
-            if not (productCode and productName and productLine and productScale and
-                    productVendor and productDescription and quantityInStock_raw and
-                    buyPrice_raw and msrp_raw):
-                errors.append("All fields are required.")
-
-            # --- Length checks based on table schema ---
-            if len(productCode) > 15:
-                errors.append("Product code cannot exceed 15 characters.")
-            if len(productName) > 70:
-                errors.append("Product name cannot exceed 70 characters.")
-            if len(productLine) > 50:
-                errors.append("Product line cannot exceed 50 characters.")
-            if len(productScale) > 10:
-                errors.append("Product scale cannot exceed 10 characters.")
-            if len(productVendor) > 50:
-                errors.append("Product vendor cannot exceed 50 characters.")
-
-            # --- Numeric conversions & validation ---
-            quantityInStock = None
-            buyPrice = None
-            msrp = None
-
-            if quantityInStock_raw:
-                try:
-                    quantityInStock = int(quantityInStock_raw)
-                    if quantityInStock < 0:
-                        errors.append("Quantity in stock cannot be negative.")
-                except ValueError:
-                    errors.append("Quantity in stock must be an integer.")
-
-            if buyPrice_raw:
-                try:
-                    buyPrice = float(buyPrice_raw)
-                    if buyPrice <= 0:
-                        errors.append("Buy price must be positive.")
-                except ValueError:
-                    errors.append("Buy price must be a valid number.")
-
-            if msrp_raw:
-                try:
-                    msrp = float(msrp_raw)
-                    if msrp <= 0:
-                        errors.append("MSRP must be positive.")
-                except ValueError:
-                    errors.append("MSRP must be a valid number.")
-
-            # --- Logical check: MSRP >= buyPrice ---
-            if buyPrice is not None and msrp is not None and msrp < buyPrice:
-                errors.append("MSRP should not be lower than buy price.")
+            product_info, errors = validate_product(request.form, product_line_names(db))
 
             # --- Check productCode uniqueness ---
             if productCode:
@@ -261,16 +121,6 @@ def init_product_routes(app, database):
                 if existing:
                     errors.append("A product with this code already exists.")
 
-            # --- Check productLine exists in productlines table ---
-            if productLine:
-                line = db.execute_query(
-                    "SELECT productLine FROM productlines WHERE productLine = %s",
-                    (productLine,),
-                    fetchone=True,
-                )
-                if not line:
-                    errors.append("Product line does not exist.")
-
             # If any errors, re-render form with old data
             if errors:
                 return render_template(
@@ -281,18 +131,6 @@ def init_product_routes(app, database):
                 )
 
             # --- If everything is valid, insert product ---
-            product_info = (
-                productCode,
-                productName,
-                productLine,
-                productScale,
-                productVendor,
-                productDescription,
-                quantityInStock,
-                buyPrice,
-                msrp,
-            )
-
             result = db.insert_product(product_info)
 
             if result:
@@ -310,6 +148,29 @@ def init_product_routes(app, database):
         # GET
         return render_template("product_form.html", mode="create")
 
+    # --- Bulk import / update from a CSV file ---
+    @app.route("/products/import", methods=["GET", "POST"])
+    def import_products():
+        if not _require_employee():
+            return redirect(url_for("index"))
+
+        if request.method == "POST":
+            upload = request.files.get("file")
+            if not upload or not upload.filename:
+                flash("Choose a CSV file to import.", "warning")
+                return redirect(url_for("import_products"))
+
+            report = import_products_csv(db, upload.stream)
+            if report["inserted"] or report["updated"]:
+                flash(f"Imported {report['inserted']} new and updated {report['updated']} existing products.",
+                      "success")
+            if report["failed"]:
+                flash(f"{report['failed']} rows were skipped, see below.", "warning")
+            return render_template("products_import.html", report=report, fields=PRODUCT_FIELDS)
+
+        # GET
+        return render_template("products_import.html", report=None, fields=PRODUCT_FIELDS)
+
     # --- Edit existing product ---
     @app.route("/products/<product_code>/edit", methods=["GET", "POST"])
     def edit_product(product_code):
@@ -323,74 +184,7 @@ def init_product_routes(app, database):
             return redirect(url_for("products_list"))
 
         if request.method == "POST":
-            productName = request.form.get("productName", "").strip()
-            productLine = request.form.get("productLine", "").strip()
-            productScale = request.form.get("productScale", "").strip()
-            productVendor = request.form.get("productVendor", "").strip()
-            productDescription = request.form.get("productDescription", "").strip()
-            quantityInStock_raw = request.form.get("quantityInStock", "").strip()
-            buyPrice_raw = request.form.get("buyPrice", "").strip()
-            msrp_raw = request.form.get("MSRP", "").strip()
-
-            errors = []
-
-            # Required checks
-            if not (productName and productLine and productScale and productVendor and
-                    productDescription and quantityInStock_raw and buyPrice_raw and
-                    msrp_raw):
-                errors.append("All fields are required.")
-
-            # Length checks
-            if len(productName) > 70:
-                errors.append("Product name cannot exceed 70 characters.")
-            if len(productLine) > 50:
-                errors.append("Product line cannot exceed 50 characters.")
-            if len(productScale) > 10:
-                errors.append("Product scale cannot exceed 10 characters.")
-            if len(productVendor) > 50:
-                errors.append("Product vendor cannot exceed 50 characters.")
-
-            # Numeric conversions
-            quantityInStock = None
-            buyPrice = None
-            msrp = None
-
-            if quantityInStock_raw:
-                try:
-                    quantityInStock = int(quantityInStock_raw)
-                    if quantityInStock < 0:
-                        errors.append("Quantity in stock cannot be negative.")
-                except ValueError:
-                    errors.append("Quantity in stock must be an integer.")
-
-            if buyPrice_raw:
-                try:
-                    buyPrice = float(buyPrice_raw)
-                    if buyPrice <= 0:
-                        errors.append("Buy price must be positive.")
-                except ValueError:
-                    errors.append("Buy price must be a valid number.")
-
-            if msrp_raw:
-                try:
-                    msrp = float(msrp_raw)
-                    if msrp <= 0:
-                        errors.append("MSRP must be positive.")
-                except ValueError:
-                    errors.append("MSRP must be a valid number.")
-
-            if buyPrice is not None and msrp is not None and msrp < buyPrice:
-                errors.append("MSRP should not be lower than buy price.")
-
-            # Check productLine exists
-            if productLine:
-                line = db.execute_query(
-                    "SELECT productLine FROM productlines WHERE productLine = %s",
-                    (productLine,),
-                    fetchone=True,
-                )
-                if not line:
-                    errors.append("Product line does not exist.")
+            product_info, errors = validate_product(request.form, product_line_names(db), with_code=False)
 
             if errors:
                 # Use request.form for repopulation
@@ -404,17 +198,7 @@ def init_product_routes(app, database):
                 )
 
             # Perform update
-            result = db.update_product(
-                product_code,
-                productName,
-                productLine,
-                productScale,
-                productVendor,
-                productDescription,
-                quantityInStock,
-                buyPrice,
-                msrp,
-            )
+            result = db.update_product(product_code, *product_info[1:])
 
             if result:
                 flash(f"Product {product_code} updated successfully.", "success")
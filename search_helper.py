@@ -0,0 +1,152 @@
+"""
+In-process faceted search over the product catalog for the product list.
+
+ProductSearch loads the products once and indexes them by vendor, product
+line and scale: every facet value maps to the set of productCodes that have
+it, so the value's count is the size of its set and filters combine by
+intersecting sets. search() returns one page of products, the number of
+matches and the facet counts together, without a database round trip.
+
+Facet counts follow the other active filters (with a line selected, the
+vendor counts are those of that line); a facet's own selection does not narrow
+its counts, so the alternatives stay visible.
+
+DatabaseHandler._evict forwards every write here; a change to products
+rebuilds the index on the next search, with one query.
+"""
+import threading
+
+import mysql.connector
+
+# Facets: request parameter -> products column
+FACETS = {"vendor": "productVendor", "line": "productLine", "scale": "productScale"}
+
+PRODUCT_COLUMNS = (
+    "productCode", "productName", "productLine", "productScale", "productVendor",
+    "quantityInStock", "buyPrice", "MSRP",
+)
+
+# Sort options of the product list: name -> (key, descending); "" is the default
+SORTS = {
+    "": (lambda p: (p["productLine"].lower(), p["productName"].lower(), p["productCode"]), False),
+    "buyPrice_asc": (lambda p: (p["buyPrice"], p["productCode"]), False),
+    "buyPrice_desc": (lambda p: (p["buyPrice"], p["productCode"]), True),
+    "stock_asc": (lambda p: (p["quantityInStock"], p["productCode"]), False),
+    "stock_desc": (lambda p: (p["quantityInStock"], p["productCode"]), True),
+    "name_asc": (lambda p: (p["productName"].lower(), p["productCode"]), False),
+    "name_desc": (lambda p: (p["productName"].lower(), p["productCode"]), True),
+}
+
+
+class ProductIndex:
+    """One loaded snapshot: the products, their facet sets and counts, and sort orders."""
+
+    def __init__(self, rows):
+        self.products = {row["productCode"]: row for row in rows}
+        # facet -> value -> set of productCodes
+        self.facets = {facet: {} for facet in FACETS}
+        for code, product in self.products.items():
+            for facet, column in FACETS.items():
+                self.facets[facet].setdefault(product[column], set()).add(code)
+        # Unfiltered counts, served as they are while no other facet is selected
+        self.counts = {
+            facet: {value: len(codes) for value, codes in values.items()}
+            for facet, values in self.facets.items()
+        }
+        # Sort name -> (productCodes in that order, productCode -> position), built on first use
+        self._orders = {}
+
+    def order(self, sort):
+        if sort not in self._orders:
+            key, descending = SORTS[sort]
+            codes = [p["productCode"] for p in sorted(self.products.values(), key=key, reverse=descending)]
+            self._orders[sort] = (codes, {code: i for i, code in enumerate(codes)})
+        return self._orders[sort]
+
+
+class ProductSearch:
+
+    def __init__(self, db):
+        self.db = db
+        self._state_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._index = None
+        self._stale = True
+        self.loads = 0
+
+    def preload(self):
+        """Builds the index now (e.g. in a server's master before it forks). True if one is held."""
+        return self._current() is not None
+
+    def invalidate(self, tables):
+        if "products" in tables:
+            with self._state_lock:
+                self._stale = True
+
+    def _current(self):
+        """The up-to-date index, rebuilding it first if needed; None if the products cannot be read."""
+        with self._load_lock:
+            with self._state_lock:
+                stale, self._stale = self._stale, False
+            if stale or self._index is None:
+                try:
+                    self._index = self._load()
+                    self.loads += 1
+                except mysql.connector.Error as err:
+                    print(f"Product search index load failed: {err}")
+                    with self._state_lock:
+                        self._stale = True
+                    return None
+            return self._index
+
+    def _load(self):
+        rows = []
+        for _, chunk in self.db.stream_query(f"SELECT {', '.join(PRODUCT_COLUMNS)} FROM products", chunk_size=10000):
+            rows.extend(dict(zip(PRODUCT_COLUMNS, row)) for row in chunk)
+        return ProductIndex(rows)
+
+    def search(self, filters, sort="", limit=10, offset=0):
+        """
+        Products matching every selected facet value (filters: {"vendor": ..., "line": ...,
+        "scale": ...}, empty values ignored), in the given SORTS order.
+        Returns {"products": the page, "total": number of matches,
+        "facets": {facet: [(value, count), ...]}}, or None if the index is unavailable.
+        """
+        index = self._current()
+        if index is None:
+            return None
+        selected = {facet: value for facet, value in filters.items() if facet in FACETS and value}
+
+        def matching(skip=None):
+            """Codes matching the selections except skip's; None when nothing narrows them."""
+            sets = sorted(
+                (index.facets[facet].get(value, set()) for facet, value in selected.items() if facet != skip),
+                key=len
+            )
+            return set.intersection(*sets) if sets else None
+
+        codes, position = index.order(sort if sort in SORTS else "")
+        matches = matching()
+        if matches is not None:
+            codes = sorted(matches, key=position.__getitem__)
+
+        facets = {}
+        for facet in FACETS:
+            base = matching(skip=facet)
+            if base is None:
+                counts = index.counts[facet]
+            else:
+                counts = {value: len(base & codes_with) for value, codes_with in index.facets[facet].items()}
+            # The selected value stays listed even when nothing has it
+            if facet in selected and selected[facet] not in counts:
+                counts = {**counts, selected[facet]: 0}
+            facets[facet] = sorted(
+                (value, count) for value, count in counts.items()
+                if count or value == selected.get(facet)
+            )
+
+        return {
+            "products": [index.products[code] for code in codes[offset:offset + limit]],
+            "total": len(codes),
+            "facets": facets,
+        }
@@ -0,0 +1,86 @@
+"""
+Production entry point: gunicorn with the application preloaded in the master.
+
+Usage:
+    python serve.py                                   # 0.0.0.0:8000, WEB_CONCURRENCY or 2 x cores + 1 workers
+    python serve.py --bind 127.0.0.1:8080 --workers 8
+
+The master builds the app once and runs app.preload (catalog caches and the
+analytics snapshot), then moves everything it allocated into the garbage
+collector's permanent generation (gc.freeze), so workers share those pages
+copy-on-write instead of dirtying them on their first collection. Each forked
+worker runs app.warm_up before it accepts requests, which opens its own
+database connection and gives it its own ETag token.
+
+Workers are synchronous (one request at a time): a DatabaseHandler holds a
+single connection per process, so concurrency comes from processes.
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import sys
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+
+def default_workers():
+    return int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+
+
+if BaseApplication is not None:
+    class Server(BaseApplication):
+        """Gunicorn application serving an already created (preloaded) Flask app."""
+
+        def __init__(self, app, options):
+            self.application = app
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the application with gunicorn.")
+    parser.add_argument("--bind", default=os.getenv("BIND", "0.0.0.0:8000"))
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--timeout", type=int, default=60, help="seconds before a stuck worker is restarted")
+    args = parser.parse_args(argv)
+
+    if BaseApplication is None:
+        print("gunicorn is not installed (pip install gunicorn).")
+        return 1
+
+    from app import create_app, preload, warm_up
+
+    # No collections while loading: objects created here are frozen below
+    gc.disable()
+    app = create_app()
+    preload(app)
+    gc.freeze()
+    # The master keeps collecting too (workers inherit this state on fork)
+    gc.enable()
+
+    options = {
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": "sync",
+        "timeout": args.timeout,
+        "preload_app": True,
+        # Runs in each worker after the fork, before it accepts connections
+        "post_worker_init": lambda worker: warm_up(app),
+    }
+    Server(app, options).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Shared fixtures. The tests run without a MySQL server: fake_mysql replaces
+mysql.connector.connect with connections whose queries return no rows.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeCursor:
+    """A cursor on an empty database: reads return no rows, writes change nothing."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.with_rows = False
+        self.rowcount = 0
+        self.lastrowid = None
+        self.column_names = ()
+
+    def execute(self, query, params=None):
+        self.conn.queries.append(query)
+        self.with_rows = query.lstrip()[:6].upper() in ("SELECT", "WITH (", "SHOW")
+
+    def fetchall(self):
+        return []
+
+    def fetchone(self):
+        return None
+
+    def fetchmany(self, size=None):
+        return []
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, **connect_args):
+        self.connect_args = connect_args
+        self.pid = os.getpid()
+        self.queries = []
+        self.closed = False
+        self.autocommit = True
+        self.in_transaction = False
+        self.unread_result = False
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_mysql(monkeypatch):
+    """Every mysql.connector.connect call returns a new FakeConnection; the list of them is returned."""
+    import mysql.connector
+
+    connections = []
+
+    def connect(**connect_args):
+        connections.append(FakeConnection(**connect_args))
+        return connections[-1]
+
+    monkeypatch.setattr(mysql.connector, "connect", connect)
+    return connections
+
+
+@pytest.fixture
+def app_env(monkeypatch, tmp_path):
+    """Environment for create_app: no job workers, and a cache bus and template cache under tmp_path."""
+    monkeypatch.setenv("DB_PASSWORD", "test")
+    monkeypatch.setenv("JOB_WORKERS", "0")
+    monkeypatch.setenv("CACHE_BUS", str(tmp_path / "bus"))
+    monkeypatch.setenv("JINJA_CACHE_DIR", str(tmp_path / "jinja"))
+    monkeypatch.setenv("ANALYTICS_ENGINE", "0")
+    monkeypatch.delenv("DB_REPLICAS", raising=False)
+    return tmp_path
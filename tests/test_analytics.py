@@ -0,0 +1,122 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from analytics_helper import ColumnarAnalytics  # noqa: E402
+
+TABLES = {
+    "offices": [("1", "San Francisco", "USA", "NA"), ("2", "Paris", "France", "EMEA")],
+    "employees": [
+        (1002, "Diane", "Murphy", "President", "1"),
+        (1102, "Gerard", "Bondur", "Sale Manager (EMEA)", "2"),
+        (1165, "Leslie", "Jennings", "Sales Rep", "1"),
+        (1337, "Loui", "Bondur", "Sales Rep", "2"),
+    ],
+    "customers": [(103, 1165), (112, 1337), (119, None)],
+    "productlines": [("Motorcycles",), ("Planes",)],
+    "products": [("S1", "Bike", "Motorcycles", Decimal("10.00")), ("S2", "Plane", "Planes", Decimal("20.00"))],
+    "orders": [
+        (10100, 103, date(2004, 1, 5), "Shipped"),
+        (10101, 112, date(2004, 6, 1), "Shipped"),
+        (10102, 112, date(2005, 2, 1), "Cancelled"),
+    ],
+    "orderdetails": [
+        (10100, "S1", 2, 15.5),
+        (10100, "S2", 1, 30.0),
+        (10101, "S2", 3, 25.0),
+        (10102, "S1", 1, 12.0),
+    ],
+}
+
+
+class TableDatabase:
+    """Serves the engine's queries from TABLES (rows filtered by orderNumber for appends)."""
+
+    def stream_query(self, query, params=None, chunk_size=1000):
+        table = query.split(" FROM ")[1].split()[0]
+        rows = TABLES[table]
+        if params:
+            rows = [row for row in rows if row[0] in params]
+        yield (), list(rows)
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setitem(TABLES, "orders", list(TABLES["orders"]))
+    monkeypatch.setitem(TABLES, "orderdetails", list(TABLES["orderdetails"]))
+    return ColumnarAnalytics(TableDatabase())
+
+
+def test_employee_performance_matrix(engine):
+    assert engine.get_employee_performance_matrix() == [
+        {"firstName": "Leslie", "lastName": "Jennings", "productLine": "Motorcycles", "revenue": 31.0},
+        {"firstName": "Leslie", "lastName": "Jennings", "productLine": "Planes", "revenue": 30.0},
+        {"firstName": "Loui", "lastName": "Bondur", "productLine": "Motorcycles", "revenue": 12.0},
+        {"firstName": "Loui", "lastName": "Bondur", "productLine": "Planes", "revenue": 75.0},
+    ]
+    assert [row["revenue"] for row in engine.get_employee_performance_matrix(limit=1, offset=3)] == [75.0]
+
+
+def test_consolidated_office_stats(engine):
+    paris, san_francisco = engine.get_consolidated_office_stats()
+    assert paris["city"] == "Paris"
+    assert (paris["active_employees"], paris["customer_count"], paris["total_orders"]) == (2, 1, 2)
+    assert paris["total_revenue"] == 87.0 and paris["avg_ticket_size"] == 43.5
+    assert paris["manager_name"] == "Gerard Bondur"
+    assert (san_francisco["customer_count"], san_francisco["total_orders"]) == (1, 1)
+    assert san_francisco["total_revenue"] == 61.0
+    assert san_francisco["manager_name"] == "Diane Murphy"
+
+
+def test_productline_report(engine):
+    planes, motorcycles = engine.get_productline_report("2004-01-01", "2005-01-01", "Shipped")
+    assert planes == {
+        "productLine": "Planes", "numProducts": 1, "unitsSold": 4,
+        "revenue": Decimal("105.00"), "estCOGS": Decimal("80.00"), "estGrossProfit": Decimal("25.00"),
+        "estGrossMargin": Decimal("25.00") / Decimal("105.00"), "distinctCustomers": 2,
+    }
+    assert (motorcycles["unitsSold"], motorcycles["revenue"], motorcycles["distinctCustomers"]) == \
+        (2, Decimal("31.00"), 1)
+
+
+def test_productline_report_leaves_unreadable_dates_to_sql(engine):
+    assert engine.get_productline_report("2004-13-99", "2005-01-01", "Shipped") is None
+
+
+def test_payment_report(engine):
+    rows = engine.get_complex_payment_report(year_filter="2004")
+    named = [(row["office_city"], row["productName"], row["total_revenue"], row["total_units"])
+             for row in rows if row["productName"]]
+    assert named == [("Paris", "Plane", 75.0, 3), ("San Francisco", "Bike", 31.0, 2),
+                     ("San Francisco", "Plane", 30.0, 1)]
+    # Reps without customers show up as rows without a product
+    assert {row["office_city"] for row in rows if row["productName"] is None} == {"Paris", "San Francisco"}
+    assert rows[0]["global_avg_revenue"] == 37.0
+
+    planes = engine.get_complex_payment_report(city_filter="par", product_line_filter="Planes")
+    assert [(row["office_city"], row["productName"]) for row in planes] == [("Paris", "Plane")]
+
+
+def test_new_order_is_appended_without_reload(engine):
+    engine.get_productline_report("2004-01-01", "2005-01-01", "Shipped")
+    TABLES["orders"].append((10103, 103, date(2004, 7, 1), "Shipped"))
+    TABLES["orderdetails"].append((10103, "S1", 1, 10.0))
+
+    engine.expect_append(10103)
+    engine.invalidate({"orders", "orderdetails"})
+    report = {row["productLine"]: row for row in engine.get_productline_report("2004-01-01", "2005-01-01", "Shipped")}
+    assert report["Motorcycles"]["unitsSold"] == 3
+    assert (engine.loads, engine.appends) == (1, 1)
+
+    engine.invalidate({"products"})
+    engine.get_productline_report("2004-01-01", "2005-01-01", "Shipped")
+    assert engine.loads == 2
+
+
+def test_disabled_engine_answers_nothing():
+    engine = ColumnarAnalytics(TableDatabase(), enabled=False)
+    assert engine.get_consolidated_office_stats() is None
+    assert not engine.preload()
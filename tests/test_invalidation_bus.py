@@ -0,0 +1,148 @@
+import json
+import os
+import socket
+
+import pytest
+
+from invalidation_helper import InvalidationBus, SocketTransport, transport_from_env
+
+
+class FakeHub:
+    """The shared side of FakeTransport: counters and the buses subscribed to messages."""
+
+    def __init__(self):
+        self.counters = {}
+        self.buses = []
+        self.dropping = False
+
+
+class FakeTransport:
+    errors = (OSError,)
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.failing = False
+
+    def bump(self, tables):
+        if self.failing:
+            raise OSError("transport down")
+        for table in tables:
+            self.hub.counters[table] = self.hub.counters.get(table, 0) + 1
+        return {table: self.hub.counters[table] for table in tables}
+
+    def versions(self):
+        return dict(self.hub.counters)
+
+    def send(self, payload):
+        if not self.hub.dropping:
+            for bus in self.hub.buses:
+                bus._receive(payload)
+
+    def listen(self, callback):
+        raise AssertionError("the tests deliver messages synchronously")
+
+
+def make_bus(hub):
+    """A subscribed bus recording what it evicts; started without its listener thread."""
+    applied = []
+    bus = InvalidationBus(FakeTransport(hub), lambda tables, order: applied.append((sorted(tables), order)),
+                          check_seconds=0)
+    bus.mark_synced()
+    bus._started_pid = os.getpid()
+    hub.buses.append(bus)
+    return bus, applied
+
+
+def test_publish_evicts_in_other_processes_only():
+    hub = FakeHub()
+    first, first_applied = make_bus(hub)
+    second, second_applied = make_bus(hub)
+
+    first.publish({"orders", "orderdetails"}, order_number=10426)
+
+    assert first_applied == []
+    assert second_applied == [(["orderdetails", "orders"], 10426)]
+    assert first.published == 1 and second.received == 1
+
+
+def test_message_already_applied_is_ignored():
+    hub = FakeHub()
+    first, _ = make_bus(hub)
+    second, second_applied = make_bus(hub)
+    first.publish({"orders"})
+    payload = json.dumps({"origin": first.origin, "versions": {"orders": 1}, "order": None})
+    second._receive(payload.encode())
+    second._receive(b"not json")
+    assert second_applied == [(["orders"], None)]
+
+
+def test_poll_catches_up_a_dropped_message():
+    hub = FakeHub()
+    first, _ = make_bus(hub)
+    second, second_applied = make_bus(hub)
+
+    hub.dropping = True
+    first.publish({"payments"})
+    assert second_applied == []
+
+    second.poll()
+    assert second_applied == [(["payments"], None)]
+    assert second.caught_up == 1
+    second.poll()
+    assert second.caught_up == 1
+
+
+def test_publish_evicts_a_change_whose_message_is_late():
+    hub = FakeHub()
+    first, first_applied = make_bus(hub)
+    second, _ = make_bus(hub)
+
+    hub.dropping = True
+    second.publish({"products"})
+    hub.dropping = False
+    # The counter moved by two: the other process's change has not arrived yet
+    first.publish({"products"})
+    assert first_applied == [(["products"], None)]
+
+
+def test_publish_errors_are_printed_not_raised(capsys):
+    hub = FakeHub()
+    bus, _ = make_bus(hub)
+    bus.transport.failing = True
+    bus.publish({"orders"})
+    assert bus.published == 0
+    assert "Cache bus publish failed" in capsys.readouterr().out
+
+
+def test_disabled_bus_does_nothing():
+    bus = InvalidationBus(None, lambda tables, order: pytest.fail("nothing to apply"))
+    assert not bus.enabled
+    bus.publish({"orders"})
+    bus.poll()
+
+
+def test_transport_from_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("CACHE_BUS", "off")
+    assert transport_from_env("classicmodels") is None
+    monkeypatch.setenv("CACHE_BUS", str(tmp_path))
+    assert isinstance(transport_from_env("classicmodels"), SocketTransport)
+
+
+def test_socket_transport_counters_and_delivery(tmp_path):
+    transport = SocketTransport(str(tmp_path))
+    assert transport.bump(["orders", "payments"]) == {"orders": 1, "payments": 1}
+    assert transport.bump(["orders"]) == {"orders": 2}
+    assert transport.versions() == {"orders": 2, "payments": 1}
+
+    receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    receiver.bind(str(tmp_path / "12345.sock"))
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    stale.bind(str(tmp_path / "54321.sock"))
+    stale.close()
+    try:
+        transport.send(b"hello")
+        assert receiver.recv(100) == b"hello"
+    finally:
+        receiver.close()
+    # The socket of a process that exited is removed
+    assert not (tmp_path / "54321.sock").exists()
@@ -0,0 +1,169 @@
+import io
+from decimal import Decimal
+
+import pytest
+
+import product_helper
+from product_helper import PRODUCT_FIELDS, import_products_csv, validate_product
+
+VALID = {
+    "productCode": "S10_1678", "productName": "1969 Harley Davidson Ultimate Chopper",
+    "productLine": "Motorcycles", "productScale": "1:10", "productVendor": "Min Lin Diecast",
+    "productDescription": "A chopper.", "quantityInStock": "7933", "buyPrice": "48.81", "MSRP": "95.70",
+}
+LINES = {"Motorcycles", "Planes"}
+
+
+class StubDatabase:
+    """Records the chunks written; product codes starting with 'BAD' fail in the database."""
+
+    def __init__(self, existing=()):
+        self.existing = {code.lower() for code in existing}
+        self.chunks = []
+
+    def get_productlines(self):
+        return [{"productLine": line} for line in sorted(LINES)]
+
+    def upsert_products(self, products):
+        self.chunks.append([product[0] for product in products])
+        failures = [(p[0], "Data too long") for p in products if p[0].startswith("BAD")]
+        written = [p for p in products if not p[0].startswith("BAD")]
+        updated = sum(p[0].lower() in self.existing for p in written)
+        return len(written) - updated, updated, failures
+
+
+def csv_file(rows, fields=PRODUCT_FIELDS):
+    lines = [",".join(fields)]
+    lines += [",".join(row.get(field, "") for field in fields) for row in rows]
+    return io.BytesIO(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+def test_valid_product():
+    product, errors = validate_product(VALID, LINES)
+    assert errors == []
+    assert product == ("S10_1678", VALID["productName"], "Motorcycles", "1:10", "Min Lin Diecast",
+                       "A chopper.", 7933, 48.81, 95.70)
+
+
+@pytest.mark.parametrize("changes, message", [
+    ({"productName": ""}, "All fields are required."),
+    ({"productCode": "X" * 16}, "Product code cannot exceed 15 characters."),
+    ({"quantityInStock": "-1"}, "Quantity in stock cannot be negative."),
+    ({"quantityInStock": "40000"}, "Quantity in stock cannot exceed 32767."),
+    ({"quantityInStock": "1.5"}, "Quantity in stock must be an integer."),
+    ({"buyPrice": "abc"}, "Buy price must be a valid number."),
+    ({"MSRP": "0"}, "MSRP must be positive."),
+    ({"MSRP": "10"}, "MSRP should not be lower than buy price."),
+    ({"productLine": "Boats"}, "Product line does not exist."),
+])
+def test_invalid_products(changes, message):
+    product, errors = validate_product({**VALID, **changes}, LINES)
+    assert product is None
+    assert message in errors
+
+
+def test_edit_form_skips_product_code():
+    product, errors = validate_product({**VALID, "productCode": ""}, LINES, with_code=False)
+    assert errors == [] and product[0] == ""
+
+
+def test_import_inserts_updates_and_reports_bad_rows():
+    db = StubDatabase(existing=["S10_1678"])
+    rows = [
+        VALID,
+        {**VALID, "productCode": "S10_9999"},
+        {**VALID, "productCode": "S10_5555", "productLine": "Boats"},
+        {**VALID, "productCode": "s10_9999"},
+        {**VALID, "productCode": "BAD_1"},
+    ]
+    report = import_products_csv(db, csv_file(rows))
+
+    assert report["rows"] == 5
+    assert (report["inserted"], report["updated"], report["failed"]) == (1, 1, 3)
+    assert report["errors"] == [
+        (4, "S10_5555", "Product line does not exist."),
+        (5, "s10_9999", "Product code appears more than once in the file."),
+        (6, "BAD_1", "Data too long"),
+    ]
+
+
+def test_import_writes_in_chunks():
+    db = StubDatabase()
+    rows = [{**VALID, "productCode": f"S{n}"} for n in range(5)]
+    report = import_products_csv(db, csv_file(rows), chunk_rows=2)
+    assert db.chunks == [["S0", "S1"], ["S2", "S3"], ["S4"]]
+    assert report["inserted"] == 5
+
+
+def test_import_rejects_missing_columns():
+    db = StubDatabase()
+    report = import_products_csv(db, csv_file([VALID], fields=PRODUCT_FIELDS[:-1]))
+    assert report["errors"] == [(1, "", "Missing columns: MSRP.")]
+    assert db.chunks == []
+
+
+def test_import_rejects_a_file_that_is_not_utf8():
+    report = import_products_csv(StubDatabase(), io.BytesIO(b"\xff\xfe\x00bad"))
+    assert report["failed"] == 1
+    assert report["errors"][0][2].startswith("Could not read the file as CSV")
+
+
+def test_import_caps_the_reported_errors(monkeypatch):
+    monkeypatch.setattr(product_helper, "IMPORT_MAX_REPORTED_ERRORS", 2)
+    rows = [{**VALID, "productCode": f"S{n}", "MSRP": "1"} for n in range(5)]
+    report = import_products_csv(StubDatabase(), csv_file(rows))
+    assert report["failed"] == 5
+    assert len(report["errors"]) == 2
+
+
+class ScriptedCursor:
+    """Answers the locking read of upsert_products with the given stored products (prices as Decimals, as from MySQL)."""
+
+    def __init__(self, stored):
+        self.stored = stored
+        self.queries = []
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        self.queries.append(" ".join(query.split()))
+
+    def fetchall(self):
+        last = self.queries[-1]
+        if last.startswith("SELECT productCode, productLine, buyPrice"):
+            return self.stored
+        return []
+
+
+def upsert(fake_mysql, stored, products):
+    from db_helper import DatabaseHandler
+
+    db = DatabaseHandler(password="test")
+    db.bus.transport = None
+    db._ensure_connection()
+    db._cursor = ScriptedCursor(stored)
+    invalidated = []
+    db._invalidate = lambda *tables: invalidated.append(tables)
+    result = db.upsert_products(products)
+    return result, db._cursor.queries, invalidated
+
+
+def product(code, line="Motorcycles", price=48.81):
+    return (code, "Name", line, "1:10", "Vendor", "Description", 10, price, 95.70)
+
+
+def test_upsert_matches_codes_case_insensitively_and_compares_prices_in_cents(fake_mysql):
+    stored = [{"productCode": "S10_1678", "productLine": "Motorcycles", "buyPrice": Decimal("48.81")}]
+    result, queries, invalidated = upsert(fake_mysql, stored, [product("s10_1678"), product("S10_9999")])
+
+    assert result == (1, 1, [])
+    assert not any("productline_daily" in query for query in queries)
+    assert invalidated == [("products",)]
+
+
+def test_upsert_rewrites_rollup_of_repriced_products(fake_mysql):
+    stored = [{"productCode": "S10_1678", "productLine": "Motorcycles", "buyPrice": Decimal("48.81")}]
+    result, queries, invalidated = upsert(fake_mysql, stored, [product("S10_1678", price=50.00)])
+
+    assert result == (0, 1, [])
+    assert any(query.startswith("SELECT DISTINCT o.orderDate") for query in queries)
+    assert invalidated == [("products", "productline_daily")]
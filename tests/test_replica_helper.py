@@ -0,0 +1,101 @@
+import mysql.connector
+import pytest
+
+from replica_helper import ReplicaPool, is_plain_read, parse_replicas
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM products",
+    "  select 1",
+    "(SELECT a FROM t) UNION (SELECT b FROM u)",
+    "WITH recent AS (SELECT * FROM orders) SELECT * FROM recent",
+    "SELECT * FROM orders WHERE comments = 'for updates'",
+])
+def test_plain_reads(query):
+    assert is_plain_read(query)
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM orders WHERE orderNumber = 1 FOR UPDATE",
+    "SELECT * FROM orders FOR SHARE",
+    "SELECT * FROM orders LOCK IN SHARE MODE",
+    "UPDATE orders SET status = 'Shipped'",
+    "INSERT INTO orders SELECT * FROM orders_archive_2003",
+    "WITH old AS (SELECT orderNumber FROM orders) DELETE FROM orders WHERE orderNumber IN (SELECT * FROM old)",
+    "DELETE FROM payments",
+])
+def test_writes_and_locking_reads_stay_on_primary(query):
+    assert not is_plain_read(query)
+
+
+@pytest.mark.parametrize("setting, expected", [
+    ("db2:3307, db3", [("db2", 3307), ("db3", 3306)]),
+    ("db2", [("db2", 3306)]),
+    (" , db2 ,", [("db2", 3306)]),
+    ("", []),
+    (None, []),
+])
+def test_parse_replicas(setting, expected):
+    assert parse_replicas(setting) == expected
+
+
+def test_parse_replicas_default_port():
+    assert parse_replicas("db2", port=3310) == [("db2", 3310)]
+
+
+def test_reads_rotate_and_skip_a_failed_replica(fake_mysql, monkeypatch, capsys):
+    import replica_helper
+
+    def connect(**args):
+        if args["host"] == "down":
+            raise mysql.connector.InterfaceError(msg="unreachable")
+        return fake_connect(**args)
+
+    fake_connect = mysql.connector.connect
+    monkeypatch.setattr(replica_helper.mysql.connector, "connect", connect)
+    pool = ReplicaPool([("a", 3306), ("down", 3306), ("b", 3306)], {"user": "u", "database": "d"})
+
+    for _ in range(4):
+        assert pool.read("SELECT 1") == (True, [])
+
+    # One connection per reachable replica, reused on its next turn
+    assert [conn.connect_args["host"] for conn in fake_mysql] == ["a", "b"]
+    assert pool.stats()["down"] == [1]
+    assert pool.reads == 4 and pool.fallbacks == 0
+    assert "down:3306 unavailable" in capsys.readouterr().out
+
+
+def test_read_falls_back_when_no_replica_is_reachable(monkeypatch, capsys):
+    import replica_helper
+
+    def connect(**args):
+        raise mysql.connector.OperationalError(msg="gone")
+
+    monkeypatch.setattr(replica_helper.mysql.connector, "connect", connect)
+    pool = ReplicaPool([("a", 3306)], {})
+    assert pool.read("SELECT 1") == (False, None)
+    assert pool.fallbacks == 1
+    # Skipped while it is down
+    assert pool.stream_args() is None
+    capsys.readouterr()
+
+
+def test_write_sends_rest_of_request_to_primary():
+    pool = ReplicaPool([("a", 3306)], {})
+    pool.begin()
+    assert not pool.primary_reads
+    pool.note_write()
+    assert pool.primary_reads
+    assert pool.end() is True
+    assert not pool.primary_reads
+
+    # Outside a request, writes do not pin reads
+    pool.note_write()
+    assert not pool.primary_reads
+
+
+def test_recent_writer_reads_from_primary():
+    pool = ReplicaPool([("a", 3306)], {})
+    pool.begin(primary=True)
+    assert pool.primary_reads
+    assert pool.end() is False
@@ -0,0 +1,26 @@
+from datetime import datetime
+
+import pytest
+
+from db_helper import decode_report_cursor, encode_report_cursor
+
+
+def test_cursor_round_trip():
+    report = {"reportDate": datetime(2024, 1, 5, 9, 30, 0), "reportId": 812}
+    cursor = encode_report_cursor(report)
+    assert cursor == "20240105093000-812"
+    assert decode_report_cursor(cursor) == (report["reportDate"], report["reportId"])
+
+
+@pytest.mark.parametrize("cursor", [
+    None,
+    "",
+    "20240105093000",
+    "20240105093000-",
+    "20240105093000-abc",
+    "20241305093000-812",
+    "2024-01-05-812",
+    "20240105093000-812-1",
+])
+def test_malformed_cursors_decode_to_none(cursor):
+    assert decode_report_cursor(cursor) is None
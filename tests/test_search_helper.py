@@ -0,0 +1,88 @@
+from decimal import Decimal
+
+from search_helper import ProductIndex, ProductSearch
+
+
+def product(code, name, line, vendor, scale="1:18", stock=10, price="10.00"):
+    return {"productCode": code, "productName": name, "productLine": line, "productScale": scale,
+            "productVendor": vendor, "quantityInStock": stock, "buyPrice": Decimal(price), "MSRP": Decimal("99")}
+
+
+PRODUCTS = [
+    product("S1", "Bravo", "Planes", "Acme", scale="1:72", stock=5, price="30.00"),
+    product("S2", "alpha", "Planes", "Zeta", stock=50, price="20.00"),
+    product("S3", "Charlie", "Ships", "Acme", stock=1, price="40.00"),
+    product("S4", "Delta", "Motorcycles", "Acme", scale="1:10", stock=99, price="10.00"),
+]
+
+
+class IndexedSearch(ProductSearch):
+    """ProductSearch over a fixed product list instead of the products table."""
+
+    def __init__(self, rows):
+        super().__init__(db=None)
+        self.rows = rows
+
+    def _load(self):
+        return ProductIndex(list(self.rows))
+
+
+def test_unfiltered_counts():
+    index = ProductIndex(PRODUCTS)
+    assert index.counts["line"] == {"Planes": 2, "Ships": 1, "Motorcycles": 1}
+    assert index.counts["vendor"] == {"Acme": 3, "Zeta": 1}
+
+
+def test_default_order_is_line_then_name():
+    result = IndexedSearch(PRODUCTS).search({})
+    assert [p["productCode"] for p in result["products"]] == ["S4", "S2", "S1", "S3"]
+    assert result["total"] == 4
+
+
+def test_facet_counts_follow_the_other_filters_only():
+    result = IndexedSearch(PRODUCTS).search({"vendor": "Acme"})
+    assert result["total"] == 3
+    # Vendor counts ignore the vendor selection, so the alternatives stay visible
+    assert dict(result["facets"]["vendor"]) == {"Acme": 3, "Zeta": 1}
+    # Line counts are those of Acme's products
+    assert dict(result["facets"]["line"]) == {"Motorcycles": 1, "Planes": 1, "Ships": 1}
+
+
+def test_filters_combine_and_sort():
+    result = IndexedSearch(PRODUCTS).search({"vendor": "Acme", "line": "Planes", "scale": ""})
+    assert [p["productCode"] for p in result["products"]] == ["S1"]
+    assert dict(result["facets"]["vendor"]) == {"Acme": 1, "Zeta": 1}
+
+    result = IndexedSearch(PRODUCTS).search({"line": "Planes"}, sort="buyPrice_desc")
+    assert [p["productCode"] for p in result["products"]] == ["S1", "S2"]
+
+
+def test_selected_value_without_matches_stays_listed():
+    result = IndexedSearch(PRODUCTS).search({"vendor": "Zeta", "line": "Ships"})
+    assert result["total"] == 0 and result["products"] == []
+    assert ("Ships", 0) in result["facets"]["line"]
+    assert ("Motorcycles", 0) not in result["facets"]["line"]
+
+
+def test_unknown_facet_value_and_sort():
+    result = IndexedSearch(PRODUCTS).search({"vendor": "Nobody"}, sort="bogus")
+    assert result["total"] == 0
+    assert result["facets"]["vendor"] == [("Acme", 3), ("Nobody", 0), ("Zeta", 1)]
+
+
+def test_pagination():
+    result = IndexedSearch(PRODUCTS).search({}, sort="stock_asc", limit=2, offset=2)
+    assert [p["productCode"] for p in result["products"]] == ["S2", "S4"]
+    assert result["total"] == 4
+
+
+def test_product_writes_rebuild_the_index():
+    search = IndexedSearch(list(PRODUCTS))
+    assert search.search({})["total"] == 4
+
+    search.rows.append(product("S5", "Echo", "Ships", "Zeta"))
+    search.invalidate({"orders"})
+    assert search.search({})["total"] == 4 and search.loads == 1
+
+    search.invalidate({"products"})
+    assert search.search({})["total"] == 5 and search.loads == 2
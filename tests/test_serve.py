@@ -0,0 +1,111 @@
+import gc
+import json
+import os
+
+import pytest
+
+import serve
+
+
+def run_in_child(body):
+    """Runs body() in a forked child and returns the JSON-serializable value it returned."""
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_end)
+            try:
+                result = {"value": body()}
+            except Exception as err:
+                result = {"error": repr(err)}
+            os.write(write_end, json.dumps(result).encode())
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as pipe:
+        result = json.loads(pipe.read() or '{"error": "no result"}')
+    os.waitpid(pid, 0)
+    assert "error" not in result, result.get("error")
+    return result["value"]
+
+
+def test_warm_up_in_forked_worker_gets_own_connection_bus_origin_and_token(fake_mysql, app_env):
+    from app import create_app, preload, warm_up
+
+    app = create_app()
+    db = app.extensions["db"]
+    preload(app)
+    assert not db.is_connected()
+    master = {"pid": os.getpid(), "origin": db.bus.origin, "token": db.data_versions.token}
+
+    def worker():
+        warm_up(app)
+        return {"pid": os.getpid(), "connection_pid": db._conn.pid,
+                "origin": db.bus.origin, "token": db.data_versions.token}
+
+    first, second = run_in_child(worker), run_in_child(worker)
+    for child in (first, second):
+        assert child["connection_pid"] == child["pid"] != master["pid"]
+        assert child["origin"] != master["origin"]
+        assert child["token"] != master["token"]
+    assert first["origin"] != second["origin"]
+    assert first["token"] != second["token"]
+
+
+def test_forked_child_never_uses_parent_connection(fake_mysql, app_env):
+    from db_helper import DatabaseHandler
+
+    db = DatabaseHandler(password="test")
+    parent_connection = db.db
+
+    def child():
+        return {"pid": os.getpid(), "connection_pid": db.db.pid,
+                "same": db.db is parent_connection, "inherited": len(db._inherited)}
+
+    result = run_in_child(child)
+    assert result["connection_pid"] == result["pid"]
+    assert not result["same"]
+    assert result["inherited"] == 1
+    # The parent keeps its own connection
+    assert db.db is parent_connection and not parent_connection.closed
+
+
+def test_main_preloads_and_keeps_gc_enabled_in_master(fake_mysql, app_env, monkeypatch):
+    started = {}
+
+    class RecordingServer:
+        def __init__(self, app, options):
+            started["app"], started["options"] = app, options
+
+        def run(self):
+            started["gc_enabled"] = gc.isenabled()
+
+    monkeypatch.setattr(serve, "BaseApplication", object)
+    monkeypatch.setattr(serve, "Server", RecordingServer, raising=False)
+    try:
+        assert serve.main(["--workers", "3"]) == 0
+    finally:
+        gc.unfreeze()
+        gc.enable()
+
+    options = started["options"]
+    assert started["gc_enabled"]
+    assert options["workers"] == 3 and options["preload_app"]
+    assert "post_fork" not in options
+    assert callable(options["post_worker_init"])
+    assert not started["app"].extensions["db"].is_connected()
+
+
+def test_main_without_gunicorn(monkeypatch, capsys):
+    monkeypatch.setattr(serve, "BaseApplication", None)
+    assert serve.main([]) == 1
+    assert "gunicorn is not installed" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("setting, expected", [("5", 5), (None, os.cpu_count() * 2 + 1)])
+def test_default_workers(monkeypatch, setting, expected):
+    if setting is None:
+        monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+    else:
+        monkeypatch.setenv("WEB_CONCURRENCY", setting)
+    assert serve.default_workers() == expected